@@ -0,0 +1,211 @@
+"""
+Eventos de uso
+--------------
+Registro de solo-agregado de lo que hacen los usuarios: menús y submenús
+pulsados, fotos vistas, calificaciones, inicios de sesión y latencia de los
+manejadores. Registrar un evento es agregar una tupla a un buffer circular en
+memoria; una tarea periódica lo vacía desde un hilo auxiliar, así que los
+manejadores nunca esperan al disco. Si el buffer se llena se descartan los
+eventos más viejos y se cuentan.
+
+Cada vaciado agrega al archivo un bloque en columnas (un miembro gzip con una
+línea JSON): instantes como desplazamientos en milisegundos, y tipo de evento y
+clave codificados contra un diccionario del bloque. Los archivos rotan por día y
+por tamaño (events-AAAAMMDD.N.jsonl.gz) y los de más de `retention_days` días
+se borran.
+
+`python analytics.py analytics --days 7` resume los últimos días: opciones más
+usadas, fotos por sede, calificación promedio por día y latencia por manejador.
+"""
+import argparse
+import gzip
+import json
+import logging
+import os
+import re
+import threading
+import time
+from collections import Counter, defaultdict, deque
+from datetime import datetime, timedelta
+from typing import Any, Deque, Dict, Iterator, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+FILE_PATTERN = re.compile(r'^(?P<prefix>[\w.-]+)-(?P<day>\d{8})\.(?P<part>\d+)\.jsonl\.gz$')
+
+# (instante, evento, usuario, clave, valor)
+Event = Tuple[float, str, int, str, Optional[float]]
+
+
+class EventLog:
+    """Buffer circular de eventos y su escritura en archivos rotados"""
+
+    def __init__(self, directory: Optional[str] = None, prefix: str = 'events', max_buffered: int = 50000,
+                 max_file_bytes: int = 16 * 1024 * 1024, retention_days: int = 90):
+        self.directory = directory
+        self.prefix = prefix
+        self.max_file_bytes = max_file_bytes
+        self.retention_days = retention_days
+        self.written = 0
+        self.dropped = 0
+        self._buffer: Deque[Event] = deque(maxlen=max_buffered)
+        self._write_lock = threading.Lock()
+
+    def configure(self, directory: Optional[str], prefix: str = 'events') -> None:
+        self.directory = directory
+        self.prefix = prefix
+
+    @property
+    def enabled(self) -> bool:
+        return bool(self.directory)
+
+    @property
+    def buffered(self) -> int:
+        return len(self._buffer)
+
+    def emit(self, event: str, user_id: Optional[int] = None, key: str = '', value: Optional[float] = None) -> None:
+        """Registra un evento; no hace nada si el registro está deshabilitado"""
+        if not self.directory:
+            return
+        buffer = self._buffer
+        if len(buffer) == buffer.maxlen:
+            self.dropped += 1
+        buffer.append((time.time(), event, user_id or 0, key, value))
+
+    def _path(self, day: str) -> str:
+        """Archivo del día con espacio libre (el último, o uno nuevo si se llenó)"""
+        parts = [int(match.group('part')) for match in map(FILE_PATTERN.match, os.listdir(self.directory))
+                 if match and match.group('prefix') == self.prefix and match.group('day') == day]
+        part = max(parts, default=0)
+        path = os.path.join(self.directory, f"{self.prefix}-{day}.{part}.jsonl.gz")
+        if os.path.exists(path) and os.path.getsize(path) >= self.max_file_bytes:
+            path = os.path.join(self.directory, f"{self.prefix}-{day}.{part + 1}.jsonl.gz")
+        return path
+
+    def _prune(self) -> None:
+        cutoff = (datetime.now() - timedelta(days=self.retention_days)).strftime('%Y%m%d')
+        for name in os.listdir(self.directory):
+            match = FILE_PATTERN.match(name)
+            if match and match.group('prefix') == self.prefix and match.group('day') < cutoff:
+                os.remove(os.path.join(self.directory, name))
+
+    def flush(self) -> int:
+        """Escribe los eventos pendientes. Pensado para correr en un hilo auxiliar"""
+        if not self.directory:
+            return 0
+        pending: List[Event] = []
+        while self._buffer:
+            pending.append(self._buffer.popleft())
+        if not pending:
+            return 0
+        with self._write_lock:
+            os.makedirs(self.directory, exist_ok=True)
+            by_day: Dict[str, List[Event]] = defaultdict(list)
+            for event in pending:
+                by_day[datetime.fromtimestamp(event[0]).strftime('%Y%m%d')].append(event)
+            for day, events in by_day.items():
+                with gzip.open(self._path(day), 'at', encoding='utf-8') as f:
+                    f.write(json.dumps(encode_block(events), ensure_ascii=False, separators=(',', ':')) + '\n')
+            self._prune()
+        self.written += len(pending)
+        return len(pending)
+
+
+def encode_block(events: List[Event]) -> Dict[str, Any]:
+    """Bloque en columnas; los tipos de evento y las claves se codifican contra un diccionario"""
+    names: Dict[str, int] = {}
+    keys: Dict[str, int] = {}
+    t0 = events[0][0]
+    return {
+        't0': round(t0, 3),
+        'dt': [round((event[0] - t0) * 1000) for event in events],
+        'event': [names.setdefault(event[1], len(names)) for event in events],
+        'user': [event[2] for event in events],
+        'key': [keys.setdefault(event[3], len(keys)) for event in events],
+        'value': [event[4] for event in events],
+        'events': list(names),
+        'keys': list(keys),
+    }
+
+
+def iter_events(directory: str, since: Optional[float] = None) -> Iterator[Dict[str, Any]]:
+    """Recorre los eventos guardados en `directory` (todos los procesos), opcionalmente desde `since`"""
+    first_day = datetime.fromtimestamp(since).strftime('%Y%m%d') if since else ''
+    matches = [FILE_PATTERN.match(name) for name in os.listdir(directory)]
+    names = sorted(match.group(0) for match in matches if match and match.group('day') >= first_day)
+    for name in names:
+        with gzip.open(os.path.join(directory, name), 'rt', encoding='utf-8') as f:
+            for number, line in enumerate(f, 1):
+                try:
+                    block = json.loads(line)
+                except ValueError as e:
+                    logger.warning(f"Bloque {number} inválido en {name}: {e}")
+                    continue
+                t0, events, keys = block['t0'], block['events'], block['keys']
+                for dt, event, user, key, value in zip(block['dt'], block['event'], block['user'],
+                                                       block['key'], block['value']):
+                    timestamp = t0 + dt / 1000
+                    if since is None or timestamp >= since:
+                        yield {'time': timestamp, 'event': events[event], 'user': user,
+                               'key': keys[key], 'value': value}
+
+
+def report(directory: str, days: int = 7, top: int = 10) -> Dict[str, Any]:
+    """Resumen de los últimos `days` días"""
+    since = time.time() - days * 86400
+    menus: Counter = Counter()
+    submenus: Counter = Counter()
+    photos: Counter = Counter()
+    sessions: Counter = Counter()
+    ratings: Dict[str, List[float]] = defaultdict(list)
+    latencies: Dict[str, List[float]] = defaultdict(list)
+    users = set()
+    for event in iter_events(directory, since):
+        kind, key, value = event['event'], event['key'], event['value']
+        users.add(event['user'])
+        if kind == 'menu':
+            menus[key] += 1
+        elif kind == 'submenu':
+            submenus[key] += 1
+        elif kind == 'photo':
+            photos[key] += 1 if value is None else int(value)
+        elif kind == 'session':
+            sessions[datetime.fromtimestamp(event['time']).strftime('%Y-%m-%d')] += 1
+        elif kind == 'rating' and value is not None:
+            ratings[datetime.fromtimestamp(event['time']).strftime('%Y-%m-%d')].append(value)
+        elif kind == 'latency' and value is not None:
+            latencies[key].append(value)
+
+    def percentile(values: List[float], fraction: float) -> float:
+        return round(values[min(len(values) - 1, int(len(values) * fraction))], 4)
+
+    return {
+        'days': days,
+        'active_users': len(users - {0}),
+        'top_menus': menus.most_common(top),
+        'top_submenus': submenus.most_common(top),
+        'photos_by_sede': dict(photos),
+        'sessions_by_day': dict(sorted(sessions.items())),
+        'rating_by_day': {day: {'count': len(values), 'average': round(sum(values) / len(values), 2)}
+                          for day, values in sorted(ratings.items())},
+        'latency_seconds': {handler: {'count': len(values), 'p50': percentile(sorted(values), 0.5),
+                                      'p95': percentile(sorted(values), 0.95)}
+                            for handler, values in sorted(latencies.items())},
+    }
+
+
+# Registro global del proceso
+ANALYTICS = EventLog()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Resumen de los eventos de uso del bot')
+    parser.add_argument('directory', nargs='?', default='analytics')
+    parser.add_argument('--days', type=int, default=7)
+    parser.add_argument('--top', type=int, default=10)
+    args = parser.parse_args()
+    print(json.dumps(report(args.directory, args.days, args.top), ensure_ascii=False, indent=2))
+
+
+if __name__ == '__main__':
+    main()
@@ -1,14 +1,20 @@
 """
 Punto de entrada para el despliegue del bot en Render.com
-Este archivo combina un servidor web simple con el bot de Telegram
+Este archivo combina un servidor web asíncrono con el bot de Telegram,
+ambos en el mismo bucle de eventos
 """
 import os
-import threading
 import asyncio
+import hmac
+import json
 import logging
+import signal
 import time
-from http.server import HTTPServer, BaseHTTPRequestHandler
-import json
+
+import profiling
+from metrics import BOT_RESTARTS, REGISTRY
+from monitoring import SlowCallbackDetector
+from web_server import AsyncHTTPServer, HTTPRequest, HTTPResponse
 
 # Configuración de logging
 logging.basicConfig(
@@ -22,102 +28,312 @@ BOT_RUNNING = False
 BOT_START_TIME = None
 BOT_INSTANCE = None
 
-class BotServerHandler(BaseHTTPRequestHandler):
-    """Manejador para el servidor HTTP simple"""
-    
-    def _set_response(self, status_code=200, content_type='application/json'):
-        self.send_response(status_code)
-        self.send_header('Content-type', content_type)
-        self.end_headers()
-    
-    def do_GET(self):
-        """Manejar solicitudes GET"""
-        if self.path == '/health' or self.path == '/healthz':
-            # Endpoint de health check para Render
-            uptime = time.time() - BOT_START_TIME if BOT_START_TIME else 0
-            response = {
-                'status': 'up',
-                'timestamp': time.time(),
-                'bot_status': 'running' if BOT_RUNNING else 'stopped',
-                'uptime_seconds': uptime
-            }
-            self._set_response()
-            self.wfile.write(json.dumps(response).encode('utf-8'))
-        else:
-            # Página principal con información básica
-            self._set_response(content_type='text/html')
-            self.wfile.write(b'<html><head><title>Bot de Clinica Medica</title></head>')
-            self.wfile.write(b'<body><h1>Bot de Telegram para Clinica Medica</h1>')
-            self.wfile.write(b'<p>El bot esta activo y ejecutandose.</p>')
-            self.wfile.write(b'<p>Visita <a href="/health">/health</a> para ver el estado del bot.</p>')
-            self.wfile.write(b'</body></html>')
-    
-    # Soporte para método HEAD (necesario para los health checks de Render)
-    def do_HEAD(self):
-        self._set_response()
-
-def run_web_server():
-    """Ejecuta el servidor web en el puerto especificado por Render"""
-    port = int(os.environ.get('PORT', 8080))
-    server_address = ('', port)
-    httpd = HTTPServer(server_address, BotServerHandler)
-    logger.info(f'Iniciando servidor HTTP en puerto {port}')
-    httpd.serve_forever()
+# Token para los endpoints /debug/* y /admin/*; si no está configurado quedan deshabilitados
+DEBUG_TOKEN = os.environ.get('DEBUG_TOKEN')
 
-async def run_bot_async():
-    """Ejecuta el bot de Telegram de forma asíncrona"""
-    global BOT_RUNNING, BOT_START_TIME, BOT_INSTANCE
-    
+# Detector de callbacks que bloquean el bucle (compartido por todos los reinicios del bot)
+SLOW_CALLBACKS = SlowCallbackDetector(threshold=float(os.environ.get('SLOW_CALLBACK_THRESHOLD', '0.25')))
+
+# Supervisor: cada cuánto revisa el bot, cuándo considera trabado getUpdates y límites del backoff
+SUPERVISOR_CHECK_INTERVAL = 5.0
+POLL_STALL_RESTART_SECONDS = float(os.environ.get('POLL_STALL_RESTART_SECONDS', '180'))
+RESTART_BACKOFF_BASE = 1.0
+RESTART_BACKOFF_MAX = 300.0
+# Tras este tiempo funcionando bien el backoff vuelve a empezar
+RESTART_BACKOFF_RESET = 600.0
+STOPPING = False
+
+# Con más de un proceso, este reparte las actualizaciones por chat (ver worker_pool.py)
+BOT_WORKERS = int(os.environ.get('BOT_WORKERS', '1'))
+
+# Con un directorio de clínicas, un solo proceso atiende a todas por webhook (ver tenants.py)
+TENANTS_DIR = os.environ.get('TENANTS_DIR')
+TENANT_IDLE_TTL = float(os.environ.get('TENANT_IDLE_TTL', '900'))
+TENANT_MAX_LOADED = int(os.environ.get('TENANT_MAX_LOADED', '10'))
+
+INDEX_HTML = (
+    '<html><head><title>Bot de Clinica Medica</title></head>'
+    '<body><h1>Bot de Telegram para Clinica Medica</h1>'
+    '<p>El bot esta activo y ejecutandose.</p>'
+    '<p>Visita <a href="/health">/health</a> para ver el estado del bot.</p>'
+    '</body></html>'
+)
+
+async def handle_index(request: HTTPRequest) -> HTTPResponse:
+    """Página principal con información básica"""
+    return HTTPResponse.html(INDEX_HTML)
+
+async def handle_health(request: HTTPRequest) -> HTTPResponse:
+    """Endpoint de health check (liveness) para Render.
+
+    Si el bucle de eventos está bloqueado esta respuesta nunca llega, que es
+    justamente lo que debe detectar la sonda.
+    """
+    uptime = time.time() - BOT_START_TIME if BOT_START_TIME else 0
+    response = {
+        'status': 'up',
+        'timestamp': time.time(),
+        'bot_status': 'running' if BOT_RUNNING else 'stopped',
+        'uptime_seconds': uptime
+    }
+    if BOT_INSTANCE is not None:
+        response['loop_lag_seconds'] = round(BOT_INSTANCE.liveness.loop_lag, 4)
+        response['max_loop_lag_seconds'] = round(BOT_INSTANCE.liveness.max_loop_lag, 4)
+    response['slow_callbacks'] = SLOW_CALLBACKS.summary()
+    return HTTPResponse.json(response)
+
+async def handle_ready(request: HTTPRequest) -> HTTPResponse:
+    """Readiness: el bucle responde y las actualizaciones de Telegram están fluyendo"""
+    if not BOT_RUNNING or BOT_INSTANCE is None:
+        return HTTPResponse.json({'ready': False, 'problems': ['bot_not_running']}, status=503)
+    ready, details = BOT_INSTANCE.liveness.readiness()
+    details['ready'] = ready
+    return HTTPResponse.json(details, status=200 if ready else 503)
+
+async def handle_metrics(request: HTTPRequest) -> HTTPResponse:
+    """Métricas en formato de texto de Prometheus"""
+    return HTTPResponse(200, REGISTRY.render().encode('utf-8'), 'text/plain; version=0.0.4; charset=utf-8')
+
+def require_debug_token(handler):
+    """Protege un endpoint de depuración con DEBUG_TOKEN (cabecera Authorization: Bearer o ?token=)"""
+    async def wrapper(request: HTTPRequest) -> HTTPResponse:
+        if not DEBUG_TOKEN:
+            return HTTPResponse(404, b'Not Found')
+        header = request.headers.get('authorization', '')
+        supplied = header[7:] if header.lower().startswith('bearer ') else request.query_param('token', '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), DEBUG_TOKEN.encode('utf-8')):
+            return HTTPResponse(401, b'Unauthorized', headers={'WWW-Authenticate': 'Bearer'})
+        return await handler(request)
+    return wrapper
+
+async def handle_debug_profile(request: HTTPRequest) -> HTTPResponse:
+    """Perfila el bucle de eventos: ?seconds=10&format=collapsed|pstats|text&interval_ms=5"""
+    seconds, error = profiling.parse_profile_params(request.query)
+    if error:
+        return HTTPResponse(400, error.encode('utf-8'))
+    interval, error = profiling.parse_interval_param(request.query)
+    if error:
+        return HTTPResponse(400, error.encode('utf-8'))
+    output = request.query_param('format', 'collapsed')
     try:
-        # Importar el módulo del bot
-        from faq_bot import ClinicBot
-        
-        logger.info("Iniciando bot de Telegram...")
-        BOT_START_TIME = time.time()
-        bot = ClinicBot()
-        BOT_INSTANCE = bot
-        
-        # Ejecutar el bot (método asíncrono)
-        await bot.application.initialize()
-        await bot.application.start()
-        await bot.application.updater.start_polling()
-        
-        logger.info("Bot de Telegram iniciado correctamente.")
+        if output == 'collapsed':
+            profiler = await profiling.sample_event_loop(seconds, interval)
+            logger.info(f"Perfil por muestreo: {profiler.sample_count} muestras en {seconds}s")
+            return HTTPResponse(200, profiler.collapsed().encode('utf-8'))
+        if output in ('pstats', 'text'):
+            stats = await profiling.cprofile_event_loop(seconds)
+            if output == 'text':
+                return HTTPResponse(200, profiling.pstats_text(stats).encode('utf-8'))
+            return HTTPResponse(200, profiling.pstats_dump(stats), 'application/octet-stream',
+                                headers={'Content-Disposition': 'attachment; filename="bot.pstats"'})
+        return HTTPResponse(400, b'format debe ser collapsed, pstats o text')
+    except profiling.ProfilerBusyError as e:
+        return HTTPResponse(409, str(e).encode('utf-8'))
+
+async def handle_debug_tracemalloc(request: HTTPRequest) -> HTTPResponse:
+    """Diferencia top-N de tracemalloc entre dos instantáneas: ?seconds=10&top=25"""
+    seconds, error = profiling.parse_profile_params(request.query)
+    if error:
+        return HTTPResponse(400, error.encode('utf-8'))
+    try:
+        top = int(request.query_param('top', '25'))
+        report = await profiling.tracemalloc_diff(seconds, max(1, min(top, 500)))
+        return HTTPResponse(200, report.encode('utf-8'))
+    except ValueError:
+        return HTTPResponse(400, b'top debe ser entero')
+    except profiling.ProfilerBusyError as e:
+        return HTTPResponse(409, str(e).encode('utf-8'))
+
+async def handle_debug_slow_callbacks(request: HTTPRequest) -> HTTPResponse:
+    """Últimos callbacks lentos con la pila capturada durante el bloqueo"""
+    return HTTPResponse.json({'summary': SLOW_CALLBACKS.summary(), 'events': list(SLOW_CALLBACKS.events)})
+
+async def handle_admin_broadcasts(request: HTTPRequest) -> HTTPResponse:
+    """GET: avance de los anuncios. POST {"texts": {"es": ..., "en": ...}}: crea uno para todos los usuarios"""
+    if BOT_INSTANCE is None or BOT_INSTANCE.broadcasts is None:
+        return HTTPResponse(503, b'Bot no iniciado')
+    if request.method != 'POST':
+        return HTTPResponse.json({'broadcasts': BOT_INSTANCE.broadcasts.summaries()})
+    try:
+        payload = json.loads(request.body or b'{}')
+        texts = {str(lang): str(text) for lang, text in payload['texts'].items()}
+        broadcast_id = BOT_INSTANCE.broadcasts.create(texts, payload.get('default_language', 'es'))
+    except (ValueError, KeyError, AttributeError, TypeError) as e:
+        return HTTPResponse(400, f"Anuncio inválido: {e}".encode('utf-8'))
+    return HTTPResponse.json({'id': broadcast_id}, status=201)
+
+async def handle_admin_broadcast_cancel(request: HTTPRequest) -> HTTPResponse:
+    """Cancela un anuncio en curso: ?id=..."""
+    if BOT_INSTANCE is None or BOT_INSTANCE.broadcasts is None:
+        return HTTPResponse(503, b'Bot no iniciado')
+    if not BOT_INSTANCE.broadcasts.cancel(request.query_param('id', '')):
+        return HTTPResponse(404, b'No hay un anuncio en curso con ese id')
+    return HTTPResponse.json({'cancelled': True})
+
+async def handle_telegram_webhook(request: HTTPRequest) -> HTTPResponse:
+    """Actualizaciones de cada clínica en el modo multi-clínica: POST /telegram/<clínica>"""
+    if not TENANTS_DIR or not BOT_RUNNING or BOT_INSTANCE is None:
+        # Telegram reintenta las actualizaciones que no recibieron un 2xx
+        return HTTPResponse(503, b'Service Unavailable')
+    return await BOT_INSTANCE.handle_webhook(request)
+
+def create_web_server() -> AsyncHTTPServer:
+    """Crea el servidor web en el puerto especificado por Render"""
+    port = int(os.environ.get('PORT', 8080))
+    server = AsyncHTTPServer(port=port)
+    server.route('/', handle_index)
+    server.route('/health', handle_health)
+    server.route('/healthz', handle_health)
+    server.route('/ready', handle_ready)
+    server.route('/metrics', handle_metrics)
+    server.route('/debug/profile', require_debug_token(handle_debug_profile))
+    server.route('/debug/tracemalloc', require_debug_token(handle_debug_tracemalloc))
+    server.route('/debug/slow-callbacks', require_debug_token(handle_debug_slow_callbacks))
+    server.route('/admin/broadcasts', require_debug_token(handle_admin_broadcasts), methods=('GET', 'POST'))
+    server.route('/admin/broadcasts/cancel', require_debug_token(handle_admin_broadcast_cancel), methods=('POST',))
+    server.route_prefix('/telegram/', handle_telegram_webhook, methods=('POST',))
+    return server
+
+async def start_bot():
+    """Crea un ClinicBot nuevo (o el pool de procesos, o el anfitrión de clínicas) y lo pone a recibir actualizaciones"""
+    global BOT_RUNNING, BOT_INSTANCE
+
+    if TENANTS_DIR:
+        from tenants import TenantHost
+
+        host = TenantHost(TENANTS_DIR, idle_ttl=TENANT_IDLE_TTL, max_loaded=TENANT_MAX_LOADED)
+        BOT_INSTANCE = host
+        await host.start()
         BOT_RUNNING = True
-        
-        # Mantener el bot en ejecución indefinidamente
-        # No llamar a stop_on_signal() aquí
-        while True:
-            await asyncio.sleep(10)  # Dormir y continuar el bucle
-    except Exception as e:
-        logger.error(f"Error al iniciar el bot de Telegram: {e}")
+        return host
+
+    if BOT_WORKERS > 1:
+        from worker_pool import WorkerPool
+
+        pool = WorkerPool(BOT_WORKERS)
+        BOT_INSTANCE = pool
+        await pool.start()
+        BOT_RUNNING = True
+        return pool
+
+    # Importar el módulo del bot
+    from faq_bot import ClinicBot, Config
+    from worker_pool import merge_shards
+
+    # Si antes corría el pool, sus archivos tienen los datos más recientes
+    merge_shards(Config.DATA_FILE)
+    bot = ClinicBot()
+    BOT_INSTANCE = bot
+    bot.liveness.start()
+    await bot.application.initialize()
+    await bot.application.start()
+    await bot.start_polling()
+    BOT_RUNNING = True
+    return bot
+
+def bot_failure(bot, started_at: float) -> str:
+    """Motivo por el que el bot debe reiniciarse, o cadena vacía si está sano"""
+    if TENANTS_DIR or BOT_WORKERS > 1:
+        reason = bot.failure()
+        if reason:
+            return reason
+    else:
+        application = bot.application
+        if not application.running:
+            return 'application_stopped'
+        if application.updater is None or not application.updater.running:
+            return 'updater_stopped'
+    last_poll = bot.liveness.last_poll or started_at
+    if bot.liveness.mode == 'polling' and time.time() - last_poll > POLL_STALL_RESTART_SECONDS:
+        return 'get_updates_stalled'
+    return ''
+
+async def run_bot_async():
+    """Ejecuta el bot de Telegram y lo reinicia con backoff exponencial si se cae o se traba"""
+    global BOT_RUNNING, BOT_START_TIME
+
+    failures = 0
+    while not STOPPING:
+        reason = ''
+        started_at = time.time()
+        try:
+            logger.info("Iniciando bot de Telegram...")
+            if BOT_START_TIME is None:
+                BOT_START_TIME = started_at
+            bot = await start_bot()
+            logger.info("Bot de Telegram iniciado correctamente.")
+
+            while not STOPPING and not reason:
+                await asyncio.sleep(SUPERVISOR_CHECK_INTERVAL)
+                reason = bot_failure(bot, started_at)
+        except Exception as e:
+            logger.error(f"Error al iniciar el bot de Telegram: {e}")
+            reason = type(e).__name__
+        if STOPPING:
+            return
+
         BOT_RUNNING = False
-        
-def bot_thread_function():
-    """Función que se ejecuta en un hilo para iniciar el bot con su propio bucle de eventos"""
-    asyncio.run(run_bot_async())
+        BOT_RESTARTS.labels(reason).inc()
+        if BOT_INSTANCE is not None:
+            try:
+                await BOT_INSTANCE.shutdown(timeout=5)
+            except Exception as e:
+                logger.error(f"Error al detener el bot antes de reiniciarlo: {e}")
 
-def main():
-    """Función principal que inicia el servidor web y el bot"""
-    # Iniciar el servidor web en un hilo
+        if time.time() - started_at > RESTART_BACKOFF_RESET:
+            failures = 0
+        delay = min(RESTART_BACKOFF_MAX, RESTART_BACKOFF_BASE * 2 ** failures)
+        failures += 1
+        logger.warning(f"Bot detenido ({reason}); reinicio #{failures} en {delay:.0f}s")
+        await asyncio.sleep(delay)
+
+async def stop_bot():
+    """Apaga el bot ordenadamente (SIGTERM de Render o Ctrl+C)"""
+    global BOT_RUNNING, STOPPING
+    # /ready deja de responder 200 mientras se drena, y el supervisor no reinicia
+    STOPPING = True
+    BOT_RUNNING = False
+    if BOT_INSTANCE is not None:
+        try:
+            await BOT_INSTANCE.shutdown()
+        except Exception as e:
+            logger.error(f"Error al detener el bot de Telegram: {e}")
+
+async def main_async():
+    """Inicia el servidor web y el bot en el mismo bucle de eventos"""
     logger.info("Iniciando la aplicación en Render.com")
-    server_thread = threading.Thread(target=run_web_server, daemon=True)
-    server_thread.start()
-    logger.info("Servidor web iniciado en segundo plano")
-    
-    # Iniciar el bot en un hilo separado con su propio bucle de eventos
-    bot_thread = threading.Thread(target=bot_thread_function, daemon=True)
-    bot_thread.start()
-    logger.info("Bot de Telegram iniciado en segundo plano")
-    
+    server = create_web_server()
+    await server.start()
+    logger.info("Servidor web iniciado")
+    SLOW_CALLBACKS.start()
+
+    stop_requested = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for signum in (signal.SIGTERM, signal.SIGINT):
+        loop.add_signal_handler(signum, stop_requested.set)
+
+    bot_task = asyncio.create_task(run_bot_async())
     logger.info("Aplicación iniciada correctamente")
-    
+
+    try:
+        # Mantener el proceso vivo hasta recibir una señal de parada
+        while not stop_requested.is_set():
+            try:
+                await asyncio.wait_for(stop_requested.wait(), 60)
+            except asyncio.TimeoutError:
+                logger.info("Aplicación en ejecución... Bot estado: " +
+                           ("ACTIVO" if BOT_RUNNING else "DETENIDO"))
+        logger.info("Señal de parada recibida, deteniendo el bot...")
+        await stop_bot()
+    finally:
+        bot_task.cancel()
+        SLOW_CALLBACKS.stop()
+        await server.stop()
+
+def main():
+    """Función principal que inicia el servidor web y el bot"""
     try:
-        # Mantener el proceso principal vivo
-        while True:
-            time.sleep(60)
-            logger.info("Aplicación en ejecución... Bot estado: " + 
-                       ("ACTIVO" if BOT_RUNNING else "DETENIDO"))
+        asyncio.run(main_async())
     except KeyboardInterrupt:
         logger.info("Deteniendo la aplicación...")
 
@@ -0,0 +1,247 @@
+"""
+Calendario de citas y reservas de turnos
+----------------------------------------
+El calendario guarda los turnos ofrecidos por la clínica y el gestor de reservas
+controla quién los ocupa. Cada turno tiene su propio candado (por franjas), de
+modo que dos usuarios que pulsan el mismo turno compiten solo entre ellos y el
+resto del calendario sigue libre. Las reservas temporales vencen con una rueda
+de temporizadores y la confirmación es una operación compare-and-set.
+"""
+import bisect
+import hashlib
+import logging
+import secrets
+import threading
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Callable, Dict, Iterator, List, Optional
+
+from timer_wheel import TimerWheel
+
+if TYPE_CHECKING:
+    from faq_bot import UserDataManager
+
+logger = logging.getLogger(__name__)
+
+
+class AppointmentCalendar:
+    """Turnos disponibles de la clínica, persistidos en la sección 'calendar'"""
+
+    def __init__(self, storage: 'UserDataManager'):
+        self.storage = storage
+        # slot_id -> {'doctor', 'specialty', 'sede', 'start', 'end'}
+        self.slots: Dict[str, Dict[str, Any]] = storage.get_section('calendar')
+        # Índice ordenado por hora de inicio, reconstruido solo cuando cambia el calendario
+        self._index: List[tuple] = []
+        self._index_dirty = True
+        # Se incrementa con cada cambio, para que los índices derivados sepan cuándo reconstruirse
+        self.version = 0
+        storage.add_reload_listener(self.reload)
+
+    @staticmethod
+    def make_slot_id(doctor: str, start: str) -> str:
+        """Genera un identificador corto y estable para un turno (cabe en callback_data)"""
+        return hashlib.blake2b(f"{doctor}|{start}".encode('utf-8'), digest_size=6).hexdigest()
+
+    def get_slot(self, slot_id: str) -> Optional[Dict[str, Any]]:
+        """Obtiene los datos de un turno"""
+        return self.slots.get(slot_id)
+
+    def upsert_slot(self, slot_id: str, data: Dict[str, Any]) -> bool:
+        """Inserta o actualiza un turno. Devuelve True si hubo cambios"""
+        if self.slots.get(slot_id) == data:
+            return False
+        self.slots[slot_id] = data
+        self._index_dirty = True
+        self.version += 1
+        return True
+
+    def remove_slot(self, slot_id: str) -> bool:
+        """Elimina un turno del calendario"""
+        if self.slots.pop(slot_id, None) is None:
+            return False
+        self._index_dirty = True
+        self.version += 1
+        return True
+
+    def reload(self) -> None:
+        """Invalida los índices cuando otro proceso cambió el calendario"""
+        self._index_dirty = True
+        self.version += 1
+
+    def iter_from(self, start: str) -> Iterator[str]:
+        """Recorre los identificadores de turno en orden de inicio a partir de `start` (ISO)"""
+        if self._index_dirty:
+            self._index = sorted((slot['start'], slot_id) for slot_id, slot in self.slots.items())
+            self._index_dirty = False
+        index = self._index
+        for position in range(bisect.bisect_left(index, (start, '')), len(index)):
+            slot_id = index[position][1]
+            # El índice puede quedar desfasado si se modifica el calendario durante el recorrido
+            if slot_id in self.slots:
+                yield slot_id
+
+    def format_slot(self, slot_id: str) -> str:
+        """Texto breve de un turno para mostrar en un botón"""
+        slot = self.slots.get(slot_id)
+        if not slot:
+            return slot_id
+        start = datetime.fromisoformat(slot['start'])
+        return f"{start:%d/%m %H:%M} · {slot.get('doctor', '')}"
+
+
+class ReservationManager:
+    """Reservas temporales (holds) y confirmadas de turnos, con candados por turno"""
+
+    FREE = 'free'
+    HELD = 'held'
+    BOOKED = 'booked'
+
+    def __init__(self, storage: 'UserDataManager', hold_ttl: float = 120.0,
+                 lock_stripes: int = 256, autosave: bool = True):
+        self.storage = storage
+        self.hold_ttl = hold_ttl
+        self.autosave = autosave
+        # slot_id -> {'status', 'user_id', 'token', 'version', 'expires_at'}
+        self.states: Dict[str, Dict[str, Any]] = storage.get_section('reservations')
+        self.wheel = TimerWheel(tick=1.0, size=max(64, int(hold_ttl) * 2))
+        self._locks = [threading.Lock() for _ in range(lock_stripes)]
+        # Funciones avisadas cuando un turno queda libre: listener(evento, slot_id)
+        self._listeners: List[Callable[[str, str], None]] = []
+
+        self._restore_holds()
+        storage.add_reload_listener(self._restore_holds)
+
+    def _restore_holds(self) -> None:
+        """Programa en la rueda los vencimientos de las reservas temporales persistidas"""
+        for slot_id in self.wheel.keys():
+            state = self.states.get(slot_id)
+            if not state or state.get('status') != self.HELD:
+                self.wheel.cancel(slot_id)
+        for slot_id, state in self.states.items():
+            if state.get('status') == self.HELD:
+                self.wheel.schedule(slot_id, state['expires_at'])
+
+    def _lock_for(self, slot_id: str) -> threading.Lock:
+        return self._locks[hash(slot_id) % len(self._locks)]
+
+    def _persist(self) -> None:
+        if self.autosave:
+            self.storage.save_data()
+
+    def add_listener(self, listener: Callable[[str, str], None]) -> None:
+        """Registra una función para los eventos 'cancelled', 'released' y 'expired'"""
+        self._listeners.append(listener)
+
+    def _notify(self, event: str, slot_id: str) -> None:
+        for listener in self._listeners:
+            try:
+                listener(event, slot_id)
+            except Exception as e:
+                logger.error(f"Error en listener de reservas ({event} {slot_id}): {e}")
+
+    def status(self, slot_id: str, now: Optional[float] = None) -> str:
+        """Estado efectivo de un turno, considerando reservas temporales vencidas"""
+        now = time.time() if now is None else now
+        state = self.states.get(slot_id)
+        if not state:
+            return self.FREE
+        if state['status'] == self.HELD and state['expires_at'] <= now:
+            return self.FREE
+        return state['status']
+
+    def is_available(self, slot_id: str, now: Optional[float] = None) -> bool:
+        """Indica si un turno puede reservarse"""
+        return self.status(slot_id, now) == self.FREE
+
+    def hold(self, slot_id: str, user_id: int, now: Optional[float] = None,
+             ttl: Optional[float] = None) -> Optional[str]:
+        """Reserva temporalmente un turno. Devuelve el token de la reserva o None si está ocupado"""
+        now = time.time() if now is None else now
+        with self._lock_for(slot_id):
+            state = self.states.get(slot_id)
+            if state:
+                if state['status'] == self.BOOKED:
+                    return None
+                if state['status'] == self.HELD and state['expires_at'] > now \
+                        and state['user_id'] != user_id:
+                    return None
+            version = state['version'] + 1 if state else 1
+            token = secrets.token_hex(4)
+            expires_at = now + (self.hold_ttl if ttl is None else ttl)
+            self.states[slot_id] = {
+                'status': self.HELD,
+                'user_id': user_id,
+                'token': token,
+                'version': version,
+                'expires_at': expires_at
+            }
+        self.wheel.schedule(slot_id, expires_at)
+        self._persist()
+        return token
+
+    def confirm(self, slot_id: str, user_id: int, token: str,
+                now: Optional[float] = None) -> bool:
+        """Confirma una reserva temporal (compare-and-set sobre usuario, token y vigencia)"""
+        now = time.time() if now is None else now
+        with self._lock_for(slot_id):
+            state = self.states.get(slot_id)
+            if not state or state['status'] != self.HELD or state['token'] != token \
+                    or state['user_id'] != user_id or state['expires_at'] <= now:
+                return False
+            self.states[slot_id] = {
+                'status': self.BOOKED,
+                'user_id': user_id,
+                'token': token,
+                'version': state['version'] + 1,
+                'booked_at': now
+            }
+        self.wheel.cancel(slot_id)
+        self._persist()
+        return True
+
+    def release(self, slot_id: str, user_id: int, token: str) -> bool:
+        """Libera una reserva temporal antes de que venza"""
+        with self._lock_for(slot_id):
+            state = self.states.get(slot_id)
+            if not state or state['status'] != self.HELD or state['token'] != token \
+                    or state['user_id'] != user_id:
+                return False
+            del self.states[slot_id]
+        self.wheel.cancel(slot_id)
+        self._persist()
+        self._notify('released', slot_id)
+        return True
+
+    def cancel_booking(self, slot_id: str, user_id: int) -> bool:
+        """Cancela una cita confirmada y deja el turno libre"""
+        with self._lock_for(slot_id):
+            state = self.states.get(slot_id)
+            if not state or state['status'] != self.BOOKED or state['user_id'] != user_id:
+                return False
+            del self.states[slot_id]
+        self._persist()
+        self._notify('cancelled', slot_id)
+        return True
+
+    def expire_holds(self, now: Optional[float] = None) -> List[str]:
+        """Libera las reservas temporales vencidas. Trabajo proporcional a lo vencido"""
+        now = time.time() if now is None else now
+        expired = []
+        for slot_id, _ in self.wheel.advance(now):
+            with self._lock_for(slot_id):
+                state = self.states.get(slot_id)
+                if state and state['status'] == self.HELD and state['expires_at'] <= now:
+                    del self.states[slot_id]
+                    expired.append(slot_id)
+        if expired:
+            logger.info(f"{len(expired)} reservas temporales vencidas liberadas")
+            self._persist()
+            for slot_id in expired:
+                self._notify('expired', slot_id)
+        return expired
+
+    def bookings_for_user(self, user_id: int) -> List[str]:
+        """Turnos confirmados de un usuario"""
+        return [slot_id for slot_id, state in list(self.states.items())
+                if state['status'] == self.BOOKED and state['user_id'] == user_id]
@@ -0,0 +1,159 @@
+"""
+Atraso de actualizaciones al arrancar
+-------------------------------------
+Tras una suspensión de Render o una caída, Telegram guarda las actualizaciones
+que llegaron mientras el bot no estaba. En vez de procesarlas una por una con
+el polling normal, al arrancar se piden todas de una vez con getUpdates sin
+espera y se agrupan por chat:
+
+- De cada tanda seguida de navegación (/start, /menu, /help, /contacto, /info
+  y botones de menú, submenú, fotos, ubicaciones, directorio o retomar) queda
+  solo el último /start, para que un usuario nuevo empiece la conversación, y
+  el último toque o comando posterior a él.
+- De cada tanda seguida de textos libres queda solo el último.
+- El resto (nombre e idioma elegidos entre medio, reservas, lista de espera,
+  calificaciones, ubicaciones compartidas, consultas inline) se conserva y
+  corta las tandas, así que el orden de la conversación no cambia.
+
+Los callback_query descartados se responden en segundo plano, sin texto, para
+quitarles el reloj de carga (los de más de 15 minutos Telegram ya no los
+acepta y el error se ignora). Lo que queda se encola en la Application en el
+orden original, se confirma el último update_id y recién entonces empieza el
+polling normal.
+"""
+import asyncio
+import logging
+from typing import Dict, List, Optional, Tuple
+
+from telegram import CallbackQuery, Update
+from telegram.error import RetryAfter, TelegramError
+from telegram.ext import Application
+
+from metrics import BACKLOG_UPDATES
+from update_processor import CANCELLABLE_PREFIXES, chat_key
+
+logger = logging.getLogger(__name__)
+
+START = 'start'
+NAVIGATION = 'navigation'
+TEXT = 'text'
+
+NAVIGATION_COMMANDS = ('/menu', '/help', '/contacto', '/info')
+NAVIGATION_PREFIXES = CANCELLABLE_PREFIXES + ('resume_',)
+FETCH_LIMIT = 100  # Máximo de getUpdates por llamada
+ANSWER_BATCH = 30  # Respuestas a callback_query descartados en paralelo
+
+
+def action_kind(update: Update) -> Optional[str]:
+    """START, NAVIGATION o TEXT si la actualización se puede agrupar; None si siempre se procesa"""
+    message = update.message
+    if message is not None and message.text:
+        command = message.text.split(maxsplit=1)[0].split('@')[0]
+        if command == '/start':
+            return START
+        if command in NAVIGATION_COMMANDS:
+            return NAVIGATION
+        return None if command.startswith('/') else TEXT
+    query = update.callback_query
+    if query is not None and (query.data or '').startswith(NAVIGATION_PREFIXES):
+        return NAVIGATION
+    return None
+
+
+def _collapse(run: List[Update], kinds: List[str]) -> List[Update]:
+    """Lo que queda de una tanda seguida de navegación o de textos"""
+    if kinds[0] == TEXT:
+        return run[-1:]
+    starts = [index for index, kind in enumerate(kinds) if kind == START]
+    if not starts:
+        return run[-1:]
+    last_start = starts[-1]
+    if last_start == len(run) - 1:
+        return [run[last_start]]
+    return [run[last_start], run[-1]]
+
+
+def coalesce(updates: List[Update]) -> Tuple[List[Update], List[Update]]:
+    """Separa el atraso en (actualizaciones a procesar, descartadas), cada lista por update_id"""
+    chats: Dict[Optional[int], List[Update]] = {}
+    for update in updates:
+        chats.setdefault(chat_key(update), []).append(update)
+
+    kept: List[Update] = []
+    for chat_id, chat_updates in chats.items():
+        if chat_id is None:
+            kept.extend(chat_updates)
+            continue
+        run: List[Update] = []
+        kinds: List[str] = []
+        for update in chat_updates:
+            kind = action_kind(update)
+            if run and (kind is None or (kind == TEXT) != (kinds[0] == TEXT)):
+                kept.extend(_collapse(run, kinds))
+                run, kinds = [], []
+            if kind is None:
+                kept.append(update)
+            else:
+                run.append(update)
+                kinds.append(kind)
+        if run:
+            kept.extend(_collapse(run, kinds))
+
+    kept_ids = {update.update_id for update in kept}
+    kept.sort(key=lambda update: update.update_id)
+    dropped = [update for update in updates if update.update_id not in kept_ids]
+    return kept, dropped
+
+
+async def _answer_stale(queries: List[CallbackQuery]) -> None:
+    """Responde sin texto los callback_query descartados, de a ANSWER_BATCH"""
+    for start in range(0, len(queries), ANSWER_BATCH):
+        results = await asyncio.gather(*(query.answer() for query in queries[start:start + ANSWER_BATCH]),
+                                       return_exceptions=True)
+        for result in results:
+            BACKLOG_UPDATES.labels('answered' if result is True else 'answer_failed').inc()
+
+
+async def _fetch(application: Application, offset: Optional[int]) -> List[Update]:
+    while True:
+        try:
+            return list(await application.bot.get_updates(offset=offset, limit=FETCH_LIMIT, timeout=0))
+        except RetryAfter as e:
+            await asyncio.sleep(float(e.retry_after))
+
+
+async def catch_up(application: Application, max_updates: int = 10000) -> int:
+    """Pide el atraso pendiente, encola lo que sigue siendo relevante y lo confirma; devuelve cuántas había"""
+    updates: List[Update] = []
+    offset: Optional[int] = None
+    confirmed: Optional[int] = None  # Offset de la última llamada exitosa: lo anterior ya está confirmado
+    try:
+        while len(updates) < max_updates:
+            batch = await _fetch(application, offset)
+            confirmed = offset
+            if not batch:
+                break
+            updates.extend(batch)
+            offset = batch[-1].update_id + 1
+        if offset != confirmed:
+            # Se llegó al máximo: confirmar lo recibido; el resto lo trae el polling normal
+            await application.bot.get_updates(offset=offset, limit=1, timeout=0)
+            confirmed = offset
+    except TelegramError as e:
+        # Lo que no se llegó a confirmar lo vuelve a entregar el polling normal
+        logger.warning(f"No se pudo recuperar el atraso de actualizaciones: {e}")
+        updates = [update for update in updates if confirmed is not None and update.update_id < confirmed]
+    if not updates:
+        return 0
+
+    kept, dropped = coalesce(updates)
+    stale = [update.callback_query for update in dropped if update.callback_query is not None]
+    if stale:
+        application.create_task(_answer_stale(stale), name='backlog:answer_stale')
+    for update in kept:
+        await application.update_queue.put(update)
+    BACKLOG_UPDATES.labels('kept').inc(len(kept))
+    BACKLOG_UPDATES.labels('coalesced').inc(len(dropped))
+    logger.info(f"Atraso al arrancar: {len(updates)} actualizaciones, se procesan {len(kept)} "
+                f"y se descartan {len(dropped)} ({len(stale)} botones respondidos en segundo plano)")
+    return len(updates)
@@ -0,0 +1,306 @@
+"""
+Benchmark de punta a punta de ClinicBot
+---------------------------------------
+Levanta el servidor falso de la Bot API (benchmarks/fake_bot_api.py) en otro
+proceso, con usuarios sintéticos que recorren /start → nombre → idioma → menú →
+submenú (fotos, ubicaciones, horarios...) → volver, y corre ClinicBot contra él
+por polling. Cada usuario reacciona al último teclado que le mandó el bot.
+Con --workers N corre el pool de procesos (worker_pool.py) en lugar de un solo
+ClinicBot, para comparar el rendimiento por cantidad de núcleos.
+
+La latencia se mide desde que getUpdates entrega la actualización hasta la
+última llamada del bot a la API para ese chat antes de que el usuario reaccione.
+
+Uso: python benchmarks/bench_e2e.py [--users 2000] [--concurrency 200] [--latency-ms 0] [--rate-429 0] [--workers 1]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import random
+import sys
+import time
+from typing import Any, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI, find_free_port, run_clinic_bot, serve  # noqa: E402
+
+FIRST_USER_ID = 1_000_000
+NAMES = ['Ana', 'Luis', 'Marta', 'Jorge', 'Sofía', 'Pedro', 'Lucía', 'Diego']
+NAV_PREFIX = 'nav_'  # Botones del menú declarativo (ver menu.py)
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+class SyntheticUser:
+    """Estado de un usuario sintético"""
+
+    __slots__ = ('user_id', 'name', 'visits', 'named', 'keyboard', 'message', 'last_update_id',
+                 'last_response', 'timer', 'steps')
+
+    def __init__(self, user_id: int, name: str):
+        self.user_id = user_id
+        self.name = name
+        self.visits = 0
+        self.named = False
+        self.keyboard: List[str] = []
+        self.message: Optional[Dict[str, Any]] = None
+        self.last_update_id: Optional[int] = None
+        self.last_response: Optional[float] = None
+        self.timer: Optional[asyncio.TimerHandle] = None
+        self.steps = 0
+
+
+class SyntheticUsers:
+    """Genera las actualizaciones de los usuarios en respuesta a los mensajes del bot"""
+
+    def __init__(self, api: FakeBotAPI, users: int, concurrency: int, submenus: int,
+                 think: float, stall: float = 5.0, max_steps: int = 40, seed: int = 42):
+        self.api = api
+        self.total = users
+        self.concurrency = concurrency
+        self.submenus = submenus
+        self.think = think
+        self.stall = stall
+        self.max_steps = max_steps
+        self.rng = random.Random(seed)
+        self.active: Dict[int, SyntheticUser] = {}
+        self.started = 0
+        self.completed = 0
+        self.abandoned = 0
+        self.latencies: List[float] = []
+        self.first_update: Optional[float] = None
+        self.last_completion: Optional[float] = None
+        api.add_listener(self.on_bot_call)
+        api.extra_stats = self.stats
+
+    def user_payload(self, user: SyntheticUser) -> Dict[str, Any]:
+        return {'id': user.user_id, 'is_bot': False, 'first_name': user.name, 'language_code': 'es'}
+
+    def chat_payload(self, user: SyntheticUser) -> Dict[str, Any]:
+        return {'id': user.user_id, 'type': 'private', 'first_name': user.name}
+
+    def send_text(self, user: SyntheticUser, text: str) -> None:
+        message = {
+            'message_id': self.api.message_id(),
+            'date': int(time.time()),
+            'chat': self.chat_payload(user),
+            'from': self.user_payload(user),
+            'text': text,
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        self.push(user, {'message': message})
+
+    def press(self, user: SyntheticUser, data: str) -> None:
+        message = dict(user.message or {}, chat=self.chat_payload(user))
+        self.push(user, {'callback_query': {
+            'id': str(self.api.message_id()),
+            'from': self.user_payload(user),
+            'chat_instance': str(user.user_id),
+            'data': data,
+            'message': message,
+        }})
+
+    def push(self, user: SyntheticUser, update: Dict[str, Any]) -> None:
+        user.steps += 1
+        user.last_response = None
+        user.keyboard = []
+        user.last_update_id = self.api.push_update(update)
+        if self.first_update is None:
+            self.first_update = time.perf_counter()
+
+    def start_users(self) -> None:
+        while self.started < self.total and len(self.active) < self.concurrency:
+            user = SyntheticUser(FIRST_USER_ID + self.started, self.rng.choice(NAMES))
+            self.started += 1
+            self.active[user.user_id] = user
+            self.send_text(user, '/start')
+
+    def finish(self, user: SyntheticUser, abandoned: bool = False) -> None:
+        del self.active[user.user_id]
+        if abandoned:
+            self.abandoned += 1
+        else:
+            self.completed += 1
+        self.last_completion = time.perf_counter()
+        self.start_users()
+
+    def on_bot_call(self, method: str, params: Dict[str, Any], result: Any) -> None:
+        try:
+            user = self.active.get(int(params.get('chat_id') or 0))
+        except (TypeError, ValueError):
+            return
+        if user is None:
+            return
+        user.last_response = time.perf_counter()
+        markup = params.get('reply_markup')
+        if isinstance(markup, dict) and 'inline_keyboard' in markup:
+            user.keyboard = [button['callback_data'] for row in markup['inline_keyboard']
+                             for button in row if 'callback_data' in button]
+            if isinstance(result, dict):
+                user.message = result
+        # El bot puede mandar varios mensajes por actualización: se reacciona cuando deja de hablar
+        if user.timer is not None:
+            user.timer.cancel()
+        user.timer = asyncio.get_running_loop().call_later(self.think, self.react, user)
+
+    def react(self, user: SyntheticUser) -> None:
+        user.timer = None
+        if user.user_id not in self.active:
+            return
+        keyboard = user.keyboard
+        if not keyboard and user.named:
+            # Todavía no llegó el teclado (p. ej. entre deleteMessage y editMessageText)
+            silence = time.perf_counter() - (user.last_response or 0.0)
+            if silence < self.stall:
+                user.timer = asyncio.get_running_loop().call_later(self.stall - silence, self.react, user)
+                return
+        delivered = self.api.delivered_at.get(user.last_update_id)
+        if delivered is not None and user.last_response is not None:
+            self.latencies.append(user.last_response - delivered)
+        if user.steps >= self.max_steps:
+            self.finish(user, abandoned=True)
+            return
+
+        if not keyboard:
+            if user.named:
+                self.finish(user, abandoned=True)
+            else:
+                user.named = True
+                self.send_text(user, user.name)
+            return
+        if 'resume_no' in keyboard:
+            self.press(user, 'resume_no')
+            return
+        languages = [data for data in keyboard if data.startswith('lang_')]
+        if languages:
+            self.press(user, self.rng.choice(languages))
+            return
+        # El menú principal es el único con opciones y sin botón de volver
+        menu = [data for data in keyboard if data.startswith(NAV_PREFIX)]
+        if menu and 'back_to_main' not in keyboard:
+            if user.visits >= self.submenus:
+                self.finish(user)
+            else:
+                self.press(user, self.rng.choice(menu))
+            return
+        options = menu
+        if options and user.visits < self.submenus:
+            user.visits += 1
+            self.press(user, self.rng.choice(options))
+        elif 'back_to_main' in keyboard:
+            self.press(user, 'back_to_main')
+        else:
+            self.press(user, self.rng.choice(keyboard))
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.first_update is not None and self.last_completion is not None:
+            elapsed = self.last_completion - self.first_update
+        return {
+            'users_started': self.started,
+            'users_completed': self.completed,
+            'users_abandoned': self.abandoned,
+            'done': self.completed + self.abandoned >= self.total,
+            'elapsed_seconds': elapsed,
+            'latency_p50_ms': round(percentile(self.latencies, 0.50) * 1000, 3),
+            'latency_p99_ms': round(percentile(self.latencies, 0.99) * 1000, 3),
+            'latency_max_ms': round(max(self.latencies, default=0.0) * 1000, 3),
+        }
+
+
+def run_fake_api(port: int, options: Dict[str, Any]) -> None:
+    """Proceso del servidor falso: así su costo no compite con el bot por el GIL"""
+    async def main():
+        api = FakeBotAPI(latency=options['latency_ms'] / 1000, rate_429=options['rate_429'])
+        users = SyntheticUsers(api, options['users'], options['concurrency'], options['submenus'],
+                               options['think_ms'] / 1000)
+        await serve(api, port)
+        users.start_users()
+        await asyncio.Event().wait()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
+
+
+async def run_benchmark(args: argparse.Namespace, port: int) -> Dict[str, Any]:
+    from metrics import SAVE_DURATION
+
+    stats = await run_clinic_bot(port, args.timeout, workers=args.workers)
+    # Con el pool los guardados ocurren en los procesos hijos y no se ven aquí
+    save = SAVE_DURATION.labels()
+    updates = stats['updates_delivered']
+    api_calls = sum(stats['calls'].values())
+    elapsed = stats['elapsed_seconds'] or 0.0
+    return {
+        'users': args.users,
+        'concurrency': args.concurrency,
+        'submenus_per_user': args.submenus,
+        'workers': args.workers,
+        'injected_latency_ms': args.latency_ms,
+        'injected_429_rate': args.rate_429,
+        'users_completed': stats['users_completed'],
+        'users_abandoned': stats['users_abandoned'],
+        'timed_out': not stats['done'],
+        'elapsed_seconds': round(elapsed, 3),
+        'updates': updates,
+        'updates_per_sec': round(updates / elapsed, 1) if elapsed else 0.0,
+        'latency_p50_ms': stats['latency_p50_ms'],
+        'latency_p99_ms': stats['latency_p99_ms'],
+        'latency_max_ms': stats['latency_max_ms'],
+        'api_calls': api_calls,
+        'api_calls_per_update': round(api_calls / updates, 2) if updates else 0.0,
+        'api_calls_by_method': stats['calls'],
+        'throttled_429': stats['throttled'],
+        'save_data_calls': save.count if args.workers == 1 else None,
+        'save_data_mean_ms': round(save.sum / save.count * 1000, 3) if save.count else None,
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--users', type=int, default=2000)
+    parser.add_argument('--concurrency', type=int, default=200, help='usuarios recorriendo el bot a la vez')
+    parser.add_argument('--submenus', type=int, default=2, help='submenús que visita cada usuario')
+    parser.add_argument('--think-ms', type=float, default=20.0,
+                        help='silencio del bot que espera un usuario antes de reaccionar')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='latencia agregada a cada llamada a la API')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fracción de llamadas respondidas con 429')
+    parser.add_argument('--workers', type=int, default=1, help='procesos del bot (pool de worker_pool.py si es > 1)')
+    parser.add_argument('--timeout', type=float, default=600.0)
+    parser.add_argument('--output', help='archivo donde guardar el JSON además de imprimirlo')
+    parser.add_argument('--verbose', action='store_true', help='mostrar advertencias y errores del bot')
+    args = parser.parse_args()
+
+    # El bot registra cada guardado en INFO y cada 429 inyectado como error; por defecto solo el JSON
+    level = logging.WARNING if args.verbose else logging.CRITICAL
+    logging.basicConfig(level=level)
+    logging.getLogger().setLevel(level)
+
+    port = find_free_port()
+    server = multiprocessing.get_context('spawn').Process(
+        target=run_fake_api, args=(port, vars(args)), daemon=True)
+    server.start()
+    try:
+        result = asyncio.run(run_benchmark(args, port))
+    finally:
+        server.terminate()
+        server.join()
+
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
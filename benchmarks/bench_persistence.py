@@ -0,0 +1,210 @@
+"""
+Benchmark de escalabilidad de la persistencia
+---------------------------------------------
+Puebla UserDataManager con N usuarios y estados de conversación y mide, para
+cada backend registrado en backends() y cada tamaño:
+
+- latencia de update_user / save_conversation_state (cada una guarda todo),
+- duración de save_data y tamaño de la instantánea,
+- duración de load_data al arrancar,
+- pico de memoria residente (cada caso corre en su propio proceso).
+
+Con --baseline compara contra un resultado anterior y termina con código 1 si
+alguna métrica empeora más que --tolerance; --max-update-p99-ms fija además un
+límite absoluto.
+
+Uso: python benchmarks/bench_persistence.py [--sizes 1000,10000,100000,1000000] [--output base.json]
+     python benchmarks/bench_persistence.py --baseline base.json [--tolerance 0.25]
+"""
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import queue
+import random
+import resource
+import sys
+import tempfile
+import time
+from datetime import datetime
+from typing import Any, Dict, List
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+# Métricas comparadas contra la línea base y su piso absoluto (por debajo es ruido)
+COMPARED_METRICS = {
+    'update_p50_ms': 1.0,
+    'update_p99_ms': 2.0,
+    'save_ms': 2.0,
+    'load_ms': 2.0,
+    'snapshot_bytes': 64 * 1024,
+    'peak_rss_mb': 8.0,
+}
+
+
+def backends() -> Dict[str, Any]:
+    """Backends de persistencia a comparar; un backend nuevo se registra aquí"""
+    from faq_bot import UserDataManager
+    return {'pickle': UserDataManager}
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def populate(manager, users: int, rng: random.Random) -> None:
+    """Usuarios y estados con la forma que deja el bot (sin guardar uno por uno)"""
+    now = datetime.now().isoformat()
+    contexts = ['Horarios', 'Contacto', 'Servicios', 'Ubicación', 'Ver fotos']
+    for user_id in range(1, users + 1):
+        manager.user_data[user_id] = {
+            'name': f'Usuario {user_id}',
+            'language': rng.choice(('es', 'en')),
+            'last_active': now,
+        }
+        if rng.random() < 0.3:
+            manager.conversation_states[user_id] = {
+                'state': rng.randrange(2, 6),
+                'context': rng.choice(contexts),
+                'timestamp': now,
+            }
+
+
+def run_case(backend: str, users: int, updates: int, budget: float, workdir: str, results) -> None:
+    """Mide un backend con un tamaño; corre en un proceso propio para medir su pico de memoria"""
+    logging.disable(logging.INFO)
+    from faq_bot import Config
+
+    Config.DATA_FILE = os.path.join(workdir, f'{backend}_{users}.dat')
+    manager_class = backends()[backend]
+    rng = random.Random(42)
+
+    manager = manager_class()
+    populate(manager, users, rng)
+    started = time.perf_counter()
+    manager.save_data()
+    save_seconds = time.perf_counter() - started
+    snapshot_bytes = os.path.getsize(Config.DATA_FILE)
+
+    # Cada actualización de un usuario reescribe todo el archivo
+    latencies: List[float] = []
+    deadline = time.perf_counter() + budget
+    for number in range(updates):
+        user_id = rng.randrange(1, users + 1)
+        began = time.perf_counter()
+        if number % 2:
+            manager.save_conversation_state(user_id, 3, 'Horarios')
+        else:
+            manager.update_user(user_id, {'language': rng.choice(('es', 'en'))})
+        latencies.append(time.perf_counter() - began)
+        if len(latencies) >= 3 and time.perf_counter() > deadline:
+            break
+
+    del manager
+    started = time.perf_counter()
+    reloaded = manager_class()
+    load_seconds = time.perf_counter() - started
+    if len(reloaded.user_data) != users:
+        raise RuntimeError(f"Se cargaron {len(reloaded.user_data)} usuarios de {users}")
+
+    results.put({
+        'backend': backend,
+        'users': users,
+        'update_samples': len(latencies),
+        'update_p50_ms': round(percentile(latencies, 0.50) * 1000, 3),
+        'update_p99_ms': round(percentile(latencies, 0.99) * 1000, 3),
+        'save_ms': round(save_seconds * 1000, 3),
+        'load_ms': round(load_seconds * 1000, 3),
+        'snapshot_bytes': snapshot_bytes,
+        # ru_maxrss está en KiB en Linux
+        'peak_rss_mb': round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1),
+    })
+
+
+def compare(results: List[Dict[str, Any]], baseline: List[Dict[str, Any]], tolerance: float) -> List[str]:
+    """Métricas que empeoraron más que `tolerance` respecto de la línea base"""
+    previous = {(case['backend'], case['users']): case for case in baseline}
+    regressions = []
+    for case in results:
+        base = previous.get((case['backend'], case['users']))
+        if base is None:
+            continue
+        for metric, floor in COMPARED_METRICS.items():
+            old, new = base.get(metric), case.get(metric)
+            if old is None or new is None:
+                continue
+            if new > old * (1 + tolerance) and new - old > floor:
+                regressions.append(f"{case['backend']}/{case['users']}: {metric} {old} -> {new}")
+    return regressions
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sizes', default='1000,10000,100000,1000000',
+                        help='cantidades de usuarios separadas por comas')
+    parser.add_argument('--backends', default=','.join(backends()), help='backends separados por comas')
+    parser.add_argument('--updates', type=int, default=50, help='actualizaciones medidas por caso')
+    parser.add_argument('--budget', type=float, default=30.0,
+                        help='segundos máximos midiendo actualizaciones por caso (mínimo 3 muestras)')
+    parser.add_argument('--baseline', help='JSON de una corrida anterior para detectar regresiones')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='empeoramiento relativo permitido')
+    parser.add_argument('--max-update-p99-ms', type=float, help='límite absoluto para update_p99_ms')
+    parser.add_argument('--output', help='archivo donde guardar el JSON además de imprimirlo')
+    args = parser.parse_args()
+
+    available = backends()
+    selected = [name for name in args.backends.split(',') if name]
+    unknown = [name for name in selected if name not in available]
+    if unknown:
+        parser.error(f"backends desconocidos: {', '.join(unknown)} (disponibles: {', '.join(available)})")
+    sizes = [int(size) for size in args.sizes.split(',') if size]
+
+    context = multiprocessing.get_context('spawn')
+    workdir = tempfile.mkdtemp()
+    results = []
+    failures = []
+    for backend in selected:
+        for users in sizes:
+            channel = context.Queue()
+            process = context.Process(target=run_case,
+                                      args=(backend, users, args.updates, args.budget, workdir, channel))
+            process.start()
+            result = None
+            while result is None:
+                try:
+                    result = channel.get(timeout=1)
+                except queue.Empty:
+                    if not process.is_alive():
+                        break
+            process.join()
+            path = os.path.join(workdir, f'{backend}_{users}.dat')
+            if os.path.exists(path):
+                os.remove(path)
+            if result is None:
+                failures.append(f"{backend}/{users}: el caso terminó con código {process.exitcode}")
+                continue
+            results.append(result)
+            print(json.dumps(result), file=sys.stderr)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as f:
+            failures.extend(compare(results, json.load(f)['results'], args.tolerance))
+    if args.max_update_p99_ms is not None:
+        failures.extend(f"{case['backend']}/{case['users']}: update_p99_ms {case['update_p99_ms']} "
+                        f"> {args.max_update_p99_ms}"
+                        for case in results if case['update_p99_ms'] > args.max_update_p99_ms)
+
+    output = json.dumps({'results': results, 'regressions': failures}, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+    if failures:
+        print('Regresiones:\n  ' + '\n  '.join(failures), file=sys.stderr)
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
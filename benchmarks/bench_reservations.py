@@ -0,0 +1,120 @@
+"""
+Prueba de estrés de reservas concurrentes
+-----------------------------------------
+Varios hilos compiten por reservar y confirmar turnos al azar. Verifica que
+ningún turno quede reservado dos veces y mide el rendimiento según la cantidad
+de turnos distintos en disputa.
+
+Uso: python benchmarks/bench_reservations.py [--threads 8] [--ops 20000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from appointments import ReservationManager  # noqa: E402
+from faq_bot import Config, UserDataManager  # noqa: E402
+
+
+def run_case(num_slots: int, threads: int, ops: int) -> dict:
+    """Ejecuta un escenario de estrés y devuelve sus métricas"""
+    storage = UserDataManager()
+    manager = ReservationManager(storage, hold_ttl=30, autosave=False)
+    slot_ids = [f"s{i}" for i in range(num_slots)]
+    # Turnos ocupados en este momento según los propios hilos
+    occupied = set()
+    counters = {'bookings': 0, 'double_bookings': 0}
+    occupied_lock = threading.Lock()
+    barrier = threading.Barrier(threads + 1)
+
+    def worker(user_id: int) -> None:
+        rng = random.Random(user_id)
+        barrier.wait()
+        for _ in range(ops // threads):
+            slot_id = rng.choice(slot_ids)
+            token = manager.hold(slot_id, user_id)
+            if token is None:
+                continue
+            if manager.confirm(slot_id, user_id, token):
+                with occupied_lock:
+                    counters['bookings'] += 1
+                    if slot_id in occupied:
+                        counters['double_bookings'] += 1
+                    occupied.add(slot_id)
+                # Liberar para que el turno vuelva a estar en disputa
+                with occupied_lock:
+                    occupied.discard(slot_id)
+                manager.cancel_booking(slot_id, user_id)
+
+    workers = [threading.Thread(target=worker, args=(uid,)) for uid in range(1, threads + 1)]
+    for thread in workers:
+        thread.start()
+    barrier.wait()
+    started = time.perf_counter()
+    for thread in workers:
+        thread.join()
+    elapsed = time.perf_counter() - started
+
+    return {
+        'slots': num_slots,
+        'threads': threads,
+        'operations': ops,
+        'bookings': counters['bookings'],
+        'double_bookings': counters['double_bookings'],
+        'ops_per_sec': round(ops / elapsed, 1),
+        'bookings_per_sec': round(counters['bookings'] / elapsed, 1),
+    }
+
+
+def run_double_booking_check(threads: int, rounds: int) -> int:
+    """Todos los hilos pulsan el mismo turno a la vez; solo uno puede ganar por ronda"""
+    violations = 0
+    for _ in range(rounds):
+        storage = UserDataManager()
+        manager = ReservationManager(storage, hold_ttl=30, autosave=False)
+        winners = []
+        barrier = threading.Barrier(threads)
+
+        def worker(user_id: int) -> None:
+            barrier.wait()
+            token = manager.hold('slot', user_id)
+            if token and manager.confirm('slot', user_id, token):
+                winners.append(user_id)
+
+        workers = [threading.Thread(target=worker, args=(uid,)) for uid in range(1, threads + 1)]
+        for thread in workers:
+            thread.start()
+        for thread in workers:
+            thread.join()
+        if len(winners) != 1:
+            violations += 1
+    return violations
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--ops', type=int, default=20000)
+    parser.add_argument('--rounds', type=int, default=200)
+    args = parser.parse_args()
+
+    # No tocar el archivo de datos real
+    Config.DATA_FILE = os.path.join(tempfile.mkdtemp(), 'bench.pkl')
+
+    results = {
+        'same_slot_violations': run_double_booking_check(args.threads, args.rounds),
+        'cases': [run_case(num_slots, args.threads, args.ops) for num_slots in (1, 16, 256, 4096)],
+    }
+    print(json.dumps(results, indent=2))
+    if results['same_slot_violations'] or any(case['double_bookings'] for case in results['cases']):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
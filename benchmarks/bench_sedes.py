@@ -0,0 +1,89 @@
+"""
+Benchmark de la sede más cercana
+--------------------------------
+Reparte 10, 1k y 100k sedes al azar sobre Colombia y mide la búsqueda de la más
+cercana a ubicaciones al azar: con la grilla y comparando todas, con NumPy y en
+Python puro. Verifica además que todas las variantes devuelvan la misma sede.
+
+Uso: python benchmarks/bench_sedes.py [--sites 10 1000 100000] [--queries 2000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from sedes import Sede, SedeRegistry, np  # noqa: E402
+
+# Caja aproximada de Colombia (latitud, longitud)
+BOUNDS = ((-4.2, 12.5), (-79.0, -66.9))
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def measure(registry, queries):
+    latencies = []
+    results = []
+    for latitude, longitude in queries:
+        started = time.perf_counter()
+        sede, _ = registry.nearest(latitude, longitude)
+        latencies.append(time.perf_counter() - started)
+        results.append(sede.key)
+    return {
+        'p50_us': round(percentile(latencies, 0.5) * 1e6, 1),
+        'p99_us': round(percentile(latencies, 0.99) * 1e6, 1),
+        'queries_per_second': round(len(queries) / sum(latencies)),
+    }, results
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--sites', type=int, nargs='+', default=[10, 1000, 100000])
+    parser.add_argument('--queries', type=int, default=2000)
+    parser.add_argument('--cell', type=float, default=0.25, help='Tamaño de celda de la grilla en grados')
+    args = parser.parse_args()
+
+    rng = random.Random(42)
+    (min_lat, max_lat), (min_lon, max_lon) = BOUNDS
+    report = {'numpy': np is not None, 'cell_degrees': args.cell, 'queries': args.queries, 'sites': {}}
+    for count in args.sites:
+        sedes = [Sede(f"sede_{number}", {'es': f"Sede {number}"}, rng.uniform(min_lat, max_lat),
+                      rng.uniform(min_lon, max_lon), '') for number in range(count)]
+        queries = [(rng.uniform(min_lat, max_lat), rng.uniform(min_lon, max_lon)) for _ in range(args.queries)]
+        variants = {
+            'grid_numpy': dict(use_numpy=True, brute_force_limit=0),
+            'grid_python': dict(use_numpy=False, brute_force_limit=0),
+            'all_numpy': dict(use_numpy=True, brute_force_limit=count),
+            'all_python': dict(use_numpy=False, brute_force_limit=count),
+            'default': dict(),
+        }
+        if np is None:
+            variants = {name: options for name, options in variants.items() if not options.get('use_numpy')}
+        section = {}
+        expected = None
+        for name, options in variants.items():
+            # En Python puro comparar todas contra 100k sedes tarda ~0.1 s por consulta
+            variant_queries = queries[:max(20, args.queries * 1000 // count)] if name == 'all_python' else queries
+            started = time.perf_counter()
+            registry = SedeRegistry(sedes, cell_degrees=args.cell, **options)
+            registry.nearest(*queries[0])  # Construye el índice
+            build_seconds = time.perf_counter() - started
+            stats, results = measure(registry, variant_queries)
+            stats['build_ms'] = round(build_seconds * 1000, 1)
+            if expected is None:
+                expected = results
+            elif results != expected[:len(results)]:
+                raise SystemExit(f"{name} devolvió otra sede con {count} sedes")
+            section[name] = stats
+        report['sites'][str(count)] = section
+    print(json.dumps(report, indent=2))
+
+
+if __name__ == '__main__':
+    main()
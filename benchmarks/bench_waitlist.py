@@ -0,0 +1,85 @@
+"""
+Benchmark de la lista de espera
+-------------------------------
+Inscribe 100k pacientes con especialidad, sede, rango de días y jornada al azar,
+y mide el costo de encontrar y reservar al mejor candidato para turnos
+cancelados.
+
+Uso: python benchmarks/bench_waitlist.py [--entries 100000] [--matches 20000]
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+from datetime import date, datetime, timedelta
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from faq_bot import Config, UserDataManager  # noqa: E402
+from waitlist import WaitlistIndex  # noqa: E402
+
+SPECIALTIES = ['Cardiología', 'Dermatología', 'Pediatría', 'Neurología', 'Ortopedia', 'Ginecología']
+SEDES = ['sede_principal', 'sede_secundaria', None]
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('--entries', type=int, default=100000)
+    parser.add_argument('--matches', type=int, default=20000)
+    parser.add_argument('--days', type=int, default=30)
+    args = parser.parse_args()
+
+    # No tocar el archivo de datos real
+    Config.DATA_FILE = os.path.join(tempfile.mkdtemp(), 'bench.pkl')
+    rng = random.Random(42)
+    today = date.today()
+    index = WaitlistIndex(UserDataManager())
+
+    started = time.perf_counter()
+    for user_id in range(args.entries):
+        first_day = today + timedelta(days=rng.randrange(args.days))
+        index.add(user_id, user_id, rng.choice(SPECIALTIES), rng.choice(SEDES), first_day,
+                  first_day + timedelta(days=rng.randrange(7)), rng.choice((None, 0, 1)),
+                  priority=rng.randrange(3), save=False)
+    insert_seconds = time.perf_counter() - started
+
+    latencies = []
+    matched = 0
+    for number in range(args.matches):
+        start = datetime.combine(today + timedelta(days=rng.randrange(args.days)), datetime.min.time()) \
+            + timedelta(hours=rng.randrange(7, 18))
+        slot = {
+            'specialty': rng.choice(SPECIALTIES),
+            'sede': rng.choice(SEDES[:2]),
+            'start': start.isoformat(timespec='minutes')
+        }
+        began = time.perf_counter()
+        entry_id = index.match(slot)
+        if entry_id is not None:
+            index.claim(entry_id, f"slot{number}")
+            index.fulfil(f"slot{number}")
+            matched += 1
+        latencies.append(time.perf_counter() - began)
+
+    print(json.dumps({
+        'entries': args.entries,
+        'insert_seconds': round(insert_seconds, 3),
+        'heaps': len(index._heaps),
+        'matches': args.matches,
+        'matched': matched,
+        'match_p50_us': round(percentile(latencies, 0.50) * 1e6, 2),
+        'match_p99_us': round(percentile(latencies, 0.99) * 1e6, 2),
+        'match_max_us': round(max(latencies) * 1e6, 2),
+    }, indent=2))
+
+
+if __name__ == '__main__':
+    main()
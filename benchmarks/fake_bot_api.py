@@ -0,0 +1,260 @@
+"""
+Servidor falso de la Bot API de Telegram
+----------------------------------------
+Imita lo justo de https://api.telegram.org para correr ClinicBot contra él en
+benchmarks: entrega por getUpdates las actualizaciones que se le inyectan,
+responde sendMessage, editMessageText, sendPhoto, deleteMessage y compañía con
+objetos válidos, y puede agregar latencia y respuestas 429 configurables.
+
+Quien maneja la carga (usuarios sintéticos, un corpus grabado...) se suscribe a
+las llamadas del bot con add_listener y empuja actualizaciones con push_update.
+"""
+import asyncio
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import time
+from collections import Counter, deque
+from typing import Any, Callable, Deque, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+import httpx
+
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, REPO_DIR)
+
+from web_server import AsyncHTTPServer, HTTPRequest, HTTPResponse  # noqa: E402
+
+# Aviso por llamada del bot: (método, parámetros, resultado devuelto)
+CallListener = Callable[[str, Dict[str, Any], Any], None]
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'ClinicBot', 'username': 'clinic_bench_bot',
+            'can_join_groups': False, 'can_read_all_group_messages': False, 'supports_inline_queries': True}
+
+# Métodos que devuelven un mensaje
+MESSAGE_METHODS = {'sendMessage', 'sendPhoto', 'sendDocument', 'sendLocation', 'sendVenue', 'sendContact',
+                   'editMessageText', 'editMessageReplyMarkup', 'editMessageCaption', 'forwardMessage'}
+
+
+def parse_multipart(body: bytes, content_type: str) -> Dict[str, str]:
+    """Campos de texto de un cuerpo multipart/form-data (los archivos se descartan)"""
+    boundary = content_type.split('boundary=', 1)[1].strip('"').encode('latin-1')
+    fields = {}
+    for part in body.split(b'--' + boundary):
+        head, _, value = part.partition(b'\r\n\r\n')
+        if b'filename=' in head or b'name="' not in head:
+            continue
+        name = head.split(b'name="', 1)[1].split(b'"', 1)[0].decode('utf-8')
+        fields[name] = value.rstrip(b'\r\n').decode('utf-8')
+    return fields
+
+
+def parse_params(request: HTTPRequest) -> Dict[str, Any]:
+    """Parámetros de una llamada: form, multipart o JSON. Los valores compuestos vienen en JSON"""
+    content_type = request.headers.get('content-type', '')
+    if content_type.startswith('application/json'):
+        return json.loads(request.body or b'{}')
+    if content_type.startswith('multipart/form-data'):
+        raw = parse_multipart(request.body, content_type)
+    else:
+        raw = {key: values[0] for key, values in parse_qs(request.body.decode('utf-8')).items()}
+        raw.update({key: values[0] for key, values in request.query.items()})
+    params = {}
+    for key, value in raw.items():
+        try:
+            params[key] = json.loads(value)
+        except ValueError:
+            params[key] = value
+    return params
+
+
+class FakeBotAPI:
+    """Estado del servidor falso: cola de actualizaciones, mensajes y contadores"""
+
+    def __init__(self, latency: float = 0.0, rate_429: float = 0.0, retry_after: int = 1, seed: int = 42):
+        self.latency = latency
+        self.rate_429 = rate_429
+        self.retry_after = retry_after
+        self.rng = random.Random(seed)
+        self.pending: Deque[Dict[str, Any]] = deque()
+        self.next_update_id = 1
+        self.next_message_id = 1
+        self.calls: Counter = Counter()
+        self.throttled = 0
+        self.updates_pushed = 0
+        self.updates_delivered = 0
+        self.delivered_at: Dict[int, float] = {}
+        self.listeners: List[CallListener] = []
+        self.extra_stats: Callable[[], Dict[str, Any]] = dict
+        self._has_updates = asyncio.Event()
+
+    def add_listener(self, listener: CallListener) -> None:
+        self.listeners.append(listener)
+
+    def message_id(self) -> int:
+        self.next_message_id += 1
+        return self.next_message_id
+
+    def push_update(self, update: Dict[str, Any]) -> int:
+        """Encola una actualización para el próximo getUpdates y devuelve su update_id"""
+        update_id = self.next_update_id
+        self.next_update_id += 1
+        update['update_id'] = update_id
+        self.pending.append(update)
+        self.updates_pushed += 1
+        self._has_updates.set()
+        return update_id
+
+    def install(self, server: AsyncHTTPServer) -> None:
+        server.route_prefix('/bot', self.handle, methods=('GET', 'POST'))
+        server.route('/stats', self.handle_stats)
+
+    async def handle_stats(self, request: HTTPRequest) -> HTTPResponse:
+        stats = {
+            'calls': dict(self.calls),
+            'throttled': self.throttled,
+            'updates_pushed': self.updates_pushed,
+            'updates_delivered': self.updates_delivered,
+        }
+        stats.update(self.extra_stats())
+        return HTTPResponse.json(stats)
+
+    async def handle(self, request: HTTPRequest) -> HTTPResponse:
+        method = request.path.rsplit('/', 1)[-1]
+        params = parse_params(request)
+        if method == 'getUpdates':
+            return self._ok(await self._get_updates(params))
+
+        self.calls[method] += 1
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        if self.rate_429 and self.rng.random() < self.rate_429:
+            self.throttled += 1
+            return HTTPResponse.json({
+                'ok': False, 'error_code': 429,
+                'description': f'Too Many Requests: retry after {self.retry_after}',
+                'parameters': {'retry_after': self.retry_after}
+            }, status=429)
+        result = self._result(method, params)
+        for listener in self.listeners:
+            listener(method, params, result)
+        return self._ok(result)
+
+    def _ok(self, result: Any) -> HTTPResponse:
+        return HTTPResponse.json({'ok': True, 'result': result})
+
+    async def _get_updates(self, params: Dict[str, Any]) -> List[Dict[str, Any]]:
+        offset = int(params.get('offset') or 0)
+        while self.pending and self.pending[0]['update_id'] < offset:
+            self.pending.popleft()
+        if not self.pending:
+            self._has_updates.clear()
+            try:
+                await asyncio.wait_for(self._has_updates.wait(), float(params.get('timeout') or 0))
+            except asyncio.TimeoutError:
+                return []
+        limit = int(params.get('limit') or 100)
+        batch = [update for _, update in zip(range(limit), self.pending)]
+        now = time.perf_counter()
+        for update in batch:
+            if update['update_id'] not in self.delivered_at:
+                self.delivered_at[update['update_id']] = now
+                self.updates_delivered += 1
+        return batch
+
+    def _message(self, params: Dict[str, Any], message_id: Optional[int] = None) -> Dict[str, Any]:
+        chat_id = int(params.get('chat_id') or 0)
+        message = {
+            'message_id': message_id or self.message_id(),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER,
+        }
+        if 'text' in params:
+            message['text'] = str(params['text'])
+        if isinstance(params.get('reply_markup'), dict) and 'inline_keyboard' in params['reply_markup']:
+            message['reply_markup'] = params['reply_markup']
+        return message
+
+    def _result(self, method: str, params: Dict[str, Any]) -> Any:
+        if method == 'getMe':
+            return BOT_USER
+        if method.startswith('edit') and 'message_id' in params:
+            return self._message(params, int(params['message_id']))
+        if method in MESSAGE_METHODS:
+            return self._message(params)
+        if method == 'sendMediaGroup':
+            return [self._message(params) for _ in params.get('media') or [None]]
+        return True
+
+
+def find_free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+async def serve(api: FakeBotAPI, port: int) -> Tuple[AsyncHTTPServer, FakeBotAPI]:
+    """Levanta el servidor falso en 127.0.0.1:port"""
+    # Las fotos de las sedes superan el límite de cuerpo por defecto
+    server = AsyncHTTPServer(host='127.0.0.1', port=port, max_body=64 * 1024 * 1024)
+    api.install(server)
+    await server.start()
+    return server, api
+
+
+async def wait_for_api(client: httpx.AsyncClient, url: str, timeout: float = 10.0) -> None:
+    deadline = time.perf_counter() + timeout
+    while True:
+        try:
+            await client.get(url)
+            return
+        except httpx.TransportError:
+            if time.perf_counter() > deadline:
+                raise
+            await asyncio.sleep(0.05)
+
+
+async def run_clinic_bot(port: int, timeout: float, poll_interval: float = 0.5, workers: int = 1) -> Dict[str, Any]:
+    """Corre ClinicBot por polling contra el servidor falso hasta que /stats diga 'done'.
+
+    Con workers > 1 corre el pool de procesos de worker_pool.py. Usa archivos de
+    datos temporales; devuelve las últimas estadísticas del servidor.
+    """
+    from faq_bot import ClinicBot, Config
+
+    workdir = tempfile.mkdtemp()
+    Config.DATA_FILE = os.path.join(workdir, 'bench.pkl')
+    Config.WARM_START_FILE = os.path.join(workdir, 'warm_start.json')
+    Config.SCHEDULES_DIR = os.path.join(workdir, 'horarios')
+    Config.PHOTOS_DIR = os.path.join(REPO_DIR, Config.PHOTOS_DIR)
+    Config.MENU_FILE = os.path.join(REPO_DIR, Config.MENU_FILE)
+    Config.TOKEN = '123456:BENCHMARK'
+    Config.API_BASE_URL = f'http://127.0.0.1:{port}/bot'
+    Config.UPDATE_RECORD_FILE = None
+    stats_url = f'http://127.0.0.1:{port}/stats'
+
+    async with httpx.AsyncClient() as client:
+        await wait_for_api(client, stats_url)
+        if workers > 1:
+            from worker_pool import WorkerPool
+
+            runner = WorkerPool(workers, poll_timeout=5)
+            await runner.start()
+        else:
+            runner = ClinicBot()
+            await runner.application.initialize()
+            await runner.application.start()
+            await runner.start_polling(timeout=5)
+        deadline = time.perf_counter() + timeout
+        try:
+            while True:
+                await asyncio.sleep(poll_interval)
+                stats = (await client.get(stats_url)).json()
+                if stats.get('done') or time.perf_counter() > deadline:
+                    return stats
+        finally:
+            await runner.shutdown(timeout=10)
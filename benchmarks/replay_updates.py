@@ -0,0 +1,208 @@
+"""
+Reproducción de un corpus de actualizaciones grabadas
+-----------------------------------------------------
+Alimenta ClinicBot con un corpus grabado con UPDATE_RECORD_FILE (ver
+update_recorder.py) a través del servidor falso de la Bot API, respetando los
+tiempos originales a 1×, acelerados (--speed 10) o sin pausa (--speed 0).
+
+Reporta en JSON el ritmo logrado, el retraso de entrega respecto del horario
+del corpus (si el bot no da abasto, crece) y la latencia desde que getUpdates
+entrega cada actualización hasta la primera llamada del bot para ese chat.
+
+Uso: python benchmarks/replay_updates.py grabaciones/updates.jsonl.gz [--speed 10] [--output run.json]
+"""
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import sys
+import time
+from collections import defaultdict, deque
+from typing import Any, Deque, Dict, List, Optional
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from fake_bot_api import FakeBotAPI, find_free_port, run_clinic_bot, serve  # noqa: E402
+from update_recorder import iter_corpus  # noqa: E402
+
+
+def percentile(values, fraction):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))] if ordered else 0.0
+
+
+def chat_of(update: Dict[str, Any]) -> Optional[int]:
+    """Chat al que el bot respondería una actualización"""
+    for key in ('message', 'edited_message', 'channel_post'):
+        if key in update:
+            return update[key].get('chat', {}).get('id')
+    query = update.get('callback_query')
+    if query is not None:
+        chat = (query.get('message') or {}).get('chat', {}).get('id')
+        return chat if chat is not None else query.get('from', {}).get('id')
+    for key in ('inline_query', 'chosen_inline_result', 'my_chat_member'):
+        if key in update:
+            return update[key].get('from', {}).get('id')
+    return None
+
+
+class CorpusReplayer:
+    """Empuja el corpus al servidor falso con el ritmo pedido y mide las respuestas del bot"""
+
+    def __init__(self, api: FakeBotAPI, path: str, speed: float, limit: Optional[int] = None,
+                 max_pending: int = 1000, quiet: float = 1.0):
+        self.api = api
+        self.path = path
+        self.speed = speed
+        self.limit = limit
+        self.max_pending = max_pending
+        self.quiet = quiet
+        self.fed = False
+        self.first_push: Optional[float] = None
+        self.last_call: Optional[float] = None
+        self.scheduled_at: Dict[int, float] = {}
+        self.awaiting: Dict[int, Deque[int]] = defaultdict(deque)
+        self.lags: List[float] = []
+        self.latencies: List[float] = []
+        api.add_listener(self.on_bot_call)
+        api.extra_stats = self.stats
+
+    async def feed(self) -> None:
+        started = time.perf_counter()
+        for number, (offset, update) in enumerate(iter_corpus(self.path)):
+            if self.limit is not None and number >= self.limit:
+                break
+            if self.speed > 0:
+                due = started + offset / self.speed
+                delay = due - time.perf_counter()
+                if delay > 0:
+                    await asyncio.sleep(delay)
+            else:
+                due = time.perf_counter()
+                # Sin pausa, pero sin cargar todo el corpus en la cola del servidor
+                while len(self.api.pending) >= self.max_pending:
+                    await asyncio.sleep(0.005)
+            update_id = self.api.push_update(update)
+            self.scheduled_at[update_id] = due
+            chat = chat_of(update)
+            if chat is not None:
+                self.awaiting[chat].append(update_id)
+            if self.first_push is None:
+                self.first_push = time.perf_counter()
+        self.fed = True
+
+    def on_bot_call(self, method: str, params: Dict[str, Any], result: Any) -> None:
+        now = time.perf_counter()
+        self.last_call = now
+        try:
+            chat = int(params.get('chat_id') or 0)
+        except (TypeError, ValueError):
+            return
+        waiting = self.awaiting.get(chat)
+        if not waiting:
+            return
+        # La primera llamada para el chat después de entregar su actualización más vieja
+        delivered = self.api.delivered_at.get(waiting[0])
+        if delivered is not None:
+            update_id = waiting.popleft()
+            self.latencies.append(now - delivered)
+            self.lags.append(delivered - self.scheduled_at.pop(update_id, delivered))
+
+    def done(self) -> bool:
+        if not self.fed or self.api.updates_delivered < self.api.updates_pushed:
+            return False
+        last = self.last_call or self.first_push or 0.0
+        return time.perf_counter() - last > self.quiet
+
+    def stats(self) -> Dict[str, Any]:
+        elapsed = None
+        if self.first_push is not None:
+            elapsed = (self.last_call or time.perf_counter()) - self.first_push
+        return {
+            'done': self.done(),
+            'elapsed_seconds': elapsed,
+            'responded': len(self.latencies),
+            'latency_p50_ms': round(percentile(self.latencies, 0.50) * 1000, 3),
+            'latency_p99_ms': round(percentile(self.latencies, 0.99) * 1000, 3),
+            'latency_max_ms': round(max(self.latencies, default=0.0) * 1000, 3),
+            'delivery_lag_p50_ms': round(percentile(self.lags, 0.50) * 1000, 3),
+            'delivery_lag_p99_ms': round(percentile(self.lags, 0.99) * 1000, 3),
+        }
+
+
+def run_replay_api(port: int, options: Dict[str, Any]) -> None:
+    """Proceso del servidor falso y del reproductor"""
+    async def main():
+        api = FakeBotAPI(latency=options['latency_ms'] / 1000, rate_429=options['rate_429'])
+        replayer = CorpusReplayer(api, options['corpus'], options['speed'], options['limit'])
+        await serve(api, port)
+        await replayer.feed()
+        await asyncio.Event().wait()
+
+    logging.basicConfig(level=logging.WARNING)
+    asyncio.run(main())
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[1])
+    parser.add_argument('corpus', help='archivo .jsonl.gz grabado con UPDATE_RECORD_FILE')
+    parser.add_argument('--speed', type=float, default=1.0, help='1 = tiempo real, 10 = diez veces más rápido, 0 = sin pausa')
+    parser.add_argument('--limit', type=int, help='reproducir solo las primeras N actualizaciones')
+    parser.add_argument('--latency-ms', type=float, default=0.0, help='latencia agregada a cada llamada a la API')
+    parser.add_argument('--rate-429', type=float, default=0.0, help='fracción de llamadas respondidas con 429')
+    parser.add_argument('--timeout', type=float, default=3600.0)
+    parser.add_argument('--output', help='archivo donde guardar el JSON además de imprimirlo')
+    parser.add_argument('--verbose', action='store_true', help='mostrar advertencias y errores del bot')
+    args = parser.parse_args()
+    if args.speed < 0:
+        parser.error('--speed no puede ser negativo')
+
+    level = logging.WARNING if args.verbose else logging.CRITICAL
+    logging.basicConfig(level=level)
+    logging.getLogger().setLevel(level)
+
+    port = find_free_port()
+    server = multiprocessing.get_context('spawn').Process(
+        target=run_replay_api, args=(port, vars(args)), daemon=True)
+    server.start()
+    try:
+        stats = asyncio.run(run_clinic_bot(port, args.timeout))
+    finally:
+        server.terminate()
+        server.join()
+
+    updates = stats['updates_delivered']
+    api_calls = sum(stats['calls'].values())
+    elapsed = stats['elapsed_seconds'] or 0.0
+    result = {
+        'corpus': os.path.basename(args.corpus),
+        'speed': args.speed or 'unthrottled',
+        'injected_latency_ms': args.latency_ms,
+        'injected_429_rate': args.rate_429,
+        'timed_out': not stats['done'],
+        'elapsed_seconds': round(elapsed, 3),
+        'updates': updates,
+        'updates_per_sec': round(updates / elapsed, 1) if elapsed else 0.0,
+        'responded': stats['responded'],
+        'latency_p50_ms': stats['latency_p50_ms'],
+        'latency_p99_ms': stats['latency_p99_ms'],
+        'latency_max_ms': stats['latency_max_ms'],
+        'delivery_lag_p50_ms': stats['delivery_lag_p50_ms'],
+        'delivery_lag_p99_ms': stats['delivery_lag_p99_ms'],
+        'api_calls': api_calls,
+        'api_calls_per_update': round(api_calls / updates, 2) if updates else 0.0,
+        'api_calls_by_method': stats['calls'],
+        'throttled_429': stats['throttled'],
+    }
+    output = json.dumps(result, indent=2)
+    print(output)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            f.write(output + '\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,268 @@
+"""
+Anuncios a todos los usuarios
+-----------------------------
+Envía un anuncio (cierre por feriado, nueva especialidad, cambio de horario) a
+cada usuario de UserDataManager.user_data en su idioma guardado.
+
+- Los destinatarios se recorren en orden de id y en lotes. Al terminar cada
+  lote se guarda el último id enviado (a lo sumo cada CHECKPOINT_INTERVAL), así
+  que tras un reinicio se retoma desde ahí en vez de reenviar.
+- El ritmo lo marca un espaciado fijo de 1/rate segundos entre envíos, por
+  debajo del límite global de Telegram (~30 mensajes/s) para dejar lugar a las
+  respuestas interactivas. Un 429 pausa todos los envíos lo que indique
+  retry_after y reduce el ritmo a la mitad; cada envío aceptado lo vuelve a
+  subir un 5%.
+- Los usuarios que bloquearon el bot (Forbidden) se eliminan de user_data.
+- summaries() informa enviados, pendientes, mensajes/s y ETA.
+
+Los anuncios se guardan en la sección compartida 'broadcasts'. Con el pool de
+procesos cada proceso envía a sus propios usuarios, con rate / BOT_WORKERS, y
+registra su avance en progress[índice del proceso].
+"""
+import asyncio
+import logging
+import time
+import uuid
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from metrics import BROADCAST_MESSAGES, record_error
+
+if TYPE_CHECKING:
+    from faq_bot import UserDataManager
+
+logger = logging.getLogger(__name__)
+
+CHECKPOINT_INTERVAL = 5.0  # Segundos mínimos entre guardados del avance
+MAX_ATTEMPTS = 5  # Intentos por destinatario ante 429 o errores de red
+
+
+def new_progress() -> Dict[str, Any]:
+    return {'cursor': None, 'total': 0, 'sent': 0, 'failed': 0, 'blocked': 0,
+            'elapsed': 0.0, 'finished': False}
+
+
+def summarize(broadcast: Dict[str, Any]) -> Dict[str, Any]:
+    """Avance sumado de todos los procesos, con mensajes/s y ETA"""
+    progress = list(broadcast['progress'].values())
+    done = sum(p['sent'] + p['failed'] + p['blocked'] for p in progress)
+    total = sum(p['total'] for p in progress)
+    # Los procesos envían en paralelo: el tiempo es el del más lento
+    elapsed = max((p['elapsed'] for p in progress), default=0.0)
+    throughput = done / elapsed if elapsed > 0 else 0.0
+    remaining = max(0, total - done)
+    return {
+        'id': broadcast['id'],
+        'status': broadcast['status'],
+        'created_at': broadcast['created_at'],
+        'languages': sorted(broadcast['texts']),
+        'total': total,
+        'sent': sum(p['sent'] for p in progress),
+        'failed': sum(p['failed'] for p in progress),
+        'blocked': sum(p['blocked'] for p in progress),
+        'remaining': remaining,
+        'workers_finished': sum(1 for p in progress if p['finished']),
+        'workers': broadcast['workers'],
+        'messages_per_second': round(throughput, 2),
+        'eta_seconds': round(remaining / throughput) if throughput > 0 and remaining else None,
+    }
+
+
+class BroadcastManager:
+    """Anuncios persistidos en la sección 'broadcasts' y su envío a los usuarios de este proceso"""
+
+    def __init__(self, storage: 'UserDataManager', rate: float = 25.0, batch_size: int = 100,
+                 worker: int = 0, workers: int = 1, paid: bool = False):
+        self.storage = storage
+        self.max_rate = max(1.0, rate)
+        self.rate = self.max_rate
+        self.batch_size = batch_size
+        self.worker = worker
+        self.workers = workers
+        self.paid = paid  # allow_paid_broadcast: hasta 1000 mensajes/s pagando con Stars
+        self.broadcasts: Dict[str, Dict[str, Any]] = storage.get_section('broadcasts')
+        self.pending = 0
+        self._task: Optional[asyncio.Task] = None
+        self._stopping = False
+        self._next_slot = 0.0
+        self._paused_until = 0.0
+
+    def create(self, texts: Dict[str, str], default_language: str = 'es') -> str:
+        """Crea un anuncio con un texto por idioma; empieza a enviarse en el próximo tic"""
+        texts = {lang: text for lang, text in texts.items() if text}
+        if not texts:
+            raise ValueError("El anuncio no tiene texto")
+        if default_language not in texts:
+            default_language = next(iter(texts))
+        broadcast_id = uuid.uuid4().hex[:12]
+        with self.storage.shared():
+            self.broadcasts[broadcast_id] = {
+                'id': broadcast_id,
+                'texts': texts,
+                'default_language': default_language,
+                'created_at': time.time(),
+                'status': 'running',
+                'workers': self.workers,
+                'progress': {},
+            }
+            self.storage.save_data()
+        logger.info(f"Anuncio {broadcast_id} creado en {', '.join(sorted(texts))}")
+        return broadcast_id
+
+    def cancel(self, broadcast_id: str) -> bool:
+        """Detiene un anuncio; los procesos lo notan en su próximo guardado de avance"""
+        with self.storage.shared():
+            broadcast = self.broadcasts.get(broadcast_id)
+            if broadcast is None or broadcast['status'] != 'running':
+                return False
+            broadcast['status'] = 'cancelled'
+            self.storage.save_data()
+        logger.info(f"Anuncio {broadcast_id} cancelado")
+        return True
+
+    def summaries(self) -> List[Dict[str, Any]]:
+        with self.storage.shared():
+            return [summarize(broadcast) for broadcast in self.broadcasts.values()]
+
+    @property
+    def running(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    def start_pending(self, bot) -> None:
+        """Tarea periódica: si hay un anuncio sin terminar en este proceso, empieza (o retoma) su envío"""
+        if self.running or self._stopping:
+            return
+        key = str(self.worker)
+        with self.storage.shared():
+            pending = [broadcast['id'] for broadcast in self.broadcasts.values()
+                       if broadcast['status'] == 'running'
+                       and not broadcast['progress'].get(key, {}).get('finished')]
+        if pending:
+            self._task = asyncio.get_running_loop().create_task(self._run(bot, pending[0]))
+
+    async def stop(self) -> None:
+        """Guarda el avance y detiene el envío en curso (apagado)"""
+        self._stopping = True
+        if self._task is not None:
+            try:
+                await self._task
+            except Exception:
+                pass
+            self._task = None
+
+    async def _run(self, bot, broadcast_id: str) -> None:
+        key = str(self.worker)
+        with self.storage.shared():
+            broadcast = self.broadcasts[broadcast_id]
+            texts, default_language = broadcast['texts'], broadcast['default_language']
+            # Copia local: una recarga de la sección compartida reemplaza sus diccionarios
+            progress = dict(broadcast['progress'].get(key) or new_progress())
+        cursor = progress['cursor']
+        recipients = sorted(user_id for user_id in self.storage.user_data
+                            if cursor is None or user_id > cursor)
+        progress['total'] = progress['sent'] + progress['failed'] + progress['blocked'] + len(recipients)
+        self.pending = len(recipients)
+        self.rate = self.max_rate
+        logger.info(f"Anuncio {broadcast_id}: {len(recipients)} destinatarios en este proceso "
+                    f"({'retomado' if cursor is not None else 'nuevo'}, {self.rate:.1f} mensajes/s)")
+
+        run_started = time.monotonic()
+        elapsed_before = progress['elapsed']
+        last_checkpoint = run_started
+        # Lotes de unos 2 segundos de envío, para que un apagado no espere de más
+        batch_size = max(1, min(self.batch_size, int(self.max_rate * 2)))
+        try:
+            for start in range(0, len(recipients), batch_size):
+                if self._stopping:
+                    break
+                batch = recipients[start:start + batch_size]
+                results = await asyncio.gather(*(
+                    self._send(bot, user_id, self._text(user_id, texts, default_language)) for user_id in batch
+                ))
+                blocked = [user_id for user_id, result in zip(batch, results) if result == 'blocked']
+                for result in results:
+                    progress[result] += 1
+                    BROADCAST_MESSAGES.labels(result).inc()
+                for user_id in blocked:
+                    self.storage.user_data.pop(user_id, None)
+                    self.storage.conversation_states.pop(user_id, None)
+                progress['cursor'] = batch[-1]
+                progress['elapsed'] = elapsed_before + time.monotonic() - run_started
+                self.pending -= len(batch)
+                if time.monotonic() - last_checkpoint >= CHECKPOINT_INTERVAL:
+                    last_checkpoint = time.monotonic()
+                    if not self._checkpoint(broadcast_id, progress):
+                        break
+            else:
+                progress['finished'] = True
+        except Exception as e:
+            logger.error(f"Error en el anuncio {broadcast_id}: {e}")
+            record_error(e)
+        self._checkpoint(broadcast_id, progress)
+        self.pending = 0
+
+    def _checkpoint(self, broadcast_id: str, progress: Dict[str, Any]) -> bool:
+        """Guarda el avance de este proceso; False si el anuncio se canceló o ya no existe"""
+        with self.storage.shared():
+            broadcast = self.broadcasts.get(broadcast_id)
+            if broadcast is None:
+                return False
+            broadcast['progress'][str(self.worker)] = dict(progress)
+            if len(broadcast['progress']) >= broadcast['workers'] and all(
+                    p['finished'] for p in broadcast['progress'].values()) and broadcast['status'] == 'running':
+                broadcast['status'] = 'done'
+            self.storage.save_data()
+            summary = summarize(broadcast)
+        eta = summary['eta_seconds']
+        logger.info(f"Anuncio {broadcast_id}: {summary['sent']}/{summary['total']} enviados, "
+                    f"{summary['blocked']} bloqueados, {summary['failed']} fallidos, "
+                    f"{summary['messages_per_second']} mensajes/s, "
+                    f"ETA {f'{eta // 60}m{eta % 60:02d}s' if eta is not None else '-'}")
+        return broadcast['status'] == 'running' or progress['finished']
+
+    def _text(self, user_id: int, texts: Dict[str, str], default_language: str) -> str:
+        language = self.storage.user_data.get(user_id, {}).get('language', default_language)
+        return texts.get(language) or texts[default_language]
+
+    async def _pace(self) -> None:
+        """Espera el turno de envío: uno cada 1/rate segundos y ninguno durante una pausa por 429"""
+        while True:
+            now = time.monotonic()
+            slot = max(now, self._next_slot, self._paused_until)
+            self._next_slot = slot + 1 / self.rate
+            if slot > now:
+                await asyncio.sleep(slot - now)
+            if time.monotonic() >= self._paused_until:
+                return
+
+    async def _send(self, bot, user_id: int, text: str) -> str:
+        """Envía a un usuario: 'sent', 'blocked' o 'failed'"""
+        for attempt in range(MAX_ATTEMPTS):
+            await self._pace()
+            try:
+                await bot.send_message(chat_id=user_id, text=text,
+                                       allow_paid_broadcast=True if self.paid else None)
+                # Cada envío aceptado sube el ritmo un 5%, hasta el máximo
+                self.rate = min(self.max_rate, self.rate * 1.05)
+                return 'sent'
+            except Forbidden:
+                return 'blocked'
+            except RetryAfter as e:
+                now = time.monotonic()
+                if now >= self._paused_until:
+                    self.rate = max(1.0, self.rate / 2)
+                    logger.warning(f"Límite de Telegram en anuncios: pausa de {e.retry_after}s, "
+                                   f"ritmo reducido a {self.rate:.1f} mensajes/s")
+                self._paused_until = max(self._paused_until, now + float(e.retry_after))
+            except BadRequest as e:
+                # Chat inexistente o texto inválido: reintentar no cambia nada
+                logger.debug(f"No se pudo enviar el anuncio a {user_id}: {e}")
+                return 'failed'
+            except NetworkError as e:
+                logger.debug(f"Error de red al enviar el anuncio a {user_id} (intento {attempt + 1}): {e}")
+                await asyncio.sleep(2 ** attempt)
+            except TelegramError as e:
+                logger.debug(f"No se pudo enviar el anuncio a {user_id}: {e}")
+                return 'failed'
+        return 'failed'
@@ -0,0 +1,193 @@
+"""
+Directorio de médicos y especialidades
+--------------------------------------
+Índice de búsqueda por tokens y prefijos sobre los médicos del calendario, y un
+paginador de teclados inline que guarda el cursor dentro del propio
+callback_data (máximo 64 bytes), de modo que cambiar de página es una sola
+edición del mensaje y no requiere sesión en el servidor.
+"""
+import hashlib
+import re
+import unicodedata
+from typing import Callable, Dict, List, Optional, Sequence, Set
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from appointments import AppointmentCalendar
+
+# Especialidades anunciadas aunque todavía no haya horarios cargados
+DEFAULT_SPECIALTIES = ['Cardiología', 'Dermatología', 'Pediatría']
+
+CALLBACK_DATA_LIMIT = 64
+
+
+def normalize(text: str) -> str:
+    """Minúsculas y sin tildes, para comparar búsquedas"""
+    text = unicodedata.normalize('NFKD', text).encode('ascii', 'ignore').decode('ascii')
+    return text.lower()
+
+
+def tokenize(text: str) -> List[str]:
+    return re.findall(r'[a-z0-9]+', normalize(text))
+
+
+def entry_id(kind: str, name: str) -> str:
+    """Identificador estable de una entrada (no cambia al reconstruir el índice)"""
+    return hashlib.blake2b(f"{kind}|{name}".encode('utf-8'), digest_size=4).hexdigest()
+
+
+class DirectoryEntry:
+    """Médico o especialidad del directorio"""
+
+    __slots__ = ('id', 'kind', 'name', 'specialty', 'sedes', 'doctors')
+
+    def __init__(self, kind: str, name: str, specialty: str = ''):
+        # Un médico con horarios en dos especialidades tiene una entrada en cada una
+        self.id = entry_id(kind, f"{name}|{specialty}" if kind == 'doctor' else name)
+        self.kind = kind  # 'doctor' o 'specialty'
+        self.name = name
+        self.specialty = specialty
+        self.sedes: Set[str] = set()
+        self.doctors: List[str] = []  # ids de médicos (solo especialidades)
+
+
+class DoctorDirectory:
+    """Directorio con índice de prefijos, reconstruido cuando cambia el calendario"""
+
+    MAX_PREFIX = 8  # Prefijos más largos se resuelven filtrando el de 8 caracteres
+
+    def __init__(self, calendar: AppointmentCalendar):
+        self.calendar = calendar
+        self.entries: Dict[str, DirectoryEntry] = {}
+        self.specialties: List[str] = []
+        self._prefixes: Dict[str, Set[str]] = {}
+        self._built_version = -1
+
+    def _ensure_built(self) -> None:
+        if self._built_version == self.calendar.version:
+            return
+        entries: Dict[str, DirectoryEntry] = {}
+        for name in DEFAULT_SPECIALTIES:
+            specialty = DirectoryEntry('specialty', name)
+            entries[specialty.id] = specialty
+
+        for slot in self.calendar.slots.values():
+            doctor_key = entry_id('doctor', f"{slot['doctor']}|{slot['specialty']}")
+            doctor = entries.get(doctor_key)
+            if doctor is None:
+                doctor = DirectoryEntry('doctor', slot['doctor'], slot['specialty'])
+                entries[doctor.id] = doctor
+                specialty_key = entry_id('specialty', slot['specialty'])
+                if specialty_key not in entries:
+                    entries[specialty_key] = DirectoryEntry('specialty', slot['specialty'])
+                entries[specialty_key].doctors.append(doctor.id)
+            doctor.sedes.add(slot['sede'])
+
+        prefixes: Dict[str, Set[str]] = {}
+        for entry in entries.values():
+            entry.doctors.sort(key=lambda key: normalize(entries[key].name))
+            for token in tokenize(f"{entry.name} {entry.specialty}"):
+                for size in range(1, min(len(token), self.MAX_PREFIX) + 1):
+                    prefixes.setdefault(token[:size], set()).add(entry.id)
+
+        self.entries = entries
+        self.specialties = sorted((key for key, entry in entries.items() if entry.kind == 'specialty'),
+                                  key=lambda key: normalize(entries[key].name))
+        self._prefixes = prefixes
+        self._built_version = self.calendar.version
+
+    def get(self, key: str) -> Optional[DirectoryEntry]:
+        self._ensure_built()
+        return self.entries.get(key)
+
+    def list_specialties(self) -> List[str]:
+        self._ensure_built()
+        return self.specialties
+
+    def doctors_of(self, specialty_id: str) -> List[str]:
+        entry = self.get(specialty_id)
+        return entry.doctors if entry else []
+
+    def search(self, query: str) -> List[str]:
+        """Busca entradas cuyos tokens empiecen por cada palabra de la consulta"""
+        self._ensure_built()
+        result: Optional[Set[str]] = None
+        for token in tokenize(query):
+            candidates = self._prefixes.get(token[:self.MAX_PREFIX], set())
+            if len(token) > self.MAX_PREFIX:
+                candidates = {key for key in candidates
+                              if any(word.startswith(token) for word in
+                                     tokenize(f"{self.entries[key].name} {self.entries[key].specialty}"))}
+            result = candidates if result is None else result & candidates
+            if not result:
+                return []
+        if not result:
+            return []
+        # Especialidades primero, luego médicos, en orden alfabético
+        return sorted(result, key=lambda key: (self.entries[key].kind != 'specialty',
+                                               normalize(self.entries[key].name)))
+
+
+class InlinePaginator:
+    """Paginador de teclados inline con el cursor codificado en el callback_data.
+
+    Formato: '<prefijo>_<vista>_<página en base 36>_<argumento>'.
+    """
+
+    def __init__(self, prefix: str = 'dir', page_size: int = 8):
+        self.prefix = prefix
+        self.page_size = page_size
+
+    def encode(self, view: str, page: int, arg: str = '') -> str:
+        """Codifica un cursor, recortando el argumento para no superar 64 bytes"""
+        head = f"{self.prefix}_{view}_{self._base36(page)}_"
+        room = CALLBACK_DATA_LIMIT - len(head.encode('utf-8'))
+        data = arg.encode('utf-8')[:room].decode('utf-8', 'ignore')
+        return head + data
+
+    def decode(self, data: str) -> Optional[tuple]:
+        """Decodifica un cursor en (vista, página, argumento)"""
+        parts = data.split('_', 3)
+        if len(parts) < 3 or parts[0] != self.prefix:
+            return None
+        try:
+            page = int(parts[2], 36)
+        except ValueError:
+            return None
+        return parts[1], page, parts[3] if len(parts) > 3 else ''
+
+    @staticmethod
+    def _base36(number: int) -> str:
+        digits = '0123456789abcdefghijklmnopqrstuvwxyz'
+        text = ''
+        while True:
+            number, rest = divmod(number, 36)
+            text = digits[rest] + text
+            if number == 0:
+                return text
+
+    def page_count(self, total: int) -> int:
+        return max(1, -(-total // self.page_size))
+
+    def build(self, items: Sequence[str], page: int, view: str, arg: str,
+              item_button: Callable[[str], InlineKeyboardButton],
+              extra_rows: Optional[List[List[InlineKeyboardButton]]] = None) -> InlineKeyboardMarkup:
+        """Crea el teclado de una página con botones de navegación"""
+        pages = self.page_count(len(items))
+        page = min(max(page, 0), pages - 1)
+        start = page * self.page_size
+        keyboard = [[item_button(item)] for item in items[start:start + self.page_size]]
+
+        if pages > 1:
+            navigation = []
+            if page > 0:
+                navigation.append(InlineKeyboardButton("«", callback_data=self.encode(view, 0, arg)))
+                navigation.append(InlineKeyboardButton("‹", callback_data=self.encode(view, page - 1, arg)))
+            navigation.append(InlineKeyboardButton(f"{page + 1}/{pages}", callback_data=self.encode(view, page, arg)))
+            if page < pages - 1:
+                navigation.append(InlineKeyboardButton("›", callback_data=self.encode(view, page + 1, arg)))
+                navigation.append(InlineKeyboardButton("»", callback_data=self.encode(view, pages - 1, arg)))
+            keyboard.append(navigation)
+
+        keyboard.extend(extra_rows or [])
+        return InlineKeyboardMarkup(keyboard)
@@ -9,8 +9,10 @@ import json
 import logging
 import os
 import pickle
-from datetime import datetime
-from typing import Dict, List, Optional, Tuple, Union, Any
+import time
+from contextlib import nullcontext
+from datetime import date, datetime, timedelta
+from typing import Callable, ContextManager, Dict, List, Optional, Tuple, Type, Union, Any
 
 import dotenv
 from telegram import (
@@ -19,9 +21,33 @@ from telegram import (
 )
 from telegram.ext import (
     Application, CallbackContext, CallbackQueryHandler, CommandHandler,
-    ConversationHandler, MessageHandler, filters
+    ApplicationHandlerStop, ConversationHandler, InlineQueryHandler, MessageHandler, TypeHandler, filters
 )
-from telegram.error import BadRequest, TelegramError
+from telegram.error import BadRequest, NetworkError, RetryAfter, TelegramError
+
+from analytics import ANALYTICS, EventLog
+from backlog import catch_up
+from appointments import AppointmentCalendar, ReservationManager
+from broadcast import BroadcastManager
+from directory import DoctorDirectory, InlinePaginator
+from inline_results import InlineResultCache
+from menu import MenuGraph, MenuLibrary, MenuNode
+from sedes import SedeRegistry, directions_url
+from message_expiry import MessageExpiry
+from metrics import (
+    BOT_MESSAGES_DELETED, BOT_MESSAGES_TRACKED, BROADCAST_PENDING, BROADCAST_RATE, REMINDERS_PENDING, REMINDERS_SENT, SAVE_BYTES, SAVE_DURATION, SAVE_LAST_BYTES,
+    ANALYTICS_BUFFERED, INBOUND_BLOCKED, INBOUND_SHED, UPDATE_QUEUE_DEPTH, UPDATES,
+    observe_api_call, record_error, timed_handler
+)
+from monitoring import ApiCallListener, LivenessMonitor, TrackedHTTPXRequest
+from rate_limit import ALLOW, InboundRateLimiter, update_kind
+from reminders import ReminderScheduler
+from schedule_import import ScheduleImporter
+from tracing import TRACER, TracedApplication, Tracer
+from update_processor import ChatUpdateProcessor
+from update_recorder import UpdateRecorder
+from warm_start import WarmStartPersistence, write_atomic
+from waitlist import WaitlistIndex
 
 # Cargar variables de entorno
 dotenv.load_dotenv()
@@ -46,6 +72,49 @@ class Config:
     DATA_FILE = 'user_data.pkl'
     PHOTOS_DIR = os.getenv('PHOTOS_DIR', 'fotos')
     TOKEN = os.getenv('TELEGRAM_TOKEN')
+    API_BASE_URL = os.getenv('TELEGRAM_API_URL', 'https://api.telegram.org/bot')  # Otro servidor de la Bot API (local o de pruebas)
+    HOLD_TTL = int(os.getenv('HOLD_TTL', '120'))  # Segundos que dura la reserva temporal de un turno
+    MAX_SLOT_BUTTONS = 6  # Turnos libres mostrados en "Horario de citas"
+    SCHEDULES_DIR = os.getenv('SCHEDULES_DIR', 'horarios')  # Archivos .csv/.ics con los horarios de los médicos
+    SCHEDULES_SCAN_INTERVAL = int(os.getenv('SCHEDULES_SCAN_INTERVAL', '300'))
+    WAITLIST_OFFER_TTL = int(os.getenv('WAITLIST_OFFER_TTL', '900'))  # Segundos para aceptar un turno ofrecido
+    WAITLIST_DAYS = 14  # Días que cubre por defecto una inscripción en la lista de espera
+    TRACE_SAMPLE_RATE = float(os.getenv('TRACE_SAMPLE_RATE', '0'))  # Fracción de actualizaciones trazadas (0 = apagado)
+    TRACE_FILE = os.getenv('TRACE_FILE', 'trazas/bot_trace.json')
+    TRACE_FORMAT = os.getenv('TRACE_FORMAT', 'chrome')  # 'chrome' u 'otlp'
+    UPDATE_RECORD_FILE = os.getenv('UPDATE_RECORD_FILE')  # Corpus .jsonl.gz de actualizaciones anonimizadas (opcional)
+    UPDATE_RECORD_SALT = os.getenv('UPDATE_RECORD_SALT')  # Sal fija para que los ids coincidan entre grabaciones
+    WARM_START_FILE = os.getenv('WARM_START_FILE', 'warm_start.json')  # Conversaciones abiertas al apagar
+    WARM_START_MAX_AGE = int(os.getenv('WARM_START_MAX_AGE', '3600'))
+    SHUTDOWN_TIMEOUT = float(os.getenv('SHUTDOWN_TIMEOUT', '20'))  # Segundos para drenar al recibir SIGTERM
+    MESSAGE_TTL = int(os.getenv('MESSAGE_TTL', str(24 * 3600)))  # Segundos tras los que se borran los mensajes del bot
+    MESSAGE_SWEEP_INTERVAL = 10  # Segundos entre barridos de mensajes vencidos
+    MESSAGE_DELETE_RATE = float(os.getenv('MESSAGE_DELETE_RATE', '5'))  # Llamadas a deleteMessages por segundo
+    REMINDER_CHECK_INTERVAL = 30  # Segundos entre revisiones de recordatorios de citas vencidos
+    REMINDER_BATCH = 300  # Recordatorios enviados como máximo por revisión
+    REMINDER_RATE = float(os.getenv('REMINDER_RATE', '20'))  # Recordatorios por segundo
+    INLINE_CACHE_TIME = int(os.getenv('INLINE_CACHE_TIME', '3600'))  # Segundos que Telegram guarda las respuestas inline
+    ANALYTICS_DIR = os.getenv('ANALYTICS_DIR', 'analytics')  # Eventos de uso (vacío = deshabilitado)
+    BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '25'))  # Mensajes/s de los anuncios (Telegram admite ~30 en total)
+    BROADCAST_PAID = os.getenv('BROADCAST_PAID', '0') == '1'  # allow_paid_broadcast: hasta 1000/s, cobrado en Stars
+    SEDES_FILE = os.getenv('SEDES_FILE', 'sedes.json')  # Sedes adicionales para la búsqueda de la más cercana (opcional)
+    MENU_FILE = os.getenv('MENU_FILE', 'menu.json')  # Estructura del menú (ver menu.py); se recarga al modificarse
+    MENU_RELOAD_INTERVAL = 5  # Segundos entre revisiones de cambios en MENU_FILE
+    INBOUND_RATE = float(os.getenv('INBOUND_RATE', '1'))  # Actualizaciones/s sostenidas por usuario (0 = sin límite)
+    INBOUND_BURST = int(os.getenv('INBOUND_BURST', '10'))  # Ráfaga admitida por usuario
+    INBOUND_START_INTERVAL = float(os.getenv('INBOUND_START_INTERVAL', '20'))  # Segundos por /start tras una ráfaga de 3
+    INBOUND_BLOCK_AFTER = 30  # Actualizaciones sobre el límite sin pausa que bloquean al usuario
+    INBOUND_BLOCK_SECONDS = 60  # Primer bloqueo; se duplica con cada reincidencia
+    INBOUND_BLOCK_MAX = 3600
+    UPDATE_CONCURRENCY = int(os.getenv('UPDATE_CONCURRENCY', '32'))  # Chats atendidos en paralelo (cada chat, en orden)
+    CALLBACK_DEDUP_WINDOW = float(os.getenv('CALLBACK_DEDUP_WINDOW', '2'))  # Segundos en que se ignora un doble toque
+    BACKLOG_COALESCE = os.getenv('BACKLOG_COALESCE', '1') == '1'  # Agrupar por chat el atraso pendiente al arrancar
+    BACKLOG_MAX_UPDATES = 10000  # Máximo del atraso que se pide de una vez; el resto llega con el polling normal
+    BROADCAST_CHECK_INTERVAL = 10  # Segundos entre revisiones de anuncios pendientes
+    RUN_SHARED_JOBS = True  # Tareas sobre calendario, reservas y lista de espera (solo un proceso del pool)
+    WORKER_INDEX = 0  # Proceso del pool que ejecuta este bot y cantidad de procesos (ver worker_pool.py)
+    WORKERS = 1
+    TEXT_OVERRIDES: Optional[Dict[str, Any]] = None  # Textos, coordenadas y direcciones propios de una clínica
     
     @classmethod
     def get_photo_path(cls, sede: str, num: int) -> str:
@@ -54,35 +123,73 @@ class Config:
     
 # Clase para manejar los datos de usuario
 class UserDataManager:
-    def __init__(self):
+    def __init__(self, data_file: Optional[str] = None):
+        # Con varias clínicas en un proceso cada una tiene su archivo (ver tenants.py)
+        self.data_file = data_file or Config.DATA_FILE
         self.user_data = {}
         self.conversation_states = {}
+        # Secciones adicionales persistidas junto a los usuarios (reservas, calendario...)
+        self.sections = {}
+        # Funciones avisadas cuando las secciones se recargan desde otro proceso
+        self._reload_listeners: List[Callable[[], None]] = []
         self.load_data()
     
     def load_data(self) -> None:
         """Carga los datos del archivo de persistencia"""
         try:
-            if os.path.exists(Config.DATA_FILE):
-                with open(Config.DATA_FILE, 'rb') as f:
+            if os.path.exists(self.data_file):
+                with TRACER.span('load_data'), open(self.data_file, 'rb') as f:
                     data = pickle.load(f)
                     self.user_data = data.get('user_data', {})
                     self.conversation_states = data.get('conversation_states', {})
+                    self.sections = data.get('sections', {})
                 logger.info("Datos de usuarios cargados correctamente")
         except Exception as e:
             logger.error(f"Error al cargar datos: {e}")
+            record_error(e)
     
-    def save_data(self) -> None:
-        """Guarda los datos al archivo de persistencia"""
+    def save_data(self, sync: bool = False) -> None:
+        """Guarda los datos al archivo de persistencia.
+
+        Se escribe en un temporal y se reemplaza, así un corte nunca deja el
+        archivo a medio escribir; con sync=True además se fuerza a disco.
+        """
         try:
-            with open(Config.DATA_FILE, 'wb') as f:
-                data = {
-                    'user_data': self.user_data,
-                    'conversation_states': self.conversation_states
-                }
-                pickle.dump(data, f)
+            started = time.perf_counter()
+            with TRACER.span('save_data') as span:
+                data = pickle.dumps(self.snapshot())
+                write_atomic(self.data_file, data, sync=sync)
+                written = len(data)
+                if span is not None:
+                    span.attributes['bytes'] = written
+            SAVE_DURATION.observe(time.perf_counter() - started)
+            SAVE_BYTES.inc(written)
+            SAVE_LAST_BYTES.set(written)
             logger.info("Datos de usuarios guardados correctamente")
         except Exception as e:
             logger.error(f"Error al guardar datos: {e}")
+            record_error(e)
+
+    async def save_data_async(self) -> None:
+        """Como save_data, pero la escritura a disco corre en un hilo.
+
+        El pickle se arma en el bucle: hacerlo en el hilo competiría con los
+        manejadores que modifican los mismos diccionarios.
+        """
+        try:
+            started = time.perf_counter()
+            with TRACER.span('save_data') as span:
+                data = pickle.dumps(self.snapshot())
+                await asyncio.to_thread(write_atomic, self.data_file, data)
+                if span is not None:
+                    span.attributes['bytes'] = len(data)
+            SAVE_DURATION.observe(time.perf_counter() - started)
+            SAVE_BYTES.inc(len(data))
+            SAVE_LAST_BYTES.set(len(data))
+            logger.info("Datos de usuarios guardados correctamente")
+        except Exception as e:
+            logger.error(f"Error al guardar datos: {e}")
+            record_error(e)
     
     def get_user(self, user_id: int) -> Dict[str, Any]:
         """Obtiene los datos de un usuario, o crea un nuevo registro si no existe"""
@@ -107,11 +214,12 @@ class UserDataManager:
         user['last_active'] = datetime.now().isoformat()
         self.save_data()
     
-    def save_conversation_state(self, user_id: int, state: int, context: str) -> None:
-        """Guarda el estado de la conversación de un usuario"""
+    def save_conversation_state(self, user_id: int, state: int, context: str, node: Optional[str] = None) -> None:
+        """Guarda el estado de la conversación de un usuario (y el nodo del menú en que estaba)"""
         self.conversation_states[user_id] = {
             'state': state,
             'context': context,
+            'node': node,
             'timestamp': datetime.now().isoformat()
         }
         self.save_data()
@@ -120,11 +228,39 @@ class UserDataManager:
         """Obtiene el estado de la conversación de un usuario"""
         return self.conversation_states.get(user_id)
     
+    def get_section(self, name: str) -> Dict[Any, Any]:
+        """Obtiene (o crea) una sección de datos persistida junto a los usuarios"""
+        if name not in self.sections:
+            self.sections[name] = {}
+        return self.sections[name]
+
+    def snapshot(self) -> Dict[str, Any]:
+        """Datos que escribe save_data"""
+        return {
+            'user_data': self.user_data,
+            'conversation_states': self.conversation_states,
+            'sections': self.sections
+        }
+    
+    def shared(self) -> ContextManager:
+        """Bloque que lee y modifica secciones compartidas entre procesos (ver worker_pool.py).
+
+        Con un solo proceso no hace nada. Dentro del bloque no debe haber awaits.
+        """
+        return nullcontext()
+    
+    def refresh(self) -> None:
+        """Recarga las secciones que otro proceso haya cambiado; con un solo proceso no hace nada"""
+    
+    def add_reload_listener(self, listener: Callable[[], None]) -> None:
+        """Registra una función para reconstruir índices derivados tras una recarga"""
+        self._reload_listeners.append(listener)
+    
 # Clase para manejar traducciones
 class TranslationManager:
     """Maneja las traducciones del bot en diferentes idiomas"""
     
-    def __init__(self):
+    def __init__(self, overrides: Optional[Dict[str, Any]] = None):
         self.translations = {
             'es': {
                 'welcome': '¡Hola! Podría ingresar su nombre, por favor:',
@@ -143,13 +279,18 @@ class TranslationManager:
                              '/help - Mostrar esta ayuda\n'
                              '/menu - Ir al menú principal\n'
                              '/contacto - Información de contacto directo\n'
+                             '/buscar - Buscar médicos o especialidades\n'
+                             '/citas - Ver o cancelar sus citas\n'
+                             '/espera - Inscribirse en la lista de espera de una especialidad\n'
                              '/idioma - Cambiar el idioma',
                 'info_text': 'Somos una clínica comprometida con su salud y bienestar. Ofrecemos servicios médicos de alta calidad con profesionales altamente calificados.',
                 'unknown_command': '{}, lo siento, no entiendo ese comando. Utilice /help para ver los comandos disponibles.',
                 'select_hours': '{}, seleccione una opción relacionada con horarios:',
                 'select_contact': '{}, seleccione una opción relacionada con contacto:',
                 'select_services': '{}, seleccione una opción relacionada con servicios:',
-                'select_location': '{}, seleccione una opción relacionada con ubicación:',
+                'select_location': '{}, seleccione una sede o comparta su ubicación para encontrar la más cercana:',
+                'nearest_office': '{}, la sede más cercana es {}, a {:.1f} km:\n{}',
+                'directions': 'Cómo llegar',
                 'opening_hours': '{}, nuestro horario de atención es de lunes a viernes de 8:00 AM a 6:00 PM.',
                 'appointment_hours': '{}, las citas están disponibles de lunes a viernes de 9:00 AM a 5:00 PM.',
                 'phone': '{}, puede contactarnos al número 123-456-7890.',
@@ -165,7 +306,35 @@ class TranslationManager:
                 'feedback': '{}, ¿cómo calificaría su experiencia con nuestro bot?',
                 'thanks_feedback': '{}, gracias por su feedback. Lo tendremos en cuenta para mejorar nuestro servicio.',
                 'error_message': 'Ha ocurrido un error. Vamos a reiniciar la conversación para asegurar un funcionamiento correcto.',
-                'select_photos': '{}, ¿de qué sede desea ver las fotos?'
+                'select_photos': '{}, ¿de qué sede desea ver las fotos?',
+                'slot_held': '{}, hemos apartado el turno {} durante {} segundos. ¿Desea confirmarlo?',
+                'slot_taken': '{}, ese turno acaba de ser tomado por otra persona. Por favor, elija otro:',
+                'slot_booked': '{}, su cita para el {} ha sido confirmada. ¡Le esperamos!',
+                'slot_hold_expired': '{}, la reserva del turno venció antes de confirmarse. Por favor, elija otro:',
+                'slot_released': '{}, hemos liberado el turno. Puede elegir otro:',
+                'confirm': 'Confirmar',
+                'cancel': 'Cancelar',
+                'directory_specialties': '{}, estas son nuestras especialidades. Seleccione una para ver sus médicos:',
+                'directory_doctors': '{}, médicos de {}:',
+                'directory_results': '{}, resultados para "{}":',
+                'directory_no_results': '{}, no encontramos médicos ni especialidades para "{}".',
+                'directory_search_usage': '{}, escriba /buscar seguido del nombre del médico o la especialidad. Por ejemplo: /buscar cardio',
+                'directory_doctor': '{}\nEspecialidad: {}\nSedes: {}',
+                'directory_back': 'Volver a especialidades',
+                'my_appointments': '{}, estas son sus citas. Pulse una para cancelarla:',
+                'no_appointments': '{}, no tiene citas confirmadas.',
+                'slot_cancelled': '{}, su cita del {} fue cancelada.',
+                'booking_not_found': '{}, no encontramos una cita suya el {}. Puede que ya estuviera cancelada.',
+                'reminder_24h': '{}, le recordamos su cita de mañana: {}.',
+                'reminder_1h': '{}, su cita es en una hora: {}. ¡Le esperamos!',
+                'waitlist_usage': '{}, escriba /espera seguido de la especialidad y, si lo desea, la sede (principal/secundaria) y la jornada (mañana/tarde). Por ejemplo: /espera cardiología principal mañana',
+                'waitlist_joined': '{}, le inscribimos en la lista de espera de {} hasta el {}. Le avisaremos apenas se libere un turno.',
+                'waitlist_offer': '{}, se liberó un turno de {}: {}. ¿Lo desea? Tiene {} minutos para aceptarlo.',
+                'waitlist_booked': '{}, su cita para el {} ha sido confirmada. ¡Le esperamos!',
+                'waitlist_declined': '{}, entendido. Seguirá en la lista de espera.',
+                'waitlist_expired': '{}, el plazo para aceptar este turno ya venció. Seguirá en la lista de espera.',
+                'accept': 'Aceptar',
+                'decline': 'Rechazar'
             },
             'en': {
                 'welcome': 'Hello! Could you please enter your name:',
@@ -184,13 +353,18 @@ class TranslationManager:
                              '/help - Show this help\n'
                              '/menu - Go to the main menu\n'
                              '/contact - Direct contact information\n'
+                             '/buscar - Search doctors or specialties\n'
+                             '/citas - View or cancel your appointments\n'
+                             '/espera - Join the waitlist for a specialty\n'
                              '/language - Change language',
                 'info_text': 'We are a clinic committed to your health and wellbeing. We offer high-quality medical services with highly qualified professionals.',
                 'unknown_command': '{}, I\'m sorry, I don\'t understand that command. Use /help to see available commands.',
                 'select_hours': '{}, select an option related to hours:',
                 'select_contact': '{}, select an option related to contact:',
                 'select_services': '{}, select an option related to services:',
-                'select_location': '{}, select an option related to location:',
+                'select_location': '{}, select an office or share your location to find the nearest one:',
+                'nearest_office': '{}, the nearest office is {}, {:.1f} km away:\n{}',
+                'directions': 'Directions',
                 'opening_hours': '{}, our opening hours are Monday to Friday from 8:00 AM to 6:00 PM.',
                 'appointment_hours': '{}, appointments are available Monday to Friday from 9:00 AM to 5:00 PM.',
                 'phone': '{}, you can contact us at 123-456-7890.',
@@ -206,7 +380,35 @@ class TranslationManager:
                 'feedback': '{}, how would you rate your experience with our bot?',
                 'thanks_feedback': '{}, thank you for your feedback. We will take it into account to improve our service.',
                 'error_message': 'An error has occurred. We will restart the conversation to ensure proper functioning.',
-                'select_photos': '{}, which office photos would you like to see?'
+                'select_photos': '{}, which office photos would you like to see?',
+                'slot_held': '{}, we have held the {} slot for {} seconds. Would you like to confirm it?',
+                'slot_taken': '{}, that slot was just taken by someone else. Please choose another one:',
+                'slot_booked': '{}, your appointment for {} has been confirmed. See you soon!',
+                'slot_hold_expired': '{}, the hold on that slot expired before confirmation. Please choose another one:',
+                'slot_released': '{}, we have released the slot. You can choose another one:',
+                'confirm': 'Confirm',
+                'cancel': 'Cancel',
+                'directory_specialties': '{}, these are our specialties. Select one to see its doctors:',
+                'directory_doctors': '{}, doctors in {}:',
+                'directory_results': '{}, results for "{}":',
+                'directory_no_results': '{}, we found no doctors or specialties for "{}".',
+                'directory_search_usage': '{}, type /buscar followed by the doctor or specialty name. For example: /buscar cardio',
+                'directory_doctor': '{}\nSpecialty: {}\nOffices: {}',
+                'directory_back': 'Back to specialties',
+                'my_appointments': '{}, these are your appointments. Tap one to cancel it:',
+                'no_appointments': '{}, you have no confirmed appointments.',
+                'slot_cancelled': '{}, your appointment for {} was cancelled.',
+                'booking_not_found': '{}, we could not find an appointment of yours for {}. It may already have been cancelled.',
+                'reminder_24h': '{}, this is a reminder of your appointment tomorrow: {}.',
+                'reminder_1h': '{}, your appointment is in one hour: {}. See you soon!',
+                'waitlist_usage': '{}, type /espera followed by the specialty and, optionally, the office (principal/secundaria) and time of day (mañana/tarde). For example: /espera cardiology principal mañana',
+                'waitlist_joined': '{}, you are on the {} waitlist until {}. We will notify you as soon as a slot frees up.',
+                'waitlist_offer': '{}, a {} slot has opened up: {}. Would you like it? You have {} minutes to accept.',
+                'waitlist_booked': '{}, your appointment for {} has been confirmed. See you soon!',
+                'waitlist_declined': '{}, understood. You will stay on the waitlist.',
+                'waitlist_expired': '{}, the time to accept this slot has expired. You will stay on the waitlist.',
+                'accept': 'Accept',
+                'decline': 'Decline'
             }
         }
         
@@ -215,6 +417,17 @@ class TranslationManager:
             'main_office': (2.9371, -75.2958),  # Coordenadas de la sede principal
             'secondary_office': (2.9428, -75.2981)  # Coordenadas de la sede secundaria
         }
+        self.addresses = {
+            'main_office': 'Calle 9 #15-25, Neiva, Huila',
+            'secondary_office': 'Cl. 9 #15-25, Neiva, Huila'
+        }
+        
+        # Textos y sedes propios de una clínica: {'translations': {idioma: {clave: texto}}, 'locations', 'addresses'}
+        if overrides:
+            for lang, texts in overrides.get('translations', {}).items():
+                self.translations.setdefault(lang, {}).update(texts)
+            self.locations.update({key: tuple(value) for key, value in overrides.get('locations', {}).items()})
+            self.addresses.update(overrides.get('addresses', {}))
     
     def get_text(self, key: str, lang: str, *args) -> str:
         """Obtiene un texto traducido por su clave"""
@@ -230,17 +443,83 @@ class TranslationManager:
     
 # Parte de la clase ClinicBot - Métodos auxiliares
 class ClinicBot:
-    def __init__(self):
+    def __init__(self, user_data_manager: Optional[UserDataManager] = None, config: Type[Config] = Config):
         """Inicializa el bot y sus componentes"""
-        self.user_data_manager = UserDataManager()
-        self.translation_manager = TranslationManager()
+        # Config o una subclase con los valores de una clínica (ver tenants.py)
+        self.config = config
+        self.user_data_manager = user_data_manager if user_data_manager is not None \
+            else UserDataManager(config.DATA_FILE)
+        self.translation_manager = TranslationManager(config.TEXT_OVERRIDES)
+        self.inline_results = InlineResultCache(self.translation_manager)
+        self.sedes = SedeRegistry.from_translations(self.translation_manager, self.config.SEDES_FILE)
+        self.menus = MenuLibrary(self.config.MENU_FILE, self.translation_manager, self.sedes)
+        self.calendar = AppointmentCalendar(self.user_data_manager)
+        self.reservation_manager = ReservationManager(self.user_data_manager, hold_ttl=self.config.HOLD_TTL)
+        self.schedule_importer = ScheduleImporter(self.calendar, self.user_data_manager, self.reservation_manager)
+        self.directory = DoctorDirectory(self.calendar)
+        self.paginator = InlinePaginator(prefix='dir')
+        self.waitlist = WaitlistIndex(self.user_data_manager)
+        self.message_expiry = MessageExpiry(self.user_data_manager, ttl=self.config.MESSAGE_TTL)
+        BOT_MESSAGES_TRACKED.set_function(lambda: self.message_expiry.tracked)
+        self.reminders = ReminderScheduler(self.user_data_manager, self.calendar, self.reservation_manager)
+        REMINDERS_PENDING.set_function(lambda: self.reminders.pending)
+        self.broadcasts = BroadcastManager(self.user_data_manager, rate=self.config.BROADCAST_RATE,
+                                           worker=self.config.WORKER_INDEX, workers=self.config.WORKERS,
+                                           paid=self.config.BROADCAST_PAID)
+        BROADCAST_PENDING.set_function(lambda: self.broadcasts.pending)
+        BROADCAST_RATE.set_function(lambda: self.broadcasts.rate if self.broadcasts.running else 0)
+        self.reservation_manager.add_listener(self.on_slot_event)
+        self.rate_limiter = None
+        if self.config.INBOUND_RATE > 0:
+            self.rate_limiter = InboundRateLimiter(
+                rate=self.config.INBOUND_RATE, burst=self.config.INBOUND_BURST,
+                start_rate=1 / self.config.INBOUND_START_INTERVAL, block_after=self.config.INBOUND_BLOCK_AFTER,
+                block_seconds=self.config.INBOUND_BLOCK_SECONDS, block_max=self.config.INBOUND_BLOCK_MAX
+            )
+            INBOUND_BLOCKED.set_function(lambda: self.rate_limiter.blocked)
+        self.update_recorder = None
+        if self.config.UPDATE_RECORD_FILE:
+            salt = self.config.UPDATE_RECORD_SALT.encode('utf-8') if self.config.UPDATE_RECORD_SALT else None
+            self.update_recorder = UpdateRecorder(self.config.UPDATE_RECORD_FILE, salt)
+            logger.info(f"Grabando actualizaciones anonimizadas en {self.config.UPDATE_RECORD_FILE}")
         
-        if not Config.TOKEN:
+        if not self.config.TOKEN:
             raise ValueError("No se ha configurado el token de Telegram. Revise el archivo .env")
             
-        self.application = Application.builder().token(Config.TOKEN).build()
+        # Conversaciones abiertas y context.user_data del último apagado ordenado
+        self.persistence = WarmStartPersistence.load(self.config.WARM_START_FILE, self.config.WARM_START_MAX_AGE)
+        
+        # Las peticiones a Telegram informan su resultado al monitor de vida (/ready)
+        self.liveness = LivenessMonitor()
+        self.tracer, self.analytics = self.build_sinks()
+        api_listeners = [self.liveness.record_api_call, observe_api_call, self.tracer.record_api_call]
+        self.tracer.configure(self.config.TRACE_SAMPLE_RATE, self.config.TRACE_FILE, self.config.TRACE_FORMAT)
+        # Con el pool cada proceso escribe sus propios archivos en el mismo directorio
+        self.analytics.configure(self.config.ANALYTICS_DIR, 'events' if self.config.WORKERS == 1 else f"events.w{self.config.WORKER_INDEX}")
+        ANALYTICS_BUFFERED.set_function(lambda: self.analytics.buffered)
+        self.application = self.build_application(api_listeners)
+        self.application.tracer = self.tracer
+        UPDATE_QUEUE_DEPTH.set_function(self.application.update_queue.qsize)
         self.setup_handlers()
     
+    def build_sinks(self) -> Tuple[Tracer, EventLog]:
+        """Destinos de las trazas y los eventos de uso: los globales del proceso"""
+        return TRACER, ANALYTICS
+
+    def build_application(self, api_listeners: List[ApiCallListener]) -> Application:
+        """Crea la Application de PTB con sus propios pools de conexiones y getUpdates"""
+        return (
+            Application.builder()
+            .application_class(TracedApplication)
+            .token(self.config.TOKEN)
+            .base_url(self.config.API_BASE_URL)
+            .persistence(self.persistence)
+            .concurrent_updates(ChatUpdateProcessor(self.config.UPDATE_CONCURRENCY, self.config.CALLBACK_DEDUP_WINDOW))
+            .request(TrackedHTTPXRequest(connection_pool_size=256, on_api_call=api_listeners))
+            .get_updates_request(TrackedHTTPXRequest(connection_pool_size=1, on_api_call=api_listeners))
+            .build()
+        )
+    
     def setup_handlers(self) -> None:
         """Configura los manejadores de comandos y conversaciones"""
         # Configurar el ConversationHandler principal
@@ -254,7 +533,10 @@ class ClinicBot:
                     CallbackQueryHandler(self.handle_language_selection, pattern=r"^lang_")
                 ],
                 States.MENU_PRINCIPAL: [
-                    CallbackQueryHandler(self.handle_main_menu_callback, pattern=r"^menu_|^resume_"),
+                    CallbackQueryHandler(self.handle_main_menu_callback, pattern=r"^menu_|^resume_|^nav_|^back_to_main$"),
+                    # Botones de un submenú cuyo manejador se canceló antes de cambiar el estado (ver update_processor.py)
+                    CallbackQueryHandler(self.handle_slot_callback, pattern=r"^slot_"),
+                    CallbackQueryHandler(self.handle_directory_callback, pattern=r"^dir_"),
                     CommandHandler("menu", self.handle_menu),
                     CommandHandler("help", self.handle_help),
                     CommandHandler("contacto", self.handle_contact),
@@ -262,6 +544,9 @@ class ClinicBot:
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.unknown)
                 ],
                 States.SUBMENU: [
+                    CallbackQueryHandler(self.handle_slot_callback, pattern=r"^slot_"),
+                    CallbackQueryHandler(self.handle_directory_callback, pattern=r"^dir_"),
+                    CallbackQueryHandler(self.handle_waitlist_callback, pattern=r"^wl_"),
                     CallbackQueryHandler(self.handle_submenu_callback),
                     MessageHandler(filters.TEXT & ~filters.COMMAND, self.unknown)
                 ],
@@ -275,25 +560,50 @@ class ClinicBot:
                 CommandHandler("help", self.handle_help),
                 CommandHandler("menu", self.handle_menu),
                 CommandHandler("contacto", self.handle_contact),
+                CommandHandler("buscar", self.handle_directory_search),
+                CommandHandler("citas", self.handle_my_appointments),
+                CommandHandler("espera", self.handle_waitlist_join),
                 CommandHandler("idioma", self.handle_language_command),
+                CallbackQueryHandler(self.handle_waitlist_callback, pattern=r"^wl_"),
                 MessageHandler(filters.COMMAND, self.unknown),
                 MessageHandler(filters.TEXT & ~filters.COMMAND, self.unknown)
             ],
             name="main_conversation",
-            persistent=False,
+            persistent=True,
             per_message=False
         )
 
         # Agregar manejadores
+        self.application.add_handler(TypeHandler(Update, self.track_update), group=-1)
         self.application.add_handler(conv_handler)
         self.application.add_handler(CommandHandler("info", self.handle_info))
+        self.application.add_handler(InlineQueryHandler(self.handle_inline_query))
+        # Ubicación compartida en cualquier estado (las actualizaciones de una ubicación en vivo no cuentan)
+        self.application.add_handler(MessageHandler(filters.LOCATION & filters.UpdateType.MESSAGE, self.handle_location))
+        # Ofertas de la lista de espera para usuarios sin conversación activa
+        self.application.add_handler(CallbackQueryHandler(self.handle_waitlist_callback, pattern=r"^wl_"))
         self.application.add_error_handler(self.error_handler)
         
         # Programar tareas periódicas
         try:
             job_queue = self.application.job_queue
             if job_queue:
-                job_queue.run_repeating(self.clean_old_messages, interval=3600)
+                job_queue.run_repeating(self.sweep_expired_messages, interval=self.config.MESSAGE_SWEEP_INTERVAL)
+                job_queue.run_repeating(self.run_broadcasts, interval=self.config.BROADCAST_CHECK_INTERVAL, first=5)
+                job_queue.run_repeating(self.reload_menu, interval=self.config.MENU_RELOAD_INTERVAL)
+                if self.rate_limiter is not None:
+                    job_queue.run_repeating(self.release_collapsed_updates, interval=1)
+                if self.config.RUN_SHARED_JOBS:
+                    job_queue.run_repeating(self.expire_slot_holds, interval=1)
+                    job_queue.run_repeating(self.import_schedules, interval=self.config.SCHEDULES_SCAN_INTERVAL, first=1)
+                    job_queue.run_repeating(self.purge_waitlist, interval=86400, first=60)
+                    job_queue.run_repeating(self.send_reminders, interval=self.config.REMINDER_CHECK_INTERVAL, first=5)
+                if self.tracer.enabled:
+                    job_queue.run_repeating(self.flush_traces, interval=5)
+                if self.update_recorder is not None:
+                    job_queue.run_repeating(self.flush_recorded_updates, interval=5)
+                if self.analytics.enabled:
+                    job_queue.run_repeating(self.flush_analytics, interval=5)
         except Exception as e:
             logger.warning(f"No se pudo configurar el JobQueue: {e}")
     
@@ -301,8 +611,70 @@ class ClinicBot:
         """Inicia el bot"""
         logger.info("Iniciando el bot")
         return
-    
+
+    async def start_polling(self, **kwargs) -> None:
+        """Procesa el atraso pendiente agrupado por chat y luego empieza el polling normal"""
+        if self.config.BACKLOG_COALESCE:
+            await catch_up(self.application, self.config.BACKLOG_MAX_UPDATES)
+        await self.application.updater.start_polling(**kwargs)
+
+    async def shutdown(self, timeout: float = Config.SHUTDOWN_TIMEOUT) -> None:
+        """Apagado ordenado: deja de recibir, drena lo pendiente, guarda y deja la instantánea de arranque"""
+        loop = asyncio.get_running_loop()
+        deadline = loop.time() + timeout
+        application = self.application
+
+        # 1. Dejar de pedir actualizaciones a Telegram y cortar el anuncio en curso tras su lote
+        if application.updater is not None and application.updater.running:
+            await application.updater.stop()
+        try:
+            await asyncio.wait_for(self.broadcasts.stop(), timeout / 2)
+        except asyncio.TimeoutError:
+            logger.warning("El anuncio en curso no terminó su lote; se retomará desde el último avance guardado")
+
+        # 2. Procesar lo que ya está en la cola, esperar las tareas creadas con
+        #    create_task (ofertas de la lista de espera) y detener el JobQueue
+        if application.running:
+            try:
+                await asyncio.wait_for(application.stop(), max(0.0, deadline - loop.time()))
+            except asyncio.TimeoutError:
+                logger.warning(f"El drenaje no terminó en {timeout:.0f}s; se guardará el estado igualmente")
+
+        # 3. Guardar el estado de forma atómica y forzada a disco
+        self.user_data_manager.save_data(sync=True)
+        await asyncio.to_thread(self.tracer.flush)
+        await asyncio.to_thread(self.analytics.flush)
+        if self.update_recorder is not None:
+            await asyncio.to_thread(self.update_recorder.flush)
+
+        # 4. Cerrar conexiones y escribir la instantánea de arranque en caliente
+        try:
+            await application.shutdown()
+        except RuntimeError:
+            # Si el drenaje se cortó por tiempo la aplicación sigue marcada como activa
+            await application.update_persistence()
+            await self.persistence.flush()
+        self.liveness.stop()
+        logger.info("Bot detenido ordenadamente")
+
     # Métodos auxiliares
+    async def track_update(self, update: Update, context: CallbackContext) -> None:
+        """Registra la llegada de cada actualización y corta las que superan el límite del usuario"""
+        # Las agrupadas que vuelven a la cola ya se registraron al llegar
+        if self.rate_limiter is None or not self.rate_limiter.was_released(update):
+            self.liveness.record_update()
+            UPDATES.inc()
+            if self.update_recorder is not None:
+                self.update_recorder.record(update.to_dict())
+            if self.rate_limiter is not None and update.effective_user is not None:
+                kind = update_kind(update)
+                result = self.rate_limiter.check(update.effective_user.id, update, kind)
+                if result != ALLOW:
+                    # Ningún otro manejador la procesa: ni guarda datos ni responde
+                    INBOUND_SHED.labels(kind, result).inc()
+                    raise ApplicationHandlerStop
+        self.user_data_manager.refresh()
+    
     async def send_and_track_message(self, update: Update, context: CallbackContext, 
                                      message_function, *args, **kwargs) -> Optional[Any]:
         """Envía un mensaje y lo rastrea para poder eliminarlo después"""
@@ -315,10 +687,12 @@ class ClinicBot:
             
             # Añadir el ID del mensaje a la lista
             context.user_data['additional_messages'].append(message.message_id)
+            self.track_bot_message(message)
             
             return message
         except Exception as e:
             logger.error(f"Error al enviar y rastrear mensaje: {e}")
+            record_error(e)
             return None
     
     async def replace_message(self, update: Update, context: CallbackContext, 
@@ -328,6 +702,22 @@ class ClinicBot:
         chat_id = update.effective_chat.id
         
         try:
+            query = update.callback_query
+            in_place = (query is not None and query.message is not None
+                        and context.user_data.get('last_bot_message_id') == query.message.message_id)
+            if in_place:
+                # El teclado tocado es el último mensaje del bot: se edita sin borrarlo ni reenviarlo
+                try:
+                    message = await query.message.edit_text(text=text, reply_markup=reply_markup)
+                    self.track_bot_message(message)
+                    return message
+                except BadRequest as e:
+                    if 'not modified' in str(e).lower():
+                        return query.message
+                    logger.warning(f"No se pudo editar el mensaje: {e}. Enviando un nuevo mensaje.")
+                except TelegramError as e:
+                    logger.warning(f"No se pudo editar el mensaje: {e}. Enviando un nuevo mensaje.")
+
             # Eliminar el mensaje anterior si existe
             if 'last_bot_message_id' in context.user_data:
                 try:
@@ -335,14 +725,14 @@ class ClinicBot:
                         chat_id=chat_id, 
                         message_id=context.user_data['last_bot_message_id']
                     )
+                    self.message_expiry.forget(chat_id, [context.user_data['last_bot_message_id']])
                 except Exception as e:
                     logger.debug(f"No se pudo eliminar mensaje anterior: {e}")
             
             # Enviar nuevo mensaje
-            if update.callback_query:
-                # Si viene de un callback_query, editamos el mensaje existente
+            if query is not None and not in_place:
+                # Si viene de un callback_query (ya respondido al llegar), editamos el mensaje existente
                 try:
-                    await update.callback_query.answer()
                     message = await update.callback_query.message.edit_text(
                         text=text,
                         reply_markup=reply_markup
@@ -365,10 +755,12 @@ class ClinicBot:
             
             # Guardar el ID del nuevo mensaje
             context.user_data['last_bot_message_id'] = message.message_id
+            self.track_bot_message(message)
             
             return message
         except Exception as e:
             logger.error(f"Error en replace_message: {e}")
+            record_error(e)
             # Enviar un mensaje nuevo como último recurso
             try:
                 message = await context.bot.send_message(
@@ -377,24 +769,18 @@ class ClinicBot:
                     reply_markup=reply_markup
                 )
                 context.user_data['last_bot_message_id'] = message.message_id
+                self.track_bot_message(message)
                 return message
             except Exception as inner_e:
                 logger.error(f"Error crítico al enviar mensaje: {inner_e}")
+                record_error(inner_e)
                 return None
 
     async def create_main_menu_markup(self, lang: str) -> InlineKeyboardMarkup:
-        """Crea un markup de teclado para el menú principal"""
-        keyboard = []
-        menu_options = self.translation_manager.get_text('menu_options', lang)
-        
-        for i in range(0, len(menu_options), 2):
-            row = []
-            for j in range(i, min(i + 2, len(menu_options))):
-                row.append(InlineKeyboardButton(menu_options[j], callback_data=f"menu_{menu_options[j]}"))
-            keyboard.append(row)
-        
-        return InlineKeyboardMarkup(keyboard)
+        """Devuelve el teclado del menú principal, ya armado en la versión actual del menú"""
+        return self.menus.current.root_node.keyboard(lang)
 
+    @timed_handler
     async def show_main_menu(self, update: Update, context: CallbackContext, 
                              user_id: int, lang: str) -> None:
         """Muestra el menú principal, eliminando mensajes adicionales"""
@@ -413,35 +799,41 @@ class ClinicBot:
                         logger.debug(f"No se pudo eliminar mensaje adicional {msg_id}: {e}")
                 
                 # Limpiar la lista después de intentar eliminar todos los mensajes
+                self.message_expiry.forget(update.effective_chat.id, context.user_data['additional_messages'])
                 context.user_data['additional_messages'] = []
             except Exception as e:
                 logger.error(f"Error al eliminar mensajes adicionales: {e}")
+                record_error(e)
         
         # Crear teclado inline para el menú principal
-        reply_markup = await self.create_main_menu_markup(lang)
+        root = self.menus.current.root_node
+        reply_markup = root.keyboard(lang)
         
         try:
             await self.replace_message(
                 update, 
                 context, 
-                self.translation_manager.get_text('what_else', lang, name),
+                root.text(lang, name),
                 reply_markup=reply_markup
             )
         except Exception as e:
             logger.error(f"Error en show_main_menu: {e}")
+            record_error(e)
             try:
                 # Intentar enviar un nuevo mensaje en caso de error
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
-                    text=self.translation_manager.get_text('what_else', lang, name),
+                    text=root.text(lang, name),
                     reply_markup=reply_markup
                 )
             except Exception as inner_e:
                 logger.error(f"Error crítico en show_main_menu: {inner_e}")
+                record_error(inner_e)
     
+    @timed_handler
     async def send_photos(self, update: Update, context: CallbackContext, 
-                          sede: str, lang: str) -> None:
-        """Envía fotos de una sede específica"""
+                          sede: str, lang: str, sede_text: Optional[str] = None) -> None:
+        """Envía las fotos de la carpeta de una sede"""
         # Inicializar la lista de mensajes adicionales si no existe
         if 'additional_messages' not in context.user_data:
             context.user_data['additional_messages'] = []
@@ -452,13 +844,10 @@ class ClinicBot:
             callback_data="back_to_main"
         )]]
         
-        # Determinar carpeta según la sede
-        if sede == "sede_principal":
-            folder_name = "sede_principal"
-            sede_text = "Sede Principal"
-        else:
-            folder_name = "sede_secundaria"
-            sede_text = "Sede Secundaria"
+        # Carpeta de la sede y su nombre para los mensajes
+        folder_name = sede
+        if sede_text is None:
+            sede_text = "Sede Principal" if sede == "sede_principal" else "Sede Secundaria"
         
         # Enviar mensaje inicial
         mensaje_inicial = await context.bot.send_message(
@@ -467,10 +856,11 @@ class ClinicBot:
             reply_markup=InlineKeyboardMarkup(back_button)
         )
         context.user_data['additional_messages'].append(mensaje_inicial.message_id)
+        self.track_bot_message(mensaje_inicial)
         
         # Intentar enviar fotos
-        fotos_enviadas = False
-        photo_dir = os.path.join(Config.PHOTOS_DIR, folder_name)
+        fotos_enviadas = 0
+        photo_dir = os.path.join(self.config.PHOTOS_DIR, folder_name)
         
         # Verificar si la carpeta existe
         if os.path.exists(photo_dir) and os.path.isdir(photo_dir):
@@ -488,9 +878,13 @@ class ClinicBot:
                             photo=photo
                         )
                         context.user_data['additional_messages'].append(sent_photo.message_id)
-                        fotos_enviadas = True
+                        self.track_bot_message(sent_photo)
+                        fotos_enviadas += 1
                 except Exception as e:
                     logger.error(f"Error al enviar foto {photo_path}: {e}")
+                    record_error(e)
+        
+        self.analytics.emit('photo', update.effective_user.id, folder_name, fotos_enviadas)
         
         # Si no hay fotos o no se pudieron enviar
         if not fotos_enviadas:
@@ -499,22 +893,196 @@ class ClinicBot:
                 text=f"No se encontraron fotos para la {sede_text}."
             )
             context.user_data['additional_messages'].append(no_photos_msg.message_id)
+            self.track_bot_message(no_photos_msg)
             
-    async def clean_old_messages(self, context: CallbackContext):
-        """Limpia mensajes antiguos"""
-        for user_id, data in context.chat_data.items():
-            if 'last_bot_messages' in data:
-                for msg_id in data['last_bot_messages']:
-                    try:
-                        await context.bot.delete_message(chat_id=user_id, message_id=msg_id)
-                    except Exception as e:
-                        logger.debug(f"No se pudo eliminar mensaje antiguo: {e}")
-                data['last_bot_messages'] = []
+    def create_slots_markup(self, lang: str) -> InlineKeyboardMarkup:
+        """Crea un teclado con los próximos turnos libres y el botón de volver"""
+        keyboard = []
+        now = time.time()
+        for slot_id in self.calendar.iter_from(datetime.now().isoformat(timespec='minutes')):
+            if len(keyboard) >= self.config.MAX_SLOT_BUTTONS:
+                break
+            if self.reservation_manager.is_available(slot_id, now):
+                keyboard.append([InlineKeyboardButton(
+                    self.calendar.format_slot(slot_id),
+                    callback_data=f"slot_hold_{slot_id}"
+                )])
+        keyboard.append([InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")])
+        return InlineKeyboardMarkup(keyboard)
+    
+    @timed_handler
+    async def expire_slot_holds(self, context: CallbackContext):
+        """Libera las reservas temporales de turnos que vencieron"""
+        with self.user_data_manager.shared():
+            self.reservation_manager.expire_holds()
+    
+    @timed_handler
+    async def import_schedules(self, context: CallbackContext):
+        """Importa los horarios de la carpeta de horarios que hayan cambiado"""
+        await self.schedule_importer.import_directory_async(self.config.SCHEDULES_DIR)
+    
+    @timed_handler
+    async def purge_waitlist(self, context: CallbackContext):
+        """Elimina de la lista de espera las inscripciones cuyo rango de días ya pasó"""
+        with self.user_data_manager.shared():
+            if self.waitlist.purge_before(date.today()):
+                self.user_data_manager.save_data()
+    
+    async def flush_traces(self, context: CallbackContext):
+        """Escribe las trazas muestreadas en TRACE_FILE sin bloquear el bucle"""
+        await asyncio.to_thread(self.tracer.flush)
+    
+    async def flush_recorded_updates(self, context: CallbackContext):
+        """Escribe en UPDATE_RECORD_FILE las actualizaciones grabadas sin bloquear el bucle"""
+        await asyncio.to_thread(self.update_recorder.flush)
+    
+    async def flush_analytics(self, context: CallbackContext):
+        """Escribe los eventos de uso acumulados en ANALYTICS_DIR sin bloquear el bucle"""
+        await asyncio.to_thread(self.analytics.flush)
+    
+    async def release_collapsed_updates(self, context: CallbackContext):
+        """Vuelve a encolar el último /start o texto agrupado de cada usuario cuando recupera fichas"""
+        for update in self.rate_limiter.release():
+            await self.application.update_queue.put(update)
+    
+    async def reload_menu(self, context: CallbackContext):
+        """Cambia al menú nuevo si MENU_FILE se modificó; las conversaciones abiertas siguen con el suyo"""
+        self.menus.reload_if_changed()
+    
+    def on_slot_event(self, event: str, slot_id: str) -> None:
+        """Ofrece a la lista de espera los turnos cancelados y los rechazados o vencidos en una oferta"""
+        if event == 'cancelled':
+            self.reminders.cancel_booking(slot_id)
+        if event == 'cancelled' or slot_id in self.waitlist.offers:
+            self.application.create_task(self.offer_slot(slot_id))
+    
+    @timed_handler
+    async def offer_slot(self, slot_id: str) -> None:
+        """Aparta un turno liberado para el mejor paciente en espera y le envía la oferta"""
+        try:
+            with self.user_data_manager.shared():
+                slot = self.calendar.get_slot(slot_id)
+                entry_id = None
+                if slot is not None and self.reservation_manager.is_available(slot_id):
+                    entry_id = self.waitlist.match(slot)
+                # Quien rechazó o dejó vencer la oferta vuelve a la lista después de buscar al siguiente
+                self.waitlist.unclaim(slot_id)
+                if entry_id is None:
+                    self.user_data_manager.save_data()
+                    return
+                
+                entry = self.waitlist.entries[entry_id]
+                token = self.reservation_manager.hold(slot_id, entry['user_id'], ttl=self.config.WAITLIST_OFFER_TTL)
+                if token is None:
+                    self.user_data_manager.save_data()
+                    return
+                self.waitlist.claim(entry_id, slot_id)
+                self.user_data_manager.save_data()
+            
+            # Sin get_user: con el pool el usuario puede ser de otro proceso y no hay que crearle un registro vacío
+            user = self.user_data_manager.user_data.get(entry['user_id'], {})
+            lang = entry.get('language') or user.get('language', 'es')
+            name = entry.get('name') or user.get('name', '')
+            keyboard = [
+                [InlineKeyboardButton(self.translation_manager.get_text('accept', lang), callback_data=f"wl_ok_{slot_id}_{token}"),
+                 InlineKeyboardButton(self.translation_manager.get_text('decline', lang), callback_data=f"wl_no_{slot_id}_{token}")]
+            ]
+            await self.application.bot.send_message(
+                chat_id=entry['chat_id'],
+                text=self.translation_manager.get_text(
+                    'waitlist_offer', lang, name, slot['specialty'],
+                    self.calendar.format_slot(slot_id), self.config.WAITLIST_OFFER_TTL // 60
+                ),
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+        except Exception as e:
+            logger.error(f"Error al ofrecer el turno {slot_id} a la lista de espera: {e}")
+            record_error(e)
+    
+    @timed_handler
+    async def sweep_expired_messages(self, context: CallbackContext):
+        """Borra en lotes los mensajes del bot que vencieron, sin pasar de MESSAGE_DELETE_RATE"""
+        expiry = self.message_expiry
+        expiry.collect()
+        max_calls = max(1, int(self.config.MESSAGE_DELETE_RATE * self.config.MESSAGE_SWEEP_INTERVAL * 0.8))
+        batches = expiry.take(max_calls)
+        for number, (chat_id, message_ids) in enumerate(batches):
+            try:
+                await context.bot.delete_messages(chat_id=chat_id, message_ids=message_ids)
+                BOT_MESSAGES_DELETED.inc(len(message_ids))
+            except BadRequest as e:
+                # Mensajes ya borrados por el usuario: no se reintenta
+                logger.debug(f"No se pudieron eliminar mensajes vencidos del chat {chat_id}: {e}")
+            except (RetryAfter, NetworkError) as e:
+                # Este lote y los siguientes vuelven a la cola para el próximo barrido
+                for pending_chat, pending_ids in reversed(batches[number:]):
+                    expiry.requeue(pending_chat, pending_ids)
+                logger.warning(f"No se pudieron borrar mensajes vencidos, se reintenta luego: {e}")
+                break
+            except TelegramError as e:
+                # Chat bloqueado por el usuario: no se reintenta
+                logger.debug(f"No se pudieron eliminar mensajes vencidos del chat {chat_id}: {e}")
+            expiry.forget(chat_id, message_ids)
+            await asyncio.sleep(1 / self.config.MESSAGE_DELETE_RATE)
+        if expiry.dirty:
+            expiry.dirty = False
+            self.user_data_manager.save_data()
+    
+    @timed_handler
+    async def send_reminders(self, context: CallbackContext):
+        """Envía los recordatorios de citas vencidos, sin pasar de REMINDER_RATE mensajes por segundo"""
+        with self.user_data_manager.shared():
+            due = self.reminders.take(self.config.REMINDER_BATCH)
+            if not due:
+                return
+            self.user_data_manager.save_data()
+        retry = []
+        for number, reminder in enumerate(due):
+            text = self.translation_manager.get_text(
+                f"reminder_{reminder['kind']}", reminder['lang'], reminder['name'],
+                self.calendar.format_slot(reminder['slot_id'])
+            )
+            try:
+                await context.bot.send_message(chat_id=reminder['user_id'], text=text)
+                REMINDERS_SENT.labels(reminder['kind']).inc()
+            except BadRequest as e:
+                logger.debug(f"No se pudo enviar el recordatorio a {reminder['user_id']}: {e}")
+            except (RetryAfter, NetworkError) as e:
+                # Este y los siguientes vuelven a la cola para la próxima revisión
+                retry = due[number:]
+                logger.warning(f"No se pudieron enviar recordatorios, se reintenta luego: {e}")
+                break
+            except TelegramError as e:
+                # Usuario que bloqueó el bot: no se reintenta
+                logger.debug(f"No se pudo enviar el recordatorio a {reminder['user_id']}: {e}")
+            await asyncio.sleep(1 / self.config.REMINDER_RATE)
+        with self.user_data_manager.shared():
+            for reminder in due[:len(due) - len(retry)]:
+                self.reminders.done(reminder)
+            for reminder in retry:
+                self.reminders.requeue(reminder)
+            self.user_data_manager.save_data()
+    
+    async def run_broadcasts(self, context: CallbackContext):
+        """Empieza o retoma el envío de un anuncio pendiente (en segundo plano)"""
+        try:
+            self.broadcasts.start_pending(context.bot)
+        except Exception as e:
+            logger.error(f"Error al iniciar el anuncio: {e}")
+            record_error(e)
+
+    def track_bot_message(self, message) -> None:
+        """Registra un mensaje enviado por el bot para borrarlo cuando venza"""
+        if message is not None and getattr(message, 'message_id', None) is not None:
+            sent_at = message.date.timestamp() if message.date else None
+            self.message_expiry.track(message.chat_id, message.message_id, sent_at)
                 
     # Parte de la clase ClinicBot - Funciones de inicialización y menú principal
+    @timed_handler
     async def start(self, update: Update, context: CallbackContext) -> int:
         """Inicia o reinicia la conversación con el bot"""
         user_id = update.effective_user.id
+        self.analytics.emit('session', user_id, 'returning' if user_id in self.user_data_manager.user_data else 'new')
         
         # Inicializar user_data para este usuario si no existe
         if not context.user_data:
@@ -561,6 +1129,7 @@ class ClinicBot:
                     )
             except Exception as e:
                 logger.error(f"Error en start para usuario existente: {e}")
+                record_error(e)
                 # Intentar enviar un mensaje básico en caso de error
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
@@ -584,6 +1153,7 @@ class ClinicBot:
             )
         except Exception as e:
             logger.error(f"Error en start para nuevo usuario: {e}")
+            record_error(e)
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text=self.translation_manager.get_text('welcome', 'es'),
@@ -592,6 +1162,7 @@ class ClinicBot:
         
         return States.NOMBRE
     
+    @timed_handler
     async def select_language(self, update: Update, context: CallbackContext) -> int:
         """Permite al usuario seleccionar su idioma preferido"""
         user_id = update.effective_user.id
@@ -616,6 +1187,7 @@ class ClinicBot:
             )
         except Exception as e:
             logger.error(f"Error en select_language: {e}")
+            record_error(e)
             await context.bot.send_message(
                 chat_id=update.effective_chat.id,
                 text=self.translation_manager.get_text('language_selection', 'es'),
@@ -624,6 +1196,7 @@ class ClinicBot:
         
         return States.IDIOMA
     
+    @timed_handler
     async def handle_language_selection(self, update: Update, context: CallbackContext) -> int:
         """Maneja la selección de idioma del usuario"""
         try:
@@ -650,6 +1223,7 @@ class ClinicBot:
             return States.MENU_PRINCIPAL
         except Exception as e:
             logger.error(f"Error en handle_language_selection: {e}")
+            record_error(e)
             # Intentar recuperarse del error
             user_id = update.effective_user.id
             lang = 'es'  # Valor predeterminado en caso de error
@@ -665,6 +1239,7 @@ class ClinicBot:
             return await self.start(update, context)
         
     # Parte de la clase ClinicBot - Manejadores del menú principal y submenús
+    @timed_handler
     async def handle_main_menu_callback(self, update: Update, context: CallbackContext) -> int:
         """Maneja las opciones del menú principal"""
         try:
@@ -674,28 +1249,25 @@ class ClinicBot:
             lang = self.user_data_manager.get_language(user_id)
             name = self.user_data_manager.get_name(user_id)
             
-            # Registrar el contexto actual para recuperación de sesión
-            data = query.data.split('_', 1)[1] if '_' in query.data else query.data
-            self.user_data_manager.save_conversation_state(user_id, States.MENU_PRINCIPAL, data)
-            
             # Manejar la opción "Reanudar sesión"
             if query.data == "resume_yes":
-                state = self.user_data_manager.get_conversation_state(user_id)
-                context_text = state.get('context', '')
+                self.analytics.emit('menu', user_id, query.data)
+                state = self.user_data_manager.get_conversation_state(user_id) or {}
                 
                 try:
-                    # Simular la selección del menú correspondiente
-                    if context_text in self.translation_manager.get_text('menu_options', lang):
-                        # Simular un callback para la opción del menú
-                        query.data = f"menu_{context_text}"
-                        # Y luego procesamos normalmente
-                        return await self.handle_main_menu_callback(update, context)
-                    else:
-                        # Volver al menú principal si no se puede determinar el contexto
-                        await self.show_main_menu(update, context, user_id, lang)
-                        return States.MENU_PRINCIPAL
+                    # El nodo guardado o, en estados anteriores al menú declarativo, la opción del menú principal
+                    graph = self.menus.current
+                    node = graph.nodes.get(state.get('node') or '')
+                    if node is None:
+                        graph, node = self.menus.resolve(f"menu_{state.get('context', '')}")
+                    if node is not None:
+                        return await self.show_menu_node(update, context, graph, node, user_id, lang, name)
+                    # Volver al menú principal si no se puede determinar el contexto
+                    await self.show_main_menu(update, context, user_id, lang)
+                    return States.MENU_PRINCIPAL
                 except Exception as e:
                     logger.error(f"Error al reanudar sesión: {e}")
+                    record_error(e)
                     # Si falla, enviamos un nuevo mensaje
                     await context.bot.send_message(
                         chat_id=update.effective_chat.id,
@@ -704,105 +1276,27 @@ class ClinicBot:
                     )
                     return States.MENU_PRINCIPAL
                     
-            elif query.data == "resume_no":
+            elif query.data in ("resume_no", "back_to_main"):
+                # "back_to_main" llega aquí si se canceló el submenú que lo mostró (ver update_processor.py)
+                self.analytics.emit('menu', user_id, query.data)
                 await self.show_main_menu(update, context, user_id, lang)
                 return States.MENU_PRINCIPAL
             
-            # Manejar las opciones del menú principal
-            menu_options = self.translation_manager.get_text('menu_options', lang)
-            
-            if "Horarios" in data or "Hours" in data:
-                keyboard = []
-                hours_options = self.translation_manager.get_text('hours', lang)
-                for option in hours_options:
-                    keyboard.append([InlineKeyboardButton(option, callback_data=f"submenu_{option}")])
-                keyboard.append([InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('select_hours', lang, name),
-                    reply_markup=reply_markup
-                )
-                return States.SUBMENU
-                
-            elif "Contacto" in data or "Contact" in data:
-                keyboard = []
-                contact_options = self.translation_manager.get_text('contact', lang)
-                for option in contact_options:
-                    keyboard.append([InlineKeyboardButton(option, callback_data=f"submenu_{option}")])
-                keyboard.append([InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('select_contact', lang, name),
-                    reply_markup=reply_markup
-                )
-                return States.SUBMENU
-                
-            elif "Servicios" in data or "Services" in data:
-                keyboard = []
-                services_options = self.translation_manager.get_text('services', lang)
-                for option in services_options:
-                    keyboard.append([InlineKeyboardButton(option, callback_data=f"submenu_{option}")])
-                keyboard.append([InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('select_services', lang, name),
-                    reply_markup=reply_markup
-                )
-                return States.SUBMENU
-                
-            elif "Ubicación" in data or "Location" in data:
-                # Mostrar directamente las opciones de sedes
-                keyboard = []
-                location_options = self.translation_manager.get_text('location', lang)
-                for option in location_options:
-                    keyboard.append([InlineKeyboardButton(option, callback_data=f"location_{option}")])
-                keyboard.append([InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")])
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('select_location', lang, name),
-                    reply_markup=reply_markup
-                )
-                return States.SUBMENU
-            
-            elif "Ver fotos" in data or "See Photos" in data:
-                # Mostrar opciones para elegir de qué sede ver las fotos
-                keyboard = [
-                    [InlineKeyboardButton("Sede Principal", callback_data="fotos_sede_principal")],
-                    [InlineKeyboardButton("Sede Secundaria", callback_data="fotos_sede_secundaria")],
-                    [InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")]
-                ]
-                reply_markup = InlineKeyboardMarkup(keyboard)
-                
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('select_photos', lang, name),
-                    reply_markup=reply_markup
-                )
-                return States.SUBMENU
+            # Opciones del menú declarativo (y botones de mensajes anteriores)
+            graph, node = self.menus.resolve(query.data)
+            if node is not None:
+                return await self.show_menu_node(update, context, graph, node, user_id, lang, name)
             
-            else:
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('choose_menu_option', lang, name),
-                    reply_markup=await self.create_main_menu_markup(lang)
-                )
-                return States.MENU_PRINCIPAL
+            await self.replace_message(
+                update, 
+                context, 
+                self.translation_manager.get_text('choose_menu_option', lang, name),
+                reply_markup=await self.create_main_menu_markup(lang)
+            )
+            return States.MENU_PRINCIPAL
         except Exception as e:
             logger.error(f"Error en handle_main_menu_callback: {e}")
+            record_error(e)
             # Intentar recuperarse del error
             try:
                 user_id = update.effective_user.id
@@ -821,8 +1315,10 @@ class ClinicBot:
                 return States.MENU_PRINCIPAL
             except Exception as inner_e:
                 logger.error(f"Error crítico en handle_main_menu_callback: {inner_e}")
+                record_error(inner_e)
                 return States.MENU_PRINCIPAL
                 
+    @timed_handler
     async def handle_submenu_callback(self, update: Update, context: CallbackContext) -> int:
         """Maneja las opciones de los submenús"""
         try:
@@ -832,181 +1328,204 @@ class ClinicBot:
             lang = self.user_data_manager.get_language(user_id)
             name = self.user_data_manager.get_name(user_id)
             
-            # Registrar el contexto actual
-            data = query.data.split('_', 1)[1] if '_' in query.data else query.data
-            self.user_data_manager.save_conversation_state(user_id, States.SUBMENU, data)
-            
-            # Preparar botón de volver al menú principal
-            back_button = [[InlineKeyboardButton(
-                self.translation_manager.get_text('back', lang), 
-                callback_data="back_to_main"
-            )]]
-            
             # Volver al menú principal
             if query.data == "back_to_main":
+                self.analytics.emit('submenu', user_id, query.data)
                 await self.show_main_menu(update, context, user_id, lang)
                 return States.MENU_PRINCIPAL
             
-            # Obtener opciones traducidas
-            hours_options = self.translation_manager.get_text('hours', lang)
-            contact_options = self.translation_manager.get_text('contact', lang)
-            services_options = self.translation_manager.get_text('services', lang)
-            location_options = self.translation_manager.get_text('location', lang)
+            # Opciones del menú declarativo (y botones de mensajes anteriores)
+            graph, node = self.menus.resolve(query.data)
+            if node is not None:
+                return await self.show_menu_node(update, context, graph, node, user_id, lang, name)
             
-            # Horarios
-            if hours_options[0] in data:  # Horario de atención / Opening hours
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('opening_hours', lang, name),
-                    reply_markup=InlineKeyboardMarkup(back_button)
-                )
-                return States.SUBMENU
-                
-            elif hours_options[1] in data:  # Horario de citas / Appointment hours
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('appointment_hours', lang, name),
-                    reply_markup=InlineKeyboardMarkup(back_button)
+            await self.replace_message(
+                update, 
+                context, 
+                self.translation_manager.get_text('choose_menu_option', lang, name),
+                reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                    self.translation_manager.get_text('back', lang), 
+                    callback_data="back_to_main"
+                )]])
+            )
+            return States.SUBMENU
+        except Exception as e:
+            logger.error(f"Error en handle_submenu_callback: {e}")
+            record_error(e)
+            # Intentar recuperarse del error
+            try:
+                user_id = update.effective_user.id
+                lang = self.user_data_manager.get_language(user_id)
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text=self.translation_manager.get_text('error_message', lang)
                 )
-                return States.SUBMENU
-            
-            # Contacto
-            elif contact_options[0] in data:  # Teléfono / Phone
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('phone', lang, name),
-                    reply_markup=InlineKeyboardMarkup(back_button)
+                # Mostrar menú principal como último recurso
+                keyboard = await self.create_main_menu_markup(lang)
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text=self.translation_manager.get_text('what_else', lang, self.user_data_manager.get_name(user_id)),
+                    reply_markup=keyboard
                 )
-                return States.SUBMENU
-                
-            elif contact_options[1] in data:  # Correo electrónico / Email
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('email', lang, name),
-                    reply_markup=InlineKeyboardMarkup(back_button)
+                return States.MENU_PRINCIPAL
+            except Exception as inner_e:
+                logger.error(f"Error crítico en handle_submenu_callback: {inner_e}")
+                record_error(inner_e)
+                return States.MENU_PRINCIPAL
+    
+    async def show_menu_node(self, update: Update, context: CallbackContext, graph: MenuGraph,
+                             node: MenuNode, user_id: int, lang: str, name: str) -> int:
+        """Responde con un nodo del menú compilado y devuelve el estado siguiente"""
+        if node.id == graph.root:
+            await self.show_main_menu(update, context, user_id, lang)
+            return States.MENU_PRINCIPAL
+        
+        # Registrar el contexto actual para recuperación de sesión
+        self.analytics.emit('menu' if node.parent == graph.root else 'submenu', user_id, node.id)
+        self.user_data_manager.save_conversation_state(user_id, States.SUBMENU, node.label(lang), node.id)
+        
+        if node.kind in ('menu', 'text'):
+            await self.replace_message(update, context, node.text(lang, name), reply_markup=node.keyboard(lang))
+        
+        elif node.kind == 'slots':
+            await self.replace_message(update, context, node.text(lang, name), reply_markup=self.create_slots_markup(lang))
+        
+        elif node.kind == 'directory':
+            text, reply_markup = self.render_directory_page('s', 0, '', lang, name)
+            await self.replace_message(update, context, text, reply_markup=reply_markup)
+        
+        elif node.kind == 'location':
+            # Primero el mensaje con botón de volver y luego la ubicación, que se rastrea
+            await self.replace_message(update, context, node.text(lang, name), reply_markup=node.keyboard(lang))
+            await self.send_and_track_message(
+                update, 
+                context, 
+                context.bot.send_location,
+                chat_id=update.effective_chat.id,
+                latitude=node.params['latitude'],
+                longitude=node.params['longitude']
+            )
+        
+        elif node.kind == 'photos':
+            try:
+                await self.send_photos(update, context, node.params['folder'], lang, node.label(lang))
+            except Exception as e:
+                logger.error(f"Error al enviar fotos de {node.params['folder']}: {e}")
+                record_error(e)
+                error_msg = await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text=f"Error al cargar las fotos: {str(e)}"
                 )
-                return States.SUBMENU
+                if 'additional_messages' not in context.user_data:
+                    context.user_data['additional_messages'] = []
+                context.user_data['additional_messages'].append(error_msg.message_id)
+                self.track_bot_message(error_msg)
+        
+        return States.SUBMENU
             
-            # Servicios
-            elif services_options[0] in data:  # Consulta general / General consultation
-                await self.replace_message(
-                    update, 
-                    context, 
-                    self.translation_manager.get_text('general_consultation', lang, name),
-                    reply_markup=InlineKeyboardMarkup(back_button)
-                )
-                return States.SUBMENU
+    @timed_handler
+    async def handle_slot_callback(self, update: Update, context: CallbackContext) -> int:
+        """Maneja la reserva, confirmación y liberación de turnos"""
+        try:
+            query = update.callback_query
+            
+            user_id = update.effective_user.id
+            lang = self.user_data_manager.get_language(user_id)
+            name = self.user_data_manager.get_name(user_id)
+            
+            # slot_hold_<slot_id> | slot_ok_<slot_id>_<token> | slot_no_<slot_id>_<token> | slot_cancel_<slot_id>
+            parts = query.data.split('_')
+            action, slot_id = parts[1], parts[2]
+            token = parts[3] if len(parts) > 3 else ''
+            slot_text = self.calendar.format_slot(slot_id)
+            
+            if action == "hold":
+                with self.user_data_manager.shared():
+                    if self.calendar.get_slot(slot_id) is None:
+                        token = None
+                    else:
+                        token = self.reservation_manager.hold(slot_id, user_id)
+                
+                if token is None:
+                    await self.replace_message(
+                        update, 
+                        context, 
+                        self.translation_manager.get_text('slot_taken', lang, name),
+                        reply_markup=self.create_slots_markup(lang)
+                    )
+                    return States.SUBMENU
                 
-            elif services_options[1] in data:  # Especialidades / Specialties
+                keyboard = [
+                    [InlineKeyboardButton(self.translation_manager.get_text('confirm', lang), callback_data=f"slot_ok_{slot_id}_{token}"),
+                     InlineKeyboardButton(self.translation_manager.get_text('cancel', lang), callback_data=f"slot_no_{slot_id}_{token}")]
+                ]
                 await self.replace_message(
                     update, 
                     context, 
-                    self.translation_manager.get_text('specialties', lang, name),
-                    reply_markup=InlineKeyboardMarkup(back_button)
+                    self.translation_manager.get_text('slot_held', lang, name, slot_text, self.config.HOLD_TTL),
+                    reply_markup=InlineKeyboardMarkup(keyboard)
                 )
                 return States.SUBMENU
             
-            # Ubicación
-            elif location_options[0] in data or "Sede Principal" in data or "Main Office" in data:
-                # Mostrar información y mapa de la sede principal
-                mensaje = "Sede Principal:\nCalle 9 #15-25, Neiva, Huila."
-                
-                # Primero enviamos el mensaje con botón de volver
-                await self.replace_message(
-                    update, 
-                    context, 
-                    mensaje,
-                    reply_markup=InlineKeyboardMarkup(back_button)
-                )
-                
-                try:
-                    # Luego enviamos la ubicación y la rastreamos
-                    await self.send_and_track_message(
+            elif action == "ok":
+                with self.user_data_manager.shared():
+                    booked = self.reservation_manager.confirm(slot_id, user_id, token)
+                    if booked:
+                        # Quien ya reservó deja de esperar un turno de esa especialidad
+                        slot = self.calendar.get_slot(slot_id)
+                        if slot is not None:
+                            self.waitlist.retire(user_id, slot['specialty'])
+                        self.reminders.schedule_booking(slot_id, user_id, lang, name)
+                        self.user_data_manager.save_data()
+                if booked:
+                    self.user_data_manager.save_conversation_state(user_id, States.SUBMENU, f"cita {slot_text}")
+                    await self.replace_message(
                         update, 
                         context, 
-                        context.bot.send_location,
-                        chat_id=update.effective_chat.id,
-                        latitude=self.translation_manager.locations['main_office'][0],
-                        longitude=self.translation_manager.locations['main_office'][1]
+                        self.translation_manager.get_text('slot_booked', lang, name, slot_text),
+                        reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                            self.translation_manager.get_text('back', lang), 
+                            callback_data="back_to_main"
+                        )]])
+                    )
+                else:
+                    await self.replace_message(
+                        update, 
+                        context, 
+                        self.translation_manager.get_text('slot_hold_expired', lang, name),
+                        reply_markup=self.create_slots_markup(lang)
                     )
-                except Exception as e:
-                    logger.error(f"Error al enviar ubicación: {e}")
-                
                 return States.SUBMENU
-                
-            elif location_options[1] in data or "Sede Secundaria" in data or "Secondary Office" in data:
-                # Mostrar información y mapa de la sede secundaria
-                mensaje = "Sede Secundaria:\nCl. 9 #15-25, Neiva, Huila."
-                
-                # Primero enviamos el mensaje con botón de volver
+            
+            elif action == "cancel":
+                with self.user_data_manager.shared():
+                    cancelled = self.reservation_manager.cancel_booking(slot_id, user_id)
+                # Botón viejo, cita ajena o ya cancelada: no se informa una cancelación que no ocurrió
                 await self.replace_message(
                     update, 
                     context, 
-                    mensaje,
-                    reply_markup=InlineKeyboardMarkup(back_button)
+                    self.translation_manager.get_text('slot_cancelled' if cancelled else 'booking_not_found',
+                                                      lang, name, slot_text),
+                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                        self.translation_manager.get_text('back', lang), 
+                        callback_data="back_to_main"
+                    )]])
                 )
-                
-                try:
-                    # Luego enviamos la ubicación y la rastreamos
-                    await self.send_and_track_message(
-                        update, 
-                        context, 
-                        context.bot.send_location,
-                        chat_id=update.effective_chat.id,
-                        latitude=self.translation_manager.locations['secondary_office'][0],
-                        longitude=self.translation_manager.locations['secondary_office'][1]
-                    )
-                except Exception as e:
-                    logger.error(f"Error al enviar ubicación: {e}")
-                
                 return States.SUBMENU
             
-            # Fotos
-            elif "fotos_sede_principal" in query.data:
-                try:
-                    await self.send_photos(update, context, "sede_principal", lang)
-                except Exception as e:
-                    logger.error(f"Error al enviar fotos de sede principal: {e}")
-                    error_msg = await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text=f"Error al cargar las fotos: {str(e)}"
-                    )
-                    if 'additional_messages' not in context.user_data:
-                        context.user_data['additional_messages'] = []
-                    context.user_data['additional_messages'].append(error_msg.message_id)
-                
-                return States.SUBMENU
-                
-            elif "fotos_sede_secundaria" in query.data:
-                try:
-                    await self.send_photos(update, context, "sede_secundaria", lang)
-                except Exception as e:
-                    logger.error(f"Error al enviar fotos de sede secundaria: {e}")
-                    error_msg = await context.bot.send_message(
-                        chat_id=update.effective_chat.id,
-                        text=f"Error al cargar las fotos: {str(e)}"
-                    )
-                    if 'additional_messages' not in context.user_data:
-                        context.user_data['additional_messages'] = []
-                    context.user_data['additional_messages'].append(error_msg.message_id)
-                
-                return States.SUBMENU
-                
             else:
+                with self.user_data_manager.shared():
+                    self.reservation_manager.release(slot_id, user_id, token)
                 await self.replace_message(
                     update, 
                     context, 
-                    self.translation_manager.get_text('choose_menu_option', lang, name),
-                    reply_markup=InlineKeyboardMarkup(back_button)
+                    self.translation_manager.get_text('slot_released', lang, name),
+                    reply_markup=self.create_slots_markup(lang)
                 )
                 return States.SUBMENU
         except Exception as e:
-            logger.error(f"Error en handle_submenu_callback: {e}")
-            # Intentar recuperarse del error
+            logger.error(f"Error en handle_slot_callback: {e}")
+            record_error(e)
             try:
                 user_id = update.effective_user.id
                 lang = self.user_data_manager.get_language(user_id)
@@ -1014,20 +1533,312 @@ class ClinicBot:
                     chat_id=update.effective_chat.id,
                     text=self.translation_manager.get_text('error_message', lang)
                 )
-                # Mostrar menú principal como último recurso
                 keyboard = await self.create_main_menu_markup(lang)
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
                     text=self.translation_manager.get_text('what_else', lang, self.user_data_manager.get_name(user_id)),
                     reply_markup=keyboard
                 )
-                return States.MENU_PRINCIPAL
             except Exception as inner_e:
-                logger.error(f"Error crítico en handle_submenu_callback: {inner_e}")
-                return States.MENU_PRINCIPAL
+                logger.error(f"Error crítico en handle_slot_callback: {inner_e}")
+                record_error(inner_e)
+            return States.MENU_PRINCIPAL
+            
+    def render_directory_page(self, view: str, page: int, arg: str,
+                              lang: str, name: str) -> Tuple[str, InlineKeyboardMarkup]:
+        """Construye el texto y el teclado de una página del directorio.
+
+        Vistas: 's' especialidades, 'd' médicos de una especialidad (arg = id),
+        'q' resultados de búsqueda (arg = consulta), 'e' ficha de una entrada (arg = id).
+        """
+        back_row = [InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")]
+        directory_row = [InlineKeyboardButton(
+            self.translation_manager.get_text('directory_back', lang),
+            callback_data=self.paginator.encode('s', 0)
+        )]
+        
+        def entry_button(key: str) -> InlineKeyboardButton:
+            entry = self.directory.get(key)
+            if entry.kind == 'specialty':
+                return InlineKeyboardButton(entry.name, callback_data=self.paginator.encode('d', 0, key))
+            return InlineKeyboardButton(f"{entry.name} · {entry.specialty}", callback_data=self.paginator.encode('e', 0, key))
+        
+        if view == 'e':
+            entry = self.directory.get(arg)
+            if entry is not None and entry.kind == 'doctor':
+                text = self.translation_manager.get_text(
+                    'directory_doctor', lang, entry.name, entry.specialty,
+                    ', '.join(sorted(sede.replace('_', ' ').title() for sede in entry.sedes))
+                )
+                return text, InlineKeyboardMarkup([directory_row, back_row])
+            view, page = 's', 0
+        
+        if view == 'd':
+            entry = self.directory.get(arg)
+            if entry is not None:
+                text = self.translation_manager.get_text('directory_doctors', lang, name, entry.name)
+                items = self.directory.doctors_of(arg)
+                return text, self.paginator.build(items, page, view, arg, entry_button, [directory_row, back_row])
+            view, page = 's', 0
+        
+        if view == 'q':
+            items = self.directory.search(arg)
+            if not items:
+                text = self.translation_manager.get_text('directory_no_results', lang, name, arg)
+                return text, InlineKeyboardMarkup([directory_row, back_row])
+            text = self.translation_manager.get_text('directory_results', lang, name, arg)
+            return text, self.paginator.build(items, page, view, arg, entry_button, [back_row])
+        
+        text = self.translation_manager.get_text('directory_specialties', lang, name)
+        items = self.directory.list_specialties()
+        return text, self.paginator.build(items, page, 's', '', entry_button, [back_row])
+    
+    @timed_handler
+    async def handle_directory_callback(self, update: Update, context: CallbackContext) -> int:
+        """Navega por el directorio: cada página es una sola edición del mensaje"""
+        try:
+            query = update.callback_query
+            
+            user_id = update.effective_user.id
+            lang = self.user_data_manager.get_language(user_id)
+            name = self.user_data_manager.get_name(user_id)
+            
+            cursor = self.paginator.decode(query.data) or ('s', 0, '')
+            text, reply_markup = self.render_directory_page(*cursor, lang, name)
+            
+            await self.replace_message(update, context, text, reply_markup=reply_markup)
+            return States.SUBMENU
+        except Exception as e:
+            logger.error(f"Error en handle_directory_callback: {e}")
+            record_error(e)
+            try:
+                user_id = update.effective_user.id
+                lang = self.user_data_manager.get_language(user_id)
+                await context.bot.send_message(
+                    chat_id=update.effective_chat.id,
+                    text=self.translation_manager.get_text('what_else', lang, self.user_data_manager.get_name(user_id)),
+                    reply_markup=await self.create_main_menu_markup(lang)
+                )
+            except Exception as inner_e:
+                logger.error(f"Error crítico en handle_directory_callback: {inner_e}")
+                record_error(inner_e)
+            return States.MENU_PRINCIPAL
+    
+    @timed_handler
+    async def handle_directory_search(self, update: Update, context: CallbackContext) -> int:
+        """Busca médicos o especialidades: /buscar <texto>"""
+        try:
+            user_id = update.effective_user.id
+            lang = self.user_data_manager.get_language(user_id)
+            name = self.user_data_manager.get_name(user_id)
+            
+            search_text = ' '.join(context.args or []).strip()
+            if not search_text:
+                await self.replace_message(
+                    update, 
+                    context, 
+                    self.translation_manager.get_text('directory_search_usage', lang, name),
+                    reply_markup=InlineKeyboardMarkup([[InlineKeyboardButton(
+                        self.translation_manager.get_text('back', lang), 
+                        callback_data="back_to_main"
+                    )]])
+                )
+                return States.SUBMENU
+            
+            # La consulta viaja dentro del callback_data, así que se recorta al mismo límite
+            search_text = self.paginator.decode(self.paginator.encode('q', 0, search_text))[2]
+            text, reply_markup = self.render_directory_page('q', 0, search_text, lang, name)
+            await self.replace_message(update, context, text, reply_markup=reply_markup)
+            return States.SUBMENU
+        except Exception as e:
+            logger.error(f"Error en handle_directory_search: {e}")
+            record_error(e)
+            return States.MENU_PRINCIPAL
+            
+    @timed_handler
+    async def handle_my_appointments(self, update: Update, context: CallbackContext) -> int:
+        """Lista las citas confirmadas del usuario con un botón para cancelar cada una"""
+        try:
+            user_id = update.effective_user.id
+            lang = self.user_data_manager.get_language(user_id)
+            name = self.user_data_manager.get_name(user_id)
+            
+            bookings = sorted(self.reservation_manager.bookings_for_user(user_id),
+                              key=lambda slot_id: (self.calendar.get_slot(slot_id) or {}).get('start', ''))
+            keyboard = [[InlineKeyboardButton(
+                f"✖ {self.calendar.format_slot(slot_id)}",
+                callback_data=f"slot_cancel_{slot_id}"
+            )] for slot_id in bookings]
+            keyboard.append([InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")])
+            
+            await self.replace_message(
+                update, 
+                context, 
+                self.translation_manager.get_text('my_appointments' if bookings else 'no_appointments', lang, name),
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            return States.SUBMENU
+        except Exception as e:
+            logger.error(f"Error en handle_my_appointments: {e}")
+            record_error(e)
+            return States.MENU_PRINCIPAL
+    
+    @timed_handler
+    async def handle_waitlist_join(self, update: Update, context: CallbackContext) -> int:
+        """Inscribe al usuario en la lista de espera: /espera <especialidad> [sede] [mañana|tarde]"""
+        try:
+            user_id = update.effective_user.id
+            lang = self.user_data_manager.get_language(user_id)
+            name = self.user_data_manager.get_name(user_id)
+            back_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+                self.translation_manager.get_text('back', lang), 
+                callback_data="back_to_main"
+            )]])
+            
+            sede, part, words = None, None, []
+            for word in context.args or []:
+                token = word.lower().replace('ñ', 'n')
+                if token in ('principal', 'secundaria'):
+                    sede = f"sede_{token}"
+                elif token in ('manana', 'morning'):
+                    part = 0
+                elif token in ('tarde', 'afternoon'):
+                    part = 1
+                else:
+                    words.append(word)
+            
+            specialty = None
+            for key in self.directory.search(' '.join(words)) if words else []:
+                entry = self.directory.get(key)
+                if entry.kind == 'specialty':
+                    specialty = entry.name
+                    break
+            
+            if specialty is None:
+                await self.replace_message(
+                    update, 
+                    context, 
+                    self.translation_manager.get_text('waitlist_usage', lang, name),
+                    reply_markup=back_markup
+                )
+                return States.SUBMENU
+            
+            first_day = date.today()
+            last_day = first_day + timedelta(days=self.config.WAITLIST_DAYS)
+            with self.user_data_manager.shared():
+                self.waitlist.add(user_id, update.effective_chat.id, specialty, sede, first_day, last_day, part,
+                                  language=lang, name=name)
+            
+            await self.replace_message(
+                update, 
+                context, 
+                self.translation_manager.get_text('waitlist_joined', lang, name, specialty, f"{last_day:%d/%m}"),
+                reply_markup=back_markup
+            )
+            return States.SUBMENU
+        except Exception as e:
+            logger.error(f"Error en handle_waitlist_join: {e}")
+            record_error(e)
+            return States.MENU_PRINCIPAL
+    
+    @timed_handler
+    async def handle_waitlist_callback(self, update: Update, context: CallbackContext) -> None:
+        """Procesa la respuesta a una oferta de la lista de espera"""
+        try:
+            query = update.callback_query
+            
+            user_id = update.effective_user.id
+            lang = self.user_data_manager.get_language(user_id)
+            name = self.user_data_manager.get_name(user_id)
+            
+            # wl_ok_<slot_id>_<token> | wl_no_<slot_id>_<token>
+            _, action, slot_id, token = query.data.split('_', 3)
+            back_markup = InlineKeyboardMarkup([[InlineKeyboardButton(
+                self.translation_manager.get_text('back', lang), 
+                callback_data="back_to_main"
+            )]])
+            
+            if action == "ok":
+                with self.user_data_manager.shared():
+                    booked = self.reservation_manager.confirm(slot_id, user_id, token)
+                    if booked:
+                        self.waitlist.fulfil(slot_id)
+                        self.reminders.schedule_booking(slot_id, user_id, lang, name)
+                        self.user_data_manager.save_data()
+                if booked:
+                    text = self.translation_manager.get_text('waitlist_booked', lang, name, self.calendar.format_slot(slot_id))
+                else:
+                    text = self.translation_manager.get_text('waitlist_expired', lang, name)
+            else:
+                # Liberar la reserva dispara la oferta al siguiente paciente en espera
+                with self.user_data_manager.shared():
+                    self.reservation_manager.release(slot_id, user_id, token)
+                text = self.translation_manager.get_text('waitlist_declined', lang, name)
+            
+            await self.replace_message(update, context, text, reply_markup=back_markup)
+        except Exception as e:
+            logger.error(f"Error en handle_waitlist_callback: {e}")
+            record_error(e)
             
     # Parte de la clase ClinicBot - Otros comandos y manejo de errores
 
+    @timed_handler
+    async def handle_inline_query(self, update: Update, context: CallbackContext) -> None:
+        """Responde "@bot horarios" desde los resultados precalculados del idioma del usuario"""
+        try:
+            query = update.inline_query
+            user = self.user_data_manager.user_data.get(query.from_user.id)
+            lang = user.get('language', 'es') if user else (query.from_user.language_code or 'es')[:2]
+            # Personal porque el idioma depende del usuario; Telegram repite la respuesta sin consultarnos
+            await query.answer(
+                self.inline_results.answer(query.query, lang),
+                cache_time=self.config.INLINE_CACHE_TIME,
+                is_personal=True
+            )
+        except Exception as e:
+            logger.error(f"Error en handle_inline_query: {e}")
+            record_error(e)
+    
+    @timed_handler
+    async def handle_location(self, update: Update, context: CallbackContext) -> None:
+        """Responde a una ubicación compartida con la sede más cercana y cómo llegar"""
+        try:
+            user_id = update.effective_user.id
+            lang = self.user_data_manager.get_language(user_id)
+            name = self.user_data_manager.get_name(user_id)
+            location = update.effective_message.location
+            nearest = self.sedes.nearest(location.latitude, location.longitude)
+            if nearest is None:
+                return
+            sede, distance = nearest
+            self.analytics.emit('location', user_id, sede.key, round(distance, 1))
+            
+            keyboard = [
+                [InlineKeyboardButton(self.translation_manager.get_text('directions', lang),
+                                      url=directions_url(location.latitude, location.longitude, sede))],
+                [InlineKeyboardButton(self.translation_manager.get_text('back', lang), callback_data="back_to_main")]
+            ]
+            await self.replace_message(
+                update, 
+                context, 
+                self.translation_manager.get_text('nearest_office', lang, name, sede.name(lang), distance, sede.address),
+                reply_markup=InlineKeyboardMarkup(keyboard)
+            )
+            await self.send_and_track_message(
+                update, 
+                context, 
+                context.bot.send_venue,
+                chat_id=update.effective_chat.id,
+                latitude=sede.latitude,
+                longitude=sede.longitude,
+                title=sede.name(lang),
+                address=sede.address
+            )
+        except Exception as e:
+            logger.error(f"Error en handle_location: {e}")
+            record_error(e)
+    
+    @timed_handler
     async def handle_help(self, update: Update, context: CallbackContext) -> None:
         """Muestra la ayuda del bot"""
         try:
@@ -1045,6 +1856,7 @@ class ClinicBot:
             )
         except Exception as e:
             logger.error(f"Error en handle_help: {e}")
+            record_error(e)
             try:
                 # Intento de recuperación
                 user_id = update.effective_user.id
@@ -1059,7 +1871,9 @@ class ClinicBot:
                 )
             except Exception as inner_e:
                 logger.error(f"Error crítico en handle_help: {inner_e}")
+                record_error(inner_e)
     
+    @timed_handler
     async def handle_info(self, update: Update, context: CallbackContext) -> None:
         """Muestra información sobre la clínica"""
         try:
@@ -1077,6 +1891,7 @@ class ClinicBot:
             )
         except Exception as e:
             logger.error(f"Error en handle_info: {e}")
+            record_error(e)
             try:
                 # Intento de recuperación
                 user_id = update.effective_user.id
@@ -1091,7 +1906,9 @@ class ClinicBot:
                 )
             except Exception as inner_e:
                 logger.error(f"Error crítico en handle_info: {inner_e}")
+                record_error(inner_e)
     
+    @timed_handler
     async def handle_menu(self, update: Update, context: CallbackContext) -> int:
         """Muestra el menú principal"""
         try:
@@ -1115,6 +1932,7 @@ class ClinicBot:
             return States.MENU_PRINCIPAL
         except Exception as e:
             logger.error(f"Error en handle_menu: {e}")
+            record_error(e)
             try:
                 # Intento de recuperación
                 user_id = update.effective_user.id
@@ -1130,8 +1948,10 @@ class ClinicBot:
                 return await self.start(update, context)
             except Exception as inner_e:
                 logger.error(f"Error crítico en handle_menu: {inner_e}")
+                record_error(inner_e)
                 return States.MENU_PRINCIPAL
     
+    @timed_handler
     async def handle_contact(self, update: Update, context: CallbackContext) -> None:
         """Muestra la información de contacto"""
         try:
@@ -1155,6 +1975,7 @@ class ClinicBot:
             )
         except Exception as e:
             logger.error(f"Error en handle_contact: {e}")
+            record_error(e)
             try:
                 # Intento de recuperación
                 user_id = update.effective_user.id
@@ -1176,18 +1997,22 @@ class ClinicBot:
                 )
             except Exception as inner_e:
                 logger.error(f"Error crítico en handle_contact: {inner_e}")
+                record_error(inner_e)
                 
     # Continuación de la clase ClinicBot - Feedback y manejo de errores
 
+    @timed_handler
     async def handle_language_command(self, update: Update, context: CallbackContext) -> int:
         """Permite cambiar el idioma"""
         try:
             return await self.select_language(update, context)
         except Exception as e:
             logger.error(f"Error en handle_language_command: {e}")
+            record_error(e)
             # Intentar recuperarse
             return await self.start(update, context)
     
+    @timed_handler
     async def request_feedback(self, update: Update, context: CallbackContext) -> int:
         """Solicita feedback al usuario"""
         try:
@@ -1215,14 +2040,15 @@ class ClinicBot:
             return States.FEEDBACK
         except Exception as e:
             logger.error(f"Error en request_feedback: {e}")
+            record_error(e)
             # En caso de error, volver al menú principal
             return States.MENU_PRINCIPAL
     
+    @timed_handler
     async def handle_feedback(self, update: Update, context: CallbackContext) -> int:
         """Procesa el feedback del usuario"""
         try:
             query = update.callback_query
-            await query.answer()
             
             user_id = update.effective_user.id
             lang = self.user_data_manager.get_language(user_id)
@@ -1231,6 +2057,7 @@ class ClinicBot:
             # Guardar la calificación
             rating = int(query.data.split('_')[1])
             self.user_data_manager.update_user(user_id, {'feedback': rating})
+            self.analytics.emit('rating', user_id, 'feedback', rating)
             
             # Agradecer el feedback
             try:
@@ -1245,6 +2072,7 @@ class ClinicBot:
                 )
             except Exception as e:
                 logger.error(f"Error al editar mensaje en feedback: {e}")
+                record_error(e)
                 # Si falla, enviar un nuevo mensaje
                 await context.bot.send_message(
                     chat_id=update.effective_chat.id,
@@ -1259,6 +2087,7 @@ class ClinicBot:
             return States.MENU_PRINCIPAL
         except Exception as e:
             logger.error(f"Error en handle_feedback: {e}")
+            record_error(e)
             # En caso de error, volver al menú principal
             try:
                 user_id = update.effective_user.id
@@ -1270,8 +2099,10 @@ class ClinicBot:
                 )
             except Exception as inner_e:
                 logger.error(f"Error crítico en handle_feedback: {inner_e}")
+                record_error(inner_e)
             return States.MENU_PRINCIPAL
             
+    @timed_handler
     async def unknown(self, update: Update, context: CallbackContext) -> None:
         """Maneja comandos desconocidos"""
         try:
@@ -1287,16 +2118,21 @@ class ClinicBot:
             )
         except Exception as e:
             logger.error(f"Error en unknown: {e}")
+            record_error(e)
             # En caso de error, intentar recuperarse
             try:
                 if update.message:
                     await update.message.reply_text("Lo siento, ha ocurrido un error. Por favor intente con /start")
             except Exception as inner_e:
                 logger.error(f"Error crítico en unknown: {inner_e}")
+                record_error(inner_e)
     
+    @timed_handler
     async def error_handler(self, update, context):
         """Maneja errores generales del bot"""
         logger.error(f"Update {update} caused error {context.error}")
+        if context.error is not None:
+            record_error(context.error)
         try:
             if update.effective_user:
                 user_id = update.effective_user.id
@@ -0,0 +1,105 @@
+"""
+Respuestas del modo inline
+--------------------------
+Resultados para "@MiClinicaBot horarios" en cualquier chat: horarios, teléfono,
+correo, servicios y las sedes como ubicación. Se construyen una sola vez por
+idioma a partir de los textos de TranslationManager y de sus coordenadas, junto
+con un índice de prefijos de las palabras de cada resultado (y de la opción del
+menú a la que pertenece). Responder una consulta es buscar en ese índice: los
+objetos de resultado se reutilizan y para una sola palabra hasta la tupla de
+respuesta ya está armada.
+"""
+from typing import TYPE_CHECKING, Dict, List, Sequence, Tuple
+
+from telegram import InlineQueryResult, InlineQueryResultArticle, InlineQueryResultVenue, InputTextMessageContent
+
+from directory import tokenize
+
+if TYPE_CHECKING:
+    from faq_bot import TranslationManager
+
+MAX_RESULTS = 50  # Límite de answerInlineQuery
+
+# Grupo del menú (clave de la lista de etiquetas, posición en menu_options) y texto de cada opción
+ARTICLES = (
+    ('hours', 0, ('opening_hours', 'appointment_hours')),
+    ('contact', 1, ('phone', 'email')),
+    ('services', 2, ('general_consultation', 'specialties')),
+)
+VENUES = ('location', 3, ('main_office', 'secondary_office'))
+
+
+def plain_text(template: str) -> str:
+    """Texto sin el nombre del usuario: '{}, nuestro horario...' -> 'Nuestro horario...'"""
+    text = template.replace('{}', '', 1).lstrip(' ,')
+    return text[:1].upper() + text[1:]
+
+
+class InlineResultCache:
+    """Resultados inline precalculados por idioma con índice de prefijos"""
+
+    MAX_PREFIX = 8  # Igual que el directorio: prefijos más largos se filtran sobre el de 8
+
+    def __init__(self, translations: 'TranslationManager'):
+        # idioma -> todos los resultados, en el orden del menú
+        self.results: Dict[str, Tuple[InlineQueryResult, ...]] = {}
+        # idioma -> prefijo -> resultados cuyas palabras empiezan así
+        self._prefixes: Dict[str, Dict[str, Tuple[InlineQueryResult, ...]]] = {}
+        # idioma -> id de resultado -> palabras (para prefijos de más de MAX_PREFIX letras)
+        self._words: Dict[str, Dict[str, List[str]]] = {}
+        for lang in translations.translations:
+            self._build(translations, lang)
+
+    def _build(self, translations: 'TranslationManager', lang: str) -> None:
+        menu = translations.get_text('menu_options', lang)
+        entries: List[Tuple[InlineQueryResult, str]] = []
+        for group, position, keys in ARTICLES:
+            labels = translations.get_text(group, lang)
+            for label, key in zip(labels, keys):
+                text = plain_text(translations.get_text(key, lang))
+                result = InlineQueryResultArticle(
+                    id=f"{lang}:{key}", title=label, description=text,
+                    input_message_content=InputTextMessageContent(text)
+                )
+                entries.append((result, f"{menu[position]} {label} {key.replace('_', ' ')}"))
+        group, position, keys = VENUES
+        for label, key in zip(translations.get_text(group, lang), keys):
+            latitude, longitude = translations.locations[key]
+            result = InlineQueryResultVenue(
+                id=f"{lang}:{key}", latitude=latitude, longitude=longitude,
+                title=label, address=translations.addresses[key]
+            )
+            entries.append((result, f"{menu[position]} {label} {translations.addresses[key]}"))
+
+        prefixes: Dict[str, List[InlineQueryResult]] = {}
+        words: Dict[str, List[str]] = {}
+        for result, keywords in entries:
+            words[result.id] = tokenize(keywords)
+            for word in words[result.id]:
+                for size in range(1, min(len(word), self.MAX_PREFIX) + 1):
+                    matches = prefixes.setdefault(word[:size], [])
+                    if result not in matches:
+                        matches.append(result)
+        self.results[lang] = tuple(result for result, _ in entries)
+        self._prefixes[lang] = {prefix: tuple(matches) for prefix, matches in prefixes.items()}
+        self._words[lang] = words
+
+    def answer(self, query: str, lang: str) -> Sequence[InlineQueryResult]:
+        """Resultados cuyo texto tiene una palabra que empieza por cada palabra de la consulta"""
+        if lang not in self.results:
+            lang = 'es'
+        tokens = tokenize(query)
+        if not tokens:
+            return self.results[lang]
+        prefixes = self._prefixes[lang]
+        if len(tokens) == 1 and len(tokens[0]) <= self.MAX_PREFIX:
+            return prefixes.get(tokens[0], ())
+        words = self._words[lang]
+        matches: Sequence[InlineQueryResult] = self.results[lang]
+        for token in tokens:
+            candidates = prefixes.get(token[:self.MAX_PREFIX], ())
+            if len(token) > self.MAX_PREFIX:
+                candidates = [result for result in candidates
+                              if any(word.startswith(token) for word in words[result.id])]
+            matches = [result for result in matches if result in candidates]
+        return matches[:MAX_RESULTS]
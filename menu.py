@@ -0,0 +1,301 @@
+"""
+Menú declarativo
+----------------
+La estructura del menú (Horarios → Horario de atención / de citas, Contacto,
+Servicios, Ubicación, Ver fotos) se define en MENU_FILE, un JSON con la raíz y
+los nodos:
+
+    {"root": "main", "nodes": {
+        "main":  {"type": "menu", "text": "what_else", "columns": 2, "children": ["hours", ...]},
+        "hours": {"type": "menu", "label": {"es": "Horarios", "en": "Hours"},
+                  "text": "select_hours", "children": ["opening_hours", ...]},
+        "opening_hours": {"type": "text", "label": {...}, "text": "opening_hours"}, ...}}
+
+Tipos de nodo: "menu" (submenú con `children` y `columns`), "text" (texto con el
+botón de volver), "slots" (texto con los próximos turnos libres), "directory"
+(especialidades), "location" (una sede de SedeRegistry por su clave en `sede`;
+la etiqueta es opcional) y "photos" (las fotos de la carpeta `folder`). "text"
+es una clave de TranslationManager o un texto por idioma; en ambos casos '{}'
+se reemplaza por el nombre del usuario.
+
+Al cargar, el archivo se compila en un MenuGraph inmutable: nodos, textos y
+teclados ya armados por idioma, con los botones apuntando a "nav_<versión>_<nodo>".
+Un error en el archivo se detecta entero al compilar. MenuLibrary revisa el
+archivo periódicamente y cambia el grafo actual de una vez cuando se modifica;
+como conserva las últimas versiones, los botones de mensajes ya enviados siguen
+mostrando el menú con el que se abrieron. Los datos de los botones anteriores a
+este formato ("menu_Horarios", "submenu_Teléfono", "fotos_sede_principal") se
+resuelven con un índice aparte.
+"""
+import hashlib
+import json
+import logging
+import os
+import re
+from collections import OrderedDict
+from types import MappingProxyType
+from typing import TYPE_CHECKING, Any, Dict, List, Mapping, NamedTuple, Optional, Tuple
+
+from telegram import InlineKeyboardButton, InlineKeyboardMarkup
+
+from metrics import MENU_RELOADS, record_error
+
+if TYPE_CHECKING:
+    from faq_bot import TranslationManager
+    from sedes import SedeRegistry
+
+logger = logging.getLogger(__name__)
+
+KINDS = ('menu', 'text', 'slots', 'directory', 'location', 'photos')
+NODE_ID = re.compile(r'^[a-z0-9_]{1,40}$')  # "nav_<versión>_<nodo>" no pasa de los 64 bytes de callback_data
+BACK_DATA = 'back_to_main'
+KEEP_VERSIONS = 8  # Versiones anteriores cuyos botones siguen funcionando
+
+
+class MenuError(ValueError):
+    """Error en la definición del menú"""
+
+
+class MenuNode(NamedTuple):
+    id: str
+    kind: str
+    parent: Optional[str]
+    children: Tuple[str, ...]
+    labels: Mapping[str, str]  # idioma -> texto del botón
+    texts: Mapping[str, str]  # idioma -> plantilla con '{}' para el nombre
+    keyboards: Mapping[str, InlineKeyboardMarkup]  # idioma -> teclado (vacío si se arma al responder)
+    params: Mapping[str, Any]
+
+    def label(self, lang: str) -> str:
+        return self.labels.get(lang) or self.labels.get('es', self.id)
+
+    def text(self, lang: str, name: str) -> str:
+        return (self.texts.get(lang) or self.texts.get('es', '')).format(name)
+
+    def keyboard(self, lang: str) -> Optional[InlineKeyboardMarkup]:
+        return self.keyboards.get(lang) or self.keyboards.get('es')
+
+
+class MenuGraph(NamedTuple):
+    version: str
+    root: str
+    nodes: Mapping[str, MenuNode]
+    legacy: Mapping[str, str]  # callback_data del formato anterior -> nodo
+
+    @property
+    def root_node(self) -> MenuNode:
+        return self.nodes[self.root]
+
+
+def callback_data(version: str, node_id: str) -> str:
+    return f"nav_{version}_{node_id}"
+
+
+def _per_language(value: Any, languages: List[str], translations: 'TranslationManager',
+                  where: str) -> Dict[str, str]:
+    """Texto por idioma a partir de una clave de TranslationManager o de {idioma: texto}"""
+    if isinstance(value, str):
+        if not any(value in texts for texts in translations.translations.values()):
+            raise MenuError(f"{where}: la clave de texto '{value}' no existe")
+        texts = {lang: translations.get_text(value, lang) for lang in languages}
+        if any(not isinstance(text, str) for text in texts.values()):
+            raise MenuError(f"{where}: la clave '{value}' no es un texto")
+    elif isinstance(value, dict) and value:
+        fallback = value.get('es', next(iter(value.values())))
+        texts = {lang: value.get(lang, fallback) for lang in languages}
+        if any(not isinstance(text, str) for text in texts.values()):
+            raise MenuError(f"{where}: los textos deben ser cadenas")
+    else:
+        raise MenuError(f"{where}: se esperaba una clave de texto o {{idioma: texto}}")
+    return texts
+
+
+def _check_template(template: str, where: str) -> None:
+    try:
+        template.format('')
+    except (IndexError, KeyError, ValueError) as e:
+        raise MenuError(f"{where}: plantilla inválida {template!r} ({e})")
+
+
+def compile_menu(data: Dict[str, Any], translations: 'TranslationManager', sedes: 'SedeRegistry',
+                 version: str) -> MenuGraph:
+    """Valida la definición del menú y arma sus nodos, textos y teclados por idioma"""
+    if not isinstance(data, dict) or not isinstance(data.get('nodes'), dict):
+        raise MenuError("El menú debe ser un objeto con 'root' y 'nodes'")
+    definitions: Dict[str, Dict[str, Any]] = data['nodes']
+    root = data.get('root')
+    if root not in definitions:
+        raise MenuError(f"La raíz '{root}' no es un nodo del menú")
+    languages = list(translations.translations)
+
+    # Padres y validación de la estructura
+    parents: Dict[str, Optional[str]] = {root: None}
+    for node_id, definition in definitions.items():
+        if not NODE_ID.match(node_id):
+            raise MenuError(f"Identificador de nodo inválido: '{node_id}'")
+        if not isinstance(definition, dict) or definition.get('type') not in KINDS:
+            raise MenuError(f"Nodo '{node_id}': 'type' debe ser uno de {', '.join(KINDS)}")
+        children = definition.get('children', [])
+        if not isinstance(children, list):
+            raise MenuError(f"Nodo '{node_id}': 'children' debe ser una lista de nodos")
+        if (definition['type'] == 'menu') != bool(children):
+            raise MenuError(f"Nodo '{node_id}': solo los nodos 'menu' tienen 'children' y no pueden estar vacíos")
+        for child in children:
+            if child not in definitions:
+                raise MenuError(f"Nodo '{node_id}': el hijo '{child}' no existe")
+            if child == root:
+                raise MenuError(f"Nodo '{node_id}': la raíz no puede ser hija de otro nodo")
+            parents.setdefault(child, node_id)
+    if definitions[root]['type'] != 'menu':
+        raise MenuError("La raíz del menú debe ser de tipo 'menu'")
+    unreachable = set(definitions) - set(parents)
+    if unreachable:
+        logger.warning(f"Nodos del menú que no son hijos de ningún otro: {', '.join(sorted(unreachable))}")
+
+    # Etiquetas, textos y parámetros de cada nodo
+    labels: Dict[str, Dict[str, str]] = {}
+    texts: Dict[str, Dict[str, str]] = {}
+    params: Dict[str, Dict[str, Any]] = {}
+    for node_id, definition in definitions.items():
+        kind = definition['type']
+        where = f"Nodo '{node_id}'"
+        params[node_id] = {}
+        texts[node_id] = {}
+        if kind == 'location':
+            sede = sedes.get(definition.get('sede', ''))
+            if sede is None:
+                raise MenuError(f"{where}: la sede '{definition.get('sede')}' no existe")
+            params[node_id].update(latitude=sede.latitude, longitude=sede.longitude)
+            labels[node_id] = ({lang: sede.name(lang) for lang in languages} if 'label' not in definition
+                               else _per_language(definition['label'], languages, translations, where))
+            texts[node_id] = {lang: f"{sede.name(lang)}:\n{sede.address}.".replace('{', '{{').replace('}', '}}')
+                              for lang in languages}
+        elif node_id != root:
+            labels[node_id] = _per_language(definition.get('label'), languages, translations, where)
+        else:
+            labels[node_id] = {}
+        if kind == 'photos':
+            folder = definition.get('folder')
+            if not isinstance(folder, str) or not folder or os.sep in folder or folder.startswith('.'):
+                raise MenuError(f"{where}: 'folder' debe ser el nombre de una carpeta de PHOTOS_DIR")
+            params[node_id]['folder'] = folder
+        if kind in ('menu', 'text', 'slots'):
+            texts[node_id] = _per_language(definition.get('text'), languages, translations, where)
+        for template in texts[node_id].values():
+            _check_template(template, where)
+        if kind == 'menu':
+            columns = definition.get('columns', 1)
+            if not isinstance(columns, int) or not 1 <= columns <= 8:
+                raise MenuError(f"{where}: 'columns' debe estar entre 1 y 8")
+            params[node_id]['columns'] = columns
+
+    # Teclados ya armados: los hijos (en filas de `columns`) y el botón de volver fuera de la raíz
+    nodes: Dict[str, MenuNode] = {}
+    for node_id, definition in definitions.items():
+        kind = definition['type']
+        children = tuple(definition.get('children', ()))
+        keyboards: Dict[str, InlineKeyboardMarkup] = {}
+        if kind in ('menu', 'text', 'location'):
+            for lang in languages:
+                buttons = [InlineKeyboardButton(labels[child][lang], callback_data=callback_data(version, child))
+                           for child in children]
+                columns = params[node_id].get('columns', 1)
+                rows = [buttons[i:i + columns] for i in range(0, len(buttons), columns)]
+                if node_id != root:
+                    rows.append([InlineKeyboardButton(translations.get_text('back', lang), callback_data=BACK_DATA)])
+                keyboards[lang] = InlineKeyboardMarkup(rows)
+        nodes[node_id] = MenuNode(
+            node_id, kind, parents.get(node_id), children, MappingProxyType(labels[node_id]),
+            MappingProxyType(texts[node_id]), MappingProxyType(keyboards), MappingProxyType(params[node_id])
+        )
+
+    # Datos de los botones del formato anterior, para mensajes enviados antes del cambio
+    legacy: Dict[str, str] = {}
+    for node_id, node in nodes.items():
+        if node.parent is None or node.kind == 'menu' and node.parent != root:
+            continue
+        if node.kind == 'photos':
+            legacy.setdefault(f"fotos_{node.params['folder']}", node_id)
+            continue
+        prefix = 'menu' if node.parent == root else 'location' if node.kind == 'location' else 'submenu'
+        for label in node.labels.values():
+            legacy.setdefault(f"{prefix}_{label}", node_id)
+
+    return MenuGraph(version, root, MappingProxyType(nodes), MappingProxyType(legacy))
+
+
+class MenuLibrary:
+    """Grafo del menú actual, sus versiones recientes y la recarga cuando cambia el archivo"""
+
+    def __init__(self, path: str, translations: 'TranslationManager', sedes: 'SedeRegistry',
+                 keep: int = KEEP_VERSIONS):
+        self.path = path
+        self.translations = translations
+        self.sedes = sedes
+        self.keep = keep
+        self._versions: 'OrderedDict[str, MenuGraph]' = OrderedDict()
+        self._stamp: Optional[Tuple[int, int]] = None
+        self.current = self.load()
+
+    def _stat(self) -> Tuple[int, int]:
+        stat = os.stat(self.path)
+        return stat.st_mtime_ns, stat.st_size
+
+    def load(self) -> MenuGraph:
+        """Compila el archivo y lo deja como menú actual; si tiene errores lanza MenuError y no cambia nada"""
+        stamp = self._stat()
+        with open(self.path, 'rb') as f:
+            content = f.read()
+        version = hashlib.blake2b(content, digest_size=3).hexdigest()
+        try:
+            data = json.loads(content)
+        except ValueError as e:
+            raise MenuError(f"{self.path} no es un JSON válido: {e}")
+        graph = self._versions.get(version) or compile_menu(data, self.translations, self.sedes, version)
+        self._stamp = stamp
+        self._versions.pop(version, None)
+        self._versions[version] = graph
+        while len(self._versions) > self.keep:
+            self._versions.popitem(last=False)
+        self.current = graph
+        logger.info(f"Menú {version} cargado de {self.path} ({len(graph.nodes)} nodos)")
+        return graph
+
+    def reload_if_changed(self) -> bool:
+        """Recarga el menú si el archivo cambió; con errores se informa y se sigue con el actual"""
+        try:
+            stamp = self._stat()
+        except OSError:
+            if self._stamp is not None:
+                logger.warning(f"No se encuentra {self.path}; se sigue con el menú {self.current.version}")
+                self._stamp = None
+            return False
+        if stamp == self._stamp:
+            return False
+        version = self.current.version
+        try:
+            self.load()
+        except (OSError, MenuError) as e:
+            logger.error(f"Error al recargar el menú: {e}")
+            record_error(e)
+            MENU_RELOADS.labels('error').inc()
+            # No se reintenta hasta que el archivo vuelva a cambiar
+            self._stamp = stamp
+            return False
+        MENU_RELOADS.labels('ok').inc()
+        return self.current.version != version
+
+    def resolve(self, data: str) -> Tuple[MenuGraph, Optional[MenuNode]]:
+        """Grafo y nodo de un botón: los "nav_" de su versión (o la actual si ya no se conserva) y los del formato anterior"""
+        current = self.current
+        if data.startswith('nav_'):
+            parts = data.split('_', 2)
+            if len(parts) == 3:
+                graph = self._versions.get(parts[1], current)
+                node = graph.nodes.get(parts[2])
+                if node is None and graph is not current:
+                    graph, node = current, current.nodes.get(parts[2])
+                return graph, node
+            return current, None
+        node_id = current.legacy.get(data)
+        return current, current.nodes.get(node_id) if node_id else None
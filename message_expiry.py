@@ -0,0 +1,130 @@
+"""
+Vencimiento de mensajes del bot
+-------------------------------
+Registro persistente, por chat, de los mensajes que envía el bot con su instante
+de envío. Cada mensaje se programa en una rueda de temporizadores y, al vencer,
+pasa a una cola de borrado que el barrido periódico vacía en lotes con
+deleteMessages (hasta 100 ids por llamada). Cada barrido solo toca los mensajes
+vencidos; nunca se recorren todos los chats.
+
+Telegram solo permite borrar mensajes de menos de 48 horas: el plazo de
+vencimiento se recorta para quedar dentro de esa ventana y los mensajes que ya
+la pasaron (por ejemplo tras un apagado largo) se descartan sin llamar a la API.
+"""
+import logging
+import time
+from typing import TYPE_CHECKING, Dict, Iterable, List, Optional, Tuple
+
+from timer_wheel import TimerWheel
+
+if TYPE_CHECKING:
+    from faq_bot import UserDataManager
+
+logger = logging.getLogger(__name__)
+
+DELETE_WINDOW = 48 * 3600  # Segundos durante los que Telegram permite borrar un mensaje
+MAX_IDS_PER_CALL = 100  # Límite de deleteMessages
+
+
+class MessageExpiry:
+    """Mensajes enviados por el bot, persistidos en la sección 'bot_messages'"""
+
+    def __init__(self, storage: 'UserDataManager', ttl: float = 24 * 3600, margin: float = 600,
+                 now: Optional[float] = None):
+        self.storage = storage
+        # Margen para que el borrado llegue antes del cierre de la ventana aunque el barrido se atrase
+        self.ttl = max(60.0, min(ttl, DELETE_WINDOW - margin))
+        # chat_id -> {message_id: instante de envío}
+        self.messages: Dict[int, Dict[int, float]] = storage.get_section('bot_messages')
+        self.wheel = TimerWheel(tick=60.0, size=max(64, int(self.ttl // 60) + 2))
+        # Vencidos pendientes de borrar, en orden de vencimiento: chat_id -> [message_id]
+        self._due: Dict[int, List[int]] = {}
+        self.tracked = 0
+        self.dirty = False
+
+        # Restaurar los vencimientos persistidos
+        now = time.time() if now is None else now
+        for chat_id, sent in list(self.messages.items()):
+            for message_id, sent_at in list(sent.items()):
+                if sent_at + DELETE_WINDOW <= now:
+                    del sent[message_id]
+                    self.dirty = True
+                else:
+                    self.wheel.schedule((chat_id, message_id), sent_at + self.ttl)
+                    self.tracked += 1
+            if not sent:
+                del self.messages[chat_id]
+
+    def track(self, chat_id: int, message_id: int, sent_at: Optional[float] = None) -> None:
+        """Registra un mensaje enviado; un mensaje editado conserva su instante de envío original"""
+        sent = self.messages.setdefault(chat_id, {})
+        if message_id in sent:
+            return
+        sent_at = time.time() if sent_at is None else sent_at
+        sent[message_id] = sent_at
+        self.wheel.schedule((chat_id, message_id), sent_at + self.ttl)
+        self.tracked += 1
+        self.dirty = True
+
+    def forget(self, chat_id: int, message_ids: Iterable[int]) -> None:
+        """Deja de seguir mensajes ya borrados (por el bot o por el barrido)"""
+        sent = self.messages.get(chat_id)
+        if not sent:
+            return
+        for message_id in message_ids:
+            if sent.pop(message_id, None) is not None:
+                self.wheel.cancel((chat_id, message_id))
+                self.tracked -= 1
+                self.dirty = True
+        if not sent:
+            del self.messages[chat_id]
+
+    def collect(self, now: Optional[float] = None) -> int:
+        """Pasa a la cola de borrado los mensajes vencidos hasta `now`"""
+        expired = self.wheel.advance(now)
+        for (chat_id, message_id), _ in expired:
+            self._due.setdefault(chat_id, []).append(message_id)
+        return len(expired)
+
+    @property
+    def pending(self) -> int:
+        return sum(len(message_ids) for message_ids in self._due.values())
+
+    @property
+    def next_due(self) -> Optional[float]:
+        """Instante en que vence el próximo mensaje, o None si no hay ninguno"""
+        if self._due:
+            return time.time()
+        first = min((min(sent.values()) for sent in self.messages.values() if sent), default=None)
+        return first + self.ttl if first is not None else None
+
+    def take(self, max_calls: int, now: Optional[float] = None) -> List[Tuple[int, List[int]]]:
+        """Saca de la cola hasta `max_calls` lotes (chat_id, ids) listos para deleteMessages"""
+        now = time.time() if now is None else now
+        batches: List[Tuple[int, List[int]]] = []
+        while self._due and len(batches) < max_calls:
+            chat_id = next(iter(self._due))
+            message_ids = self._due[chat_id]
+            sent = self.messages.get(chat_id, {})
+            batch, stale = [], []
+            while message_ids and len(batch) < MAX_IDS_PER_CALL:
+                message_id = message_ids.pop(0)
+                sent_at = sent.get(message_id)
+                if sent_at is None:
+                    continue  # ya se borró por otra vía
+                if sent_at + DELETE_WINDOW <= now:
+                    stale.append(message_id)
+                else:
+                    batch.append(message_id)
+            if not message_ids:
+                del self._due[chat_id]
+            if stale:
+                logger.debug(f"{len(stale)} mensajes del chat {chat_id} fuera de la ventana de 48 h; se descartan")
+                self.forget(chat_id, stale)
+            if batch:
+                batches.append((chat_id, batch))
+        return batches
+
+    def requeue(self, chat_id: int, message_ids: List[int]) -> None:
+        """Devuelve un lote al frente de la cola (p. ej. tras un 429)"""
+        self._due = {chat_id: message_ids + self._due.pop(chat_id, []), **self._due}
@@ -0,0 +1,338 @@
+"""
+Métricas en formato Prometheus
+------------------------------
+Registro mínimo de contadores, gauges e histogramas con etiquetas. Registrar una
+observación es una búsqueda binaria y un par de sumas sobre listas ya creadas,
+sin candados: todas las escrituras ocurren en el hilo del bucle de eventos, y
+una lectura concurrente de /metrics como mucho ve un valor un instante atrasado.
+"""
+import bisect
+import functools
+import math
+import time
+from typing import Callable, Dict, Iterable, List, Optional, Sequence, Tuple
+
+from analytics import ANALYTICS
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def _format_labels(names: Sequence[str], values: Sequence[str], extra: str = '') -> str:
+    parts = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        parts.append(extra)
+    return '{' + ','.join(parts) + '}' if parts else ''
+
+
+def _format_value(value: float) -> str:
+    if math.isinf(value):
+        return '+Inf' if value > 0 else '-Inf'
+    return repr(float(value)) if not float(value).is_integer() else str(int(value))
+
+
+class _Metric:
+    """Base de las métricas: un hijo por combinación de valores de etiquetas"""
+
+    type_name = ''
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._children: Dict[Tuple[str, ...], object] = {}
+
+    def labels(self, *values: str):
+        """Devuelve (creándolo si hace falta) el hijo para esos valores de etiqueta"""
+        key = tuple(str(value) for value in values)
+        child = self._children.get(key)
+        if child is None:
+            if len(key) != len(self.labelnames):
+                raise ValueError(f"{self.name} espera las etiquetas {self.labelnames}")
+            child = self._children.setdefault(key, self._new_child())
+        return child
+
+    def _new_child(self):
+        raise NotImplementedError
+
+    def _default(self):
+        return self.labels()
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.type_name}"]
+        for key, child in list(self._children.items()):
+            lines.extend(self._render_child(key, child))
+        return lines
+
+    def _render_child(self, key, child) -> List[str]:
+        raise NotImplementedError
+
+
+class _CounterChild:
+    __slots__ = ('value',)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+
+class Counter(_Metric):
+    """Contador monótono"""
+
+    type_name = 'counter'
+
+    def _new_child(self):
+        return _CounterChild()
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.value)}"]
+
+
+class _GaugeChild:
+    __slots__ = ('value', 'function')
+
+    def __init__(self):
+        self.value = 0.0
+        self.function: Optional[Callable[[], float]] = None
+
+    def set(self, value: float) -> None:
+        self.value = value
+
+    def inc(self, amount: float = 1.0) -> None:
+        self.value += amount
+
+    def dec(self, amount: float = 1.0) -> None:
+        self.value -= amount
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        """El valor se calcula al exportar (p. ej. el tamaño de una cola)"""
+        self.function = function
+
+    def get(self) -> float:
+        if self.function is not None:
+            try:
+                return float(self.function())
+            except Exception:
+                return float('nan')
+        return self.value
+
+
+class Gauge(_Metric):
+    """Valor que sube y baja"""
+
+    type_name = 'gauge'
+
+    def _new_child(self):
+        return _GaugeChild()
+
+    def set(self, value: float) -> None:
+        self._default().set(value)
+
+    def inc(self, amount: float = 1.0) -> None:
+        self._default().inc(amount)
+
+    def dec(self, amount: float = 1.0) -> None:
+        self._default().dec(amount)
+
+    def set_function(self, function: Callable[[], float]) -> None:
+        self._default().set_function(function)
+
+    def _render_child(self, key, child) -> List[str]:
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {_format_value(child.get())}"]
+
+
+class _HistogramChild:
+    __slots__ = ('bounds', 'counts', 'sum', 'count')
+
+    def __init__(self, bounds: Tuple[float, ...]):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)  # El último es +Inf
+        self.sum = 0.0
+        self.count = 0
+
+    def observe(self, value: float) -> None:
+        self.counts[bisect.bisect_left(self.bounds, value)] += 1
+        self.sum += value
+        self.count += 1
+
+
+class Histogram(_Metric):
+    """Histograma de buckets fijos"""
+
+    type_name = 'histogram'
+
+    def __init__(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def _new_child(self):
+        return _HistogramChild(self.buckets)
+
+    def observe(self, value: float) -> None:
+        self._default().observe(value)
+
+    def _render_child(self, key, child) -> List[str]:
+        lines = []
+        cumulative = 0
+        counts = list(child.counts)
+        for bound, count in zip(self.buckets + (float('inf'),), counts):
+            cumulative += count
+            labels = _format_labels(self.labelnames, key, f'le="{_format_value(bound)}"')
+            lines.append(f"{self.name}_bucket{labels} {cumulative}")
+        plain = _format_labels(self.labelnames, key)
+        lines.append(f"{self.name}_sum{plain} {_format_value(child.sum)}")
+        lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+class MetricsRegistry:
+    """Conjunto de métricas exportadas en /metrics"""
+
+    def __init__(self):
+        self._metrics: Dict[str, _Metric] = {}
+
+    def register(self, metric: _Metric) -> _Metric:
+        if metric.name in self._metrics:
+            raise ValueError(f"Métrica duplicada: {metric.name}")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Counter:
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name: str, documentation: str, labelnames: Iterable[str] = ()) -> Gauge:
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name: str, documentation: str, labelnames: Iterable[str] = (),
+                  buckets: Sequence[float] = DEFAULT_BUCKETS) -> Histogram:
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        lines: List[str] = []
+        for metric in list(self._metrics.values()):
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+
+# Registro global del proceso y métricas del bot
+REGISTRY = MetricsRegistry()
+
+HANDLER_LATENCY = REGISTRY.histogram(
+    'clinicbot_handler_latency_seconds', 'Duración de los manejadores de ClinicBot', ['handler'])
+API_LATENCY = REGISTRY.histogram(
+    'clinicbot_telegram_api_latency_seconds', 'Duración de las llamadas a la API de Telegram', ['method'])
+API_RESPONSES = REGISTRY.counter(
+    'clinicbot_telegram_api_responses_total', 'Respuestas de la API de Telegram por código HTTP', ['method', 'status'])
+ERRORS = REGISTRY.counter(
+    'clinicbot_errors_total', 'Errores por clase de excepción', ['exception'])
+SAVE_DURATION = REGISTRY.histogram(
+    'clinicbot_save_data_seconds', 'Duración de UserDataManager.save_data')
+SAVE_BYTES = REGISTRY.counter(
+    'clinicbot_save_data_bytes_total', 'Bytes escritos por UserDataManager.save_data')
+SAVE_LAST_BYTES = REGISTRY.gauge(
+    'clinicbot_save_data_last_bytes', 'Tamaño del último archivo de datos escrito')
+UPDATE_QUEUE_DEPTH = REGISTRY.gauge(
+    'clinicbot_update_queue_depth', 'Actualizaciones pendientes en la cola de la Application')
+UPDATES = REGISTRY.counter(
+    'clinicbot_updates_total', 'Actualizaciones recibidas')
+LOOP_LAG = REGISTRY.histogram(
+    'clinicbot_event_loop_lag_seconds', 'Retraso del latido del bucle de eventos',
+    buckets=(0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 5.0))
+SLOW_CALLBACKS = REGISTRY.counter(
+    'clinicbot_slow_callbacks_total', 'Callbacks que bloquearon el bucle más que el umbral')
+SLOW_CALLBACK_SECONDS = REGISTRY.histogram(
+    'clinicbot_slow_callback_seconds', 'Duración de los bloqueos del bucle por callbacks lentos',
+    buckets=(0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0))
+BOT_MESSAGES_TRACKED = REGISTRY.gauge(
+    'clinicbot_bot_messages_tracked', 'Mensajes del bot pendientes de vencer')
+BOT_MESSAGES_DELETED = REGISTRY.counter(
+    'clinicbot_bot_messages_deleted_total', 'Mensajes del bot borrados por el barrido de vencidos')
+ANALYTICS_BUFFERED = REGISTRY.gauge(
+    'clinicbot_analytics_buffered_events', 'Eventos de uso en memoria pendientes de escribir')
+REMINDERS_PENDING = REGISTRY.gauge(
+    'clinicbot_reminders_pending', 'Recordatorios de citas programados')
+REMINDERS_SENT = REGISTRY.counter(
+    'clinicbot_reminders_sent_total', 'Recordatorios de citas enviados por tipo (24h, 1h)', ['kind'])
+BROADCAST_MESSAGES = REGISTRY.counter(
+    'clinicbot_broadcast_messages_total', 'Mensajes de anuncios por resultado (sent, blocked, failed)', ['result'])
+BROADCAST_PENDING = REGISTRY.gauge(
+    'clinicbot_broadcast_pending', 'Destinatarios del anuncio en curso que faltan en este proceso')
+BROADCAST_RATE = REGISTRY.gauge(
+    'clinicbot_broadcast_rate', 'Ritmo de envío de anuncios en mensajes por segundo (0 si no hay anuncio en curso)')
+WORKER_UPDATES = REGISTRY.counter(
+    'clinicbot_worker_updates_total', 'Actualizaciones repartidas a cada proceso del pool', ['worker'])
+WORKER_QUEUE_DEPTH = REGISTRY.gauge(
+    'clinicbot_worker_queue_depth', 'Actualizaciones en la cola de cada proceso del pool', ['worker'])
+BOT_RESTARTS = REGISTRY.counter(
+    'clinicbot_bot_restarts_total', 'Reinicios de la Application hechos por el supervisor', ['reason'])
+TENANTS_LOADED = REGISTRY.gauge(
+    'clinicbot_tenants_loaded', 'Clínicas con su bot cargado en memoria')
+TENANT_LOADS = REGISTRY.counter(
+    'clinicbot_tenant_loads_total', 'Cargas del bot de una clínica por motivo (update, wakeup)', ['reason'])
+TENANT_EVICTIONS = REGISTRY.counter(
+    'clinicbot_tenant_evictions_total', 'Bots de clínicas descargados por inactividad')
+MENU_RELOADS = REGISTRY.counter(
+    'clinicbot_menu_reloads_total', 'Recargas del menú declarativo por resultado (ok, error)', ['result'])
+INBOUND_SHED = REGISTRY.counter(
+    'clinicbot_inbound_shed_total', 'Actualizaciones que superaron el límite por usuario, por tipo y destino '
+    '(collapsed, dropped, blocked)', ['kind', 'reason'])
+INBOUND_BLOCKED = REGISTRY.gauge(
+    'clinicbot_inbound_blocked_users', 'Usuarios bloqueados temporalmente por exceso de actualizaciones')
+CALLBACKS_COLLAPSED = REGISTRY.counter(
+    'clinicbot_callbacks_collapsed_total', 'Toques de botones descartados por repetidos o cancelados por uno '
+    'más nuevo (duplicate, superseded)', ['reason'])
+BACKLOG_UPDATES = REGISTRY.counter(
+    'clinicbot_backlog_updates_total', 'Actualizaciones atrasadas al arrancar por destino (kept, coalesced) y '
+    'respuestas a sus botones descartados (answered, answer_failed)', ['result'])
+
+
+def record_error(error: BaseException) -> None:
+    """Cuenta un error por su clase de excepción"""
+    ERRORS.labels(type(error).__name__).inc()
+
+
+def observe_api_call(method: str, duration: float, status: Optional[int],
+                     error: Optional[BaseException]) -> None:
+    """Listener para TrackedHTTPXRequest"""
+    API_LATENCY.labels(method).observe(duration)
+    API_RESPONSES.labels(method, str(status) if status is not None else 'error').inc()
+    if error is not None:
+        record_error(error)
+
+
+def timed_handler(function):
+    """Decorador: mide la duración de un manejador asíncrono y cuenta las excepciones que escapan.
+
+    Con los eventos de uso habilitados, la duración de cada actualización queda
+    además como evento 'latency' del usuario.
+    """
+    name = function.__name__
+    child = HANDLER_LATENCY.labels(name)
+
+    @functools.wraps(function)
+    async def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return await function(*args, **kwargs)
+        except Exception as e:
+            record_error(e)
+            raise
+        finally:
+            duration = time.perf_counter() - started
+            child.observe(duration)
+            analytics = getattr(args[0], 'analytics', ANALYTICS) if args else ANALYTICS
+            if analytics.enabled and len(args) > 1:
+                user = getattr(args[1], 'effective_user', None)
+                if user is not None:
+                    analytics.emit('latency', user.id, name, duration)
+
+    return wrapper
@@ -0,0 +1,255 @@
+"""
+Monitoreo de vida del bot
+-------------------------
+Latido del bucle de eventos y seguimiento de las llamadas a la API de Telegram,
+para que /health y /ready reflejen el estado real del bot y no solo un flag.
+Además, un hilo vigilante detecta los callbacks que bloquean el bucle y captura
+la pila en el momento del bloqueo.
+"""
+import asyncio
+import logging
+import sys
+import threading
+import time
+import traceback
+from collections import deque
+from typing import Any, Awaitable, Callable, Deque, Dict, List, Optional, Tuple
+
+from telegram.request import BaseRequest, HTTPXRequest
+
+from metrics import LOOP_LAG, SLOW_CALLBACK_SECONDS, SLOW_CALLBACKS
+
+logger = logging.getLogger(__name__)
+
+
+class LivenessMonitor:
+    """Latido del bucle de eventos y marcas de tiempo del flujo de actualizaciones"""
+
+    def __init__(self, interval: float = 1.0, poll_stall_seconds: float = 90.0):
+        self.interval = interval
+        self.poll_stall_seconds = poll_stall_seconds
+        self.mode = 'polling'  # 'polling' o 'webhook'
+        self.last_beat: Optional[float] = None
+        self.loop_lag = 0.0
+        self.max_loop_lag = 0.0
+        self.last_poll: Optional[float] = None
+        self.last_update: Optional[float] = None
+        self.last_api_error: Optional[str] = None
+        self.updates_seen = 0
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self) -> None:
+        """Inicia el latido en el bucle de eventos actual"""
+        if self._task is None or self._task.done():
+            self._task = asyncio.get_running_loop().create_task(self._beat())
+
+    def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def _beat(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            # Lo que tarda de más en despertar es el tiempo que el bucle estuvo ocupado
+            self.loop_lag = max(0.0, loop.time() - expected)
+            LOOP_LAG.observe(self.loop_lag)
+            self.max_loop_lag = max(self.max_loop_lag, self.loop_lag)
+            self.last_beat = time.time()
+
+    def record_api_call(self, method: str, duration: float, status: Optional[int],
+                        error: Optional[BaseException]) -> None:
+        """Registra el resultado de una llamada a la API de Telegram"""
+        if error is not None:
+            self.last_api_error = f"{method}: {type(error).__name__}"
+        elif status is not None and status >= 400:
+            self.last_api_error = f"{method}: HTTP {status}"
+        elif method == 'getUpdates':
+            self.last_poll = time.time()
+
+    def record_update(self) -> None:
+        """Registra la llegada de una actualización (polling o webhook)"""
+        self.last_update = time.time()
+        self.updates_seen += 1
+
+    def readiness(self, now: Optional[float] = None) -> Tuple[bool, Dict[str, Any]]:
+        """Evalúa si el bot está listo: bucle responsivo y actualizaciones fluyendo"""
+        now = time.time() if now is None else now
+        problems: List[str] = []
+        beat_age = now - self.last_beat if self.last_beat else None
+        if beat_age is None or beat_age > self.interval * 5:
+            problems.append('event_loop_unresponsive')
+        if self.mode == 'polling':
+            poll_age = now - self.last_poll if self.last_poll else None
+            if poll_age is None or poll_age > self.poll_stall_seconds:
+                problems.append('get_updates_stalled')
+        else:
+            poll_age = None
+        return not problems, {
+            'problems': problems,
+            'mode': self.mode,
+            'heartbeat_age_seconds': beat_age,
+            'loop_lag_seconds': round(self.loop_lag, 4),
+            'max_loop_lag_seconds': round(self.max_loop_lag, 4),
+            'last_get_updates_age_seconds': poll_age,
+            'last_update_age_seconds': now - self.last_update if self.last_update else None,
+            'updates_seen': self.updates_seen,
+            'last_api_error': self.last_api_error,
+        }
+
+
+class SlowCallbackDetector:
+    """Detecta callbacks que bloquean el bucle más de `threshold` segundos.
+
+    Una tarea del bucle marca un tic cada `tick` segundos; un hilo vigilante
+    revisa esa marca y, si se atrasa más del umbral, captura la pila del hilo del
+    bucle mientras sigue bloqueado (lo que asyncio en modo debug solo informa
+    cuando el callback ya terminó, y sin pila).
+    """
+
+    def __init__(self, threshold: float = 0.25, tick: Optional[float] = None, max_events: int = 20):
+        self.threshold = threshold
+        self.tick = tick if tick is not None else threshold / 4
+        self.events: Deque[Dict[str, Any]] = deque(maxlen=max_events)
+        self.count = 0
+        self.max_duration = 0.0
+        self._last_tick = time.monotonic()
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._task: Optional[asyncio.Task] = None
+        self._thread: Optional[threading.Thread] = None
+        self._stopped = threading.Event()
+
+    def start(self) -> None:
+        """Inicia el tic en el bucle actual y el hilo vigilante"""
+        if (self._task is not None and not self._task.done()) or (self._thread is not None and self._thread.is_alive()):
+            return
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_tick = time.monotonic()
+        self._stopped.clear()
+        self._task = self._loop.create_task(self._ticker())
+        self._thread = threading.Thread(target=self._watch, name='slow-callback-watchdog', daemon=True)
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._stopped.set()
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+        # El vigilante termina en a lo sumo un tic; esperarlo evita dos hilos tras un nuevo start()
+        if self._thread is not None:
+            self._thread.join(self.tick + 1.0)
+            self._thread = None
+
+    async def _ticker(self) -> None:
+        while True:
+            self._last_tick = time.monotonic()
+            await asyncio.sleep(self.tick)
+
+    def _watch(self) -> None:
+        event: Optional[Dict[str, Any]] = None
+        while not self._stopped.wait(self.tick):
+            # Entre dos tics normales pasan `tick` segundos; el resto es bloqueo
+            blocked = time.monotonic() - self._last_tick - self.tick
+            if blocked >= self.threshold:
+                if event is None:
+                    frame = sys._current_frames().get(self._loop_thread)
+                    event = {
+                        'started_at': time.time() - blocked,
+                        'duration_seconds': blocked,
+                        'stack': traceback.format_stack(frame) if frame is not None else [],
+                    }
+                else:
+                    event['duration_seconds'] = blocked
+            elif event is not None:
+                # Las métricas se escriben siempre desde el hilo del bucle
+                try:
+                    self._loop.call_soon_threadsafe(self._record, event)
+                except RuntimeError:
+                    return  # El bucle ya se cerró
+                event = None
+
+    def _record(self, event: Dict[str, Any]) -> None:
+        duration = event['duration_seconds']
+        self.events.append(event)
+        self.count += 1
+        self.max_duration = max(self.max_duration, duration)
+        SLOW_CALLBACKS.inc()
+        SLOW_CALLBACK_SECONDS.observe(duration)
+        logger.warning(f"Callback lento: bloqueó el bucle {duration:.3f}s en\n{''.join(event['stack'][-6:])}")
+
+    def summary(self) -> Dict[str, Any]:
+        """Resumen para /health (sin pilas)"""
+        last = self.events[-1] if self.events else None
+        return {
+            'threshold_seconds': self.threshold,
+            'count': self.count,
+            'max_seconds': round(self.max_duration, 4),
+            'last_seconds': round(last['duration_seconds'], 4) if last else None,
+            'last_at': last['started_at'] if last else None,
+        }
+
+
+# Aviso por llamada: (método de la API, duración en segundos, código HTTP o None, excepción o None)
+ApiCallListener = Callable[[str, float, Optional[int], Optional[BaseException]], None]
+
+
+async def tracked_call(listeners: List[ApiCallListener], url: str,
+                       request: Awaitable[Tuple[int, bytes]]) -> Tuple[int, bytes]:
+    """Espera una petición a la API de Telegram e informa método, duración y error a `listeners`"""
+    api_method = url.rsplit('/', 1)[-1].split('?', 1)[0]
+    started = time.perf_counter()
+    status: Optional[int] = None
+    error: Optional[BaseException] = None
+    try:
+        status, payload = await request
+        return status, payload
+    except BaseException as e:
+        error = e
+        raise
+    finally:
+        duration = time.perf_counter() - started
+        for callback in listeners:
+            try:
+                callback(api_method, duration, status, error)
+            except Exception as callback_error:
+                logger.debug(f"Error al registrar llamada {api_method}: {callback_error}")
+
+
+class TrackedHTTPXRequest(HTTPXRequest):
+    """HTTPXRequest que informa método, duración y error de cada llamada a la API de Telegram"""
+
+    def __init__(self, *args, on_api_call: Optional[List[ApiCallListener]] = None, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.on_api_call = on_api_call if on_api_call is not None else []
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        return await tracked_call(self.on_api_call, url, super().do_request(url, method, *args, **kwargs))
+
+
+class SharedPoolRequest(BaseRequest):
+    """Peticiones de un bot sobre un HTTPXRequest compartido con otros bots (ver tenants.py).
+
+    Informa sus llamadas como TrackedHTTPXRequest, pero al apagarse el bot no
+    cierra el pool: lo cierra quien lo creó.
+    """
+
+    def __init__(self, pool: HTTPXRequest, on_api_call: Optional[List[ApiCallListener]] = None):
+        self.pool = pool
+        self.on_api_call = on_api_call if on_api_call is not None else []
+
+    @property
+    def read_timeout(self) -> Optional[float]:
+        return self.pool.read_timeout
+
+    async def initialize(self) -> None:
+        await self.pool.initialize()
+
+    async def shutdown(self) -> None:
+        pass
+
+    async def do_request(self, url: str, method: str, *args, **kwargs) -> Tuple[int, bytes]:
+        return await tracked_call(self.on_api_call, url, self.pool.do_request(url, method, *args, **kwargs))
@@ -0,0 +1,153 @@
+"""
+Perfilado bajo demanda del bot en ejecución
+-------------------------------------------
+Herramientas usadas por los endpoints /debug/* de app.py para encontrar puntos
+calientes en producción sin volver a desplegar:
+
+- Muestreo de pilas del hilo del bucle de eventos desde un hilo auxiliar, con
+  salida en formato "collapsed" (una línea por pila, lista para flamegraph.pl
+  o speedscope).
+- cProfile sobre el bucle durante N segundos, como volcado pstats o texto.
+- Diferencia top-N de tracemalloc entre dos instantáneas.
+"""
+import asyncio
+import cProfile
+import io
+import marshal
+import os
+import pstats
+import sys
+import threading
+import time
+import tracemalloc
+from collections import Counter
+from typing import Dict, Optional, Tuple
+
+MAX_SECONDS = 120.0
+MIN_INTERVAL_MS, MAX_INTERVAL_MS = 1.0, 1000.0  # Rango del intervalo de muestreo
+
+# Solo un perfilado a la vez: dos muestreadores se medirían mutuamente
+_busy = threading.Lock()
+
+
+class ProfilerBusyError(RuntimeError):
+    """Ya hay un perfilado en curso"""
+
+
+def _frame_label(frame) -> str:
+    code = frame.f_code
+    return f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})"
+
+
+class SamplingProfiler:
+    """Toma muestras periódicas de la pila de un hilo y las acumula por pila completa"""
+
+    def __init__(self, thread_id: int, interval: float = 0.005):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.samples: Counter = Counter()
+        self.sample_count = 0
+
+    def run(self, seconds: float) -> None:
+        """Muestrea durante `seconds` (bloqueante: llamar desde un hilo auxiliar)"""
+        deadline = time.perf_counter() + seconds
+        while time.perf_counter() < deadline:
+            frame = sys._current_frames().get(self.thread_id)
+            if frame is not None:
+                stack = []
+                while frame is not None:
+                    stack.append(_frame_label(frame))
+                    frame = frame.f_back
+                self.samples[';'.join(reversed(stack))] += 1
+                self.sample_count += 1
+            time.sleep(self.interval)
+
+    def collapsed(self) -> str:
+        """Pilas en formato collapsed: 'externa;...;interna <muestras>'"""
+        return ''.join(f"{stack} {count}\n" for stack, count in self.samples.most_common())
+
+
+async def sample_event_loop(seconds: float, interval: float = 0.005) -> SamplingProfiler:
+    """Muestrea el hilo del bucle actual sin bloquearlo (el muestreador corre en otro hilo)"""
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusyError("Ya hay un perfilado en curso")
+    try:
+        profiler = SamplingProfiler(threading.get_ident(), max(interval, 0.001))
+        await asyncio.to_thread(profiler.run, min(seconds, MAX_SECONDS))
+        return profiler
+    finally:
+        _busy.release()
+
+
+async def cprofile_event_loop(seconds: float) -> pstats.Stats:
+    """Activa cProfile en el hilo del bucle durante `seconds` y devuelve las estadísticas"""
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusyError("Ya hay un perfilado en curso")
+    try:
+        profiler = cProfile.Profile()
+        profiler.enable()
+        try:
+            await asyncio.sleep(min(seconds, MAX_SECONDS))
+        finally:
+            profiler.disable()
+        return pstats.Stats(profiler)
+    finally:
+        _busy.release()
+
+
+def pstats_dump(stats: pstats.Stats) -> bytes:
+    """Volcado binario compatible con pstats.Stats(ruta)"""
+    return marshal.dumps(stats.stats)
+
+
+def pstats_text(stats: pstats.Stats, limit: int = 60) -> str:
+    stream = io.StringIO()
+    stats.stream = stream
+    stats.sort_stats('cumulative').print_stats(limit)
+    return stream.getvalue()
+
+
+async def tracemalloc_diff(seconds: float, top: int = 25, frames: int = 5) -> str:
+    """Diferencia de memoria asignada entre dos instantáneas separadas por `seconds`"""
+    if not _busy.acquire(blocking=False):
+        raise ProfilerBusyError("Ya hay un perfilado en curso")
+    started_here = not tracemalloc.is_tracing()
+    try:
+        if started_here:
+            tracemalloc.start(frames)
+        before = tracemalloc.take_snapshot()
+        await asyncio.sleep(min(seconds, MAX_SECONDS))
+        after = tracemalloc.take_snapshot()
+        filters = [tracemalloc.Filter(False, tracemalloc.__file__)]
+        stats = after.filter_traces(filters).compare_to(before.filter_traces(filters), 'lineno')
+        current, peak = tracemalloc.get_traced_memory()
+        lines = [f"# tracemalloc: {seconds:.0f}s, actual={current} bytes, pico={peak} bytes"]
+        lines.extend(str(stat) for stat in stats[:top])
+        return '\n'.join(lines) + '\n'
+    finally:
+        # Si lo activamos nosotros, lo apagamos para no dejar el costo encendido
+        if started_here:
+            tracemalloc.stop()
+        _busy.release()
+
+
+def parse_profile_params(query: Dict[str, list]) -> Tuple[float, Optional[str]]:
+    """Lee y valida ?seconds= de una solicitud de perfilado"""
+    try:
+        seconds = float(query.get('seconds', ['10'])[0])
+    except ValueError:
+        return 0.0, "seconds debe ser numérico"
+    if not 0 < seconds <= MAX_SECONDS:
+        return 0.0, f"seconds debe estar entre 0 y {MAX_SECONDS:.0f}"
+    return seconds, None
+
+
+def parse_interval_param(query: Dict[str, list]) -> Tuple[float, Optional[str]]:
+    """Lee y valida ?interval_ms= (en segundos, recortado a MIN_INTERVAL_MS..MAX_INTERVAL_MS)"""
+    try:
+        interval_ms = float(query.get('interval_ms', ['5'])[0])
+    except ValueError:
+        return 0.0, "interval_ms debe ser numérico"
+    if not interval_ms > 0:
+        return 0.0, "interval_ms debe ser mayor que 0"
+    return min(max(interval_ms, MIN_INTERVAL_MS), MAX_INTERVAL_MS) / 1000, None
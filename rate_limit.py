@@ -0,0 +1,182 @@
+"""
+Límite de actualizaciones por usuario
+-------------------------------------
+Cubetas de fichas por usuario que se revisan antes de cualquier manejador, para
+que un cliente que repite /start o escribe sin parar no sature el disco (cada
+/start guarda user_data.pkl) ni la cuota de envíos a Telegram.
+
+Cada usuario tiene una cubeta general para todas sus actualizaciones y otra,
+más estricta, para /start. Lo que excede el límite no llega a los manejadores:
+los /start y los textos se agrupan (se guarda solo el último de cada usuario y
+se entrega cuando vuelve a haber fichas) y el resto (botones, otros tipos) se
+descarta. Quien acumula `block_after` actualizaciones descartadas sin una pausa
+de `strike_window` segundos queda bloqueado un tiempo que se duplica con cada
+reincidencia (hasta `block_max`); tras `forgive_after` segundos sin bloqueos se
+olvidan las reincidencias.
+"""
+import logging
+import time
+from typing import Callable, Dict, List, Optional, Set
+
+from telegram import Update
+
+logger = logging.getLogger(__name__)
+
+# Resultado de revisar una actualización
+ALLOW = 'allow'
+COLLAPSED = 'collapsed'  # Guardada como la última pendiente del usuario
+DROPPED = 'dropped'
+BLOCKED = 'blocked'
+
+COLLAPSIBLE = ('start', 'text')  # Tipos de los que se entrega el último tras el límite
+
+
+def update_kind(update: Update) -> str:
+    """Tipo de actualización para el límite: 'start', 'text', 'callback' u 'other'"""
+    message = update.message
+    if message is not None and message.text:
+        return 'start' if message.text.split(maxsplit=1)[0].split('@')[0] == '/start' else 'text'
+    if update.callback_query is not None:
+        return 'callback'
+    return 'other'
+
+
+class UserLimits:
+    """Fichas, descartes y bloqueo de un usuario"""
+
+    __slots__ = ('tokens', 'start_tokens', 'updated', 'strikes', 'last_strike',
+                 'offenses', 'blocked_until', 'pending', 'pending_kind')
+
+    def __init__(self, burst: float, start_burst: float, now: float):
+        self.tokens = burst
+        self.start_tokens = start_burst
+        self.updated = now
+        self.strikes = 0
+        self.last_strike = 0.0
+        self.offenses = 0
+        self.blocked_until = 0.0
+        self.pending: Optional[Update] = None  # Último /start o texto agrupado, por entregar
+        self.pending_kind = ''
+
+
+class InboundRateLimiter:
+    """Cubetas de fichas por usuario con bloqueos temporales crecientes"""
+
+    PRUNE_INTERVAL = 60.0
+
+    def __init__(self, rate: float = 1.0, burst: float = 10, start_rate: float = 1 / 20, start_burst: float = 3,
+                 block_after: int = 30, strike_window: float = 60.0, block_seconds: float = 60.0,
+                 block_max: float = 3600.0, forgive_after: float = 86400.0,
+                 clock: Callable[[], float] = time.monotonic):
+        self.rate = rate
+        self.burst = burst
+        self.start_rate = start_rate
+        self.start_burst = start_burst
+        self.block_after = block_after
+        self.strike_window = strike_window
+        self.block_seconds = block_seconds
+        self.block_max = block_max
+        self.forgive_after = forgive_after
+        self.clock = clock
+        self.users: Dict[int, UserLimits] = {}
+        self._released: Set[int] = set()  # update_id de las agrupadas ya entregadas, que pasan sin revisar
+        self._last_prune = clock()
+
+    @property
+    def blocked(self) -> int:
+        now = self.clock()
+        return sum(1 for limits in self.users.values() if limits.blocked_until > now)
+
+    @property
+    def pending(self) -> int:
+        return sum(1 for limits in self.users.values() if limits.pending is not None)
+
+    def _refill(self, limits: UserLimits, now: float) -> None:
+        elapsed = now - limits.updated
+        if elapsed > 0:
+            limits.tokens = min(self.burst, limits.tokens + elapsed * self.rate)
+            limits.start_tokens = min(self.start_burst, limits.start_tokens + elapsed * self.start_rate)
+            limits.updated = now
+
+    def _has_tokens(self, limits: UserLimits, kind: str) -> bool:
+        return limits.tokens >= 1 and (kind != 'start' or limits.start_tokens >= 1)
+
+    def _take(self, limits: UserLimits, kind: str) -> None:
+        limits.tokens -= 1
+        if kind == 'start':
+            limits.start_tokens -= 1
+
+    def was_released(self, update: Update) -> bool:
+        """True (una sola vez) si la actualización es una agrupada que devolvió release()"""
+        if update.update_id in self._released:
+            self._released.discard(update.update_id)
+            return True
+        return False
+
+    def check(self, user_id: int, update: Update, kind: Optional[str] = None) -> str:
+        """ALLOW si la actualización puede seguir; si no, COLLAPSED, DROPPED o BLOCKED"""
+        kind = kind or update_kind(update)
+        now = self.clock()
+        limits = self.users.get(user_id)
+        if limits is None:
+            limits = self.users[user_id] = UserLimits(self.burst, self.start_burst, now)
+        if limits.blocked_until > now:
+            return BLOCKED
+        self._refill(limits, now)
+        if self._has_tokens(limits, kind):
+            self._take(limits, kind)
+            # Lo agrupado antes queda reemplazado por esta actualización más reciente
+            limits.pending = None
+            return ALLOW
+
+        # Exceso: se cuenta para el bloqueo y se agrupa o se descarta
+        if now - limits.last_strike > self.strike_window:
+            limits.strikes = 0
+        limits.strikes += 1
+        limits.last_strike = now
+        if limits.strikes >= self.block_after:
+            self._block(user_id, limits, now)
+            return BLOCKED
+        if kind in COLLAPSIBLE:
+            limits.pending = update
+            limits.pending_kind = kind
+            return COLLAPSED
+        return DROPPED
+
+    def _block(self, user_id: int, limits: UserLimits, now: float) -> None:
+        if limits.offenses and now - limits.blocked_until > self.forgive_after:
+            limits.offenses = 0
+        limits.offenses += 1
+        seconds = min(self.block_max, self.block_seconds * 2 ** (limits.offenses - 1))
+        limits.blocked_until = now + seconds
+        limits.strikes = 0
+        limits.pending = None
+        logger.warning(f"Usuario {user_id} bloqueado {seconds:.0f}s por exceso de actualizaciones "
+                       f"(vez {limits.offenses})")
+
+    def release(self) -> List[Update]:
+        """Actualizaciones agrupadas que ya tienen fichas, para volver a encolarlas"""
+        now = self.clock()
+        ready = []
+        for limits in self.users.values():
+            if limits.pending is None or limits.blocked_until > now:
+                continue
+            self._refill(limits, now)
+            if self._has_tokens(limits, limits.pending_kind):
+                self._take(limits, limits.pending_kind)
+                self._released.add(limits.pending.update_id)
+                ready.append(limits.pending)
+                limits.pending = None
+        if now - self._last_prune >= self.PRUNE_INTERVAL:
+            self._prune(now)
+        return ready
+
+    def _prune(self, now: float) -> None:
+        """Olvida a los usuarios con la cubeta llena, sin pendientes y sin reincidencias que recordar"""
+        self._last_prune = now
+        idle = [user_id for user_id, limits in self.users.items()
+                if limits.pending is None and now - limits.updated >= max(self.burst / self.rate,
+                                                                          self.start_burst / self.start_rate)
+                and (not limits.offenses or now - limits.blocked_until > self.forgive_after)]
+        for user_id in idle:
+            del self.users[user_id]
@@ -0,0 +1,165 @@
+"""
+Recordatorios de citas
+----------------------
+Recordatorios 24 h y 1 h antes de cada cita confirmada, sin un job de
+APScheduler por cita. Los recordatorios viven en la sección persistida
+'reminders' agrupados en cubetas de BUCKET segundos ({cubeta: {clave: datos}}):
+una única tarea periódica recorre solo las cubetas vencidas desde la última que
+procesó y entrega sus recordatorios en lotes. Cada tic trabaja en proporción a
+lo vencido y, al estar guardados junto a las reservas, un reinicio no pierde
+ninguno.
+
+Lo que se está enviando queda en 'inflight' hasta confirmarse; si el proceso
+se cae en medio, el siguiente arranque lo vuelve a encolar. Al disparar se
+revisa que la cita siga confirmada y a la misma hora: si se canceló se descarta,
+y si el horario importado la movió se reprograma para la nueva hora.
+"""
+import logging
+import time
+from datetime import datetime
+from typing import TYPE_CHECKING, Any, Dict, List, Optional
+
+from appointments import AppointmentCalendar, ReservationManager
+
+if TYPE_CHECKING:
+    from faq_bot import UserDataManager
+
+logger = logging.getLogger(__name__)
+
+BUCKET = 60  # Segundos por cubeta
+OFFSETS = (('24h', 24 * 3600), ('1h', 3600))  # Tipo de recordatorio y anticipación
+
+
+def slot_timestamp(slot: Dict[str, Any]) -> float:
+    return datetime.fromisoformat(slot['start']).timestamp()
+
+
+class ReminderScheduler:
+    """Recordatorios pendientes por cubeta de tiempo, en la sección 'reminders'"""
+
+    def __init__(self, storage: 'UserDataManager', calendar: AppointmentCalendar,
+                 reservations: ReservationManager):
+        self.storage = storage
+        self.calendar = calendar
+        self.reservations = reservations
+        # {'cursor': última cubeta procesada, 'buckets': {cubeta: {clave: recordatorio}}, 'inflight': {...}}
+        self.section: Dict[str, Any] = storage.get_section('reminders')
+        self._recovered = False
+        if 'buckets' not in self.section:
+            self._backfill()
+
+    def _backfill(self) -> None:
+        """Primera vez: programa los recordatorios de las citas ya confirmadas"""
+        self.section.update({'cursor': int(time.time() // BUCKET), 'buckets': {}, 'inflight': {}})
+        count = 0
+        for slot_id, state in list(self.reservations.states.items()):
+            if state.get('status') == ReservationManager.BOOKED:
+                user = self.storage.user_data.get(state['user_id'], {})
+                count += self.schedule_booking(slot_id, state['user_id'], user.get('language', 'es'),
+                                               user.get('name', ''))
+        if count:
+            logger.info(f"{count} recordatorios programados para las citas existentes")
+
+    @property
+    def pending(self) -> int:
+        return sum(len(bucket) for bucket in self.section.get('buckets', {}).values())
+
+    @property
+    def next_due(self) -> Optional[float]:
+        """Instante en que vence el próximo recordatorio, o None si no hay ninguno"""
+        if self.section.get('inflight'):
+            return time.time()
+        buckets = self.section.get('buckets')
+        return min(buckets) * BUCKET if buckets else None
+
+    def _add(self, key: str, reminder: Dict[str, Any], due: float) -> None:
+        bucket = max(int(due // BUCKET), self.section['cursor'] + 1)
+        self.section['buckets'].setdefault(bucket, {})[key] = reminder
+
+    def schedule_booking(self, slot_id: str, user_id: int, lang: str, name: str,
+                         now: Optional[float] = None) -> int:
+        """Programa los recordatorios de una cita confirmada que todavía quedan en el futuro"""
+        slot = self.calendar.get_slot(slot_id)
+        if not slot:
+            return 0
+        now = time.time() if now is None else now
+        start = slot_timestamp(slot)
+        count = 0
+        for kind, offset in OFFSETS:
+            if start - offset > now:
+                reminder = {'slot_id': slot_id, 'user_id': user_id, 'kind': kind,
+                            'start': slot['start'], 'lang': lang, 'name': name}
+                self._add(f"{slot_id}:{kind}", reminder, start - offset)
+                count += 1
+        return count
+
+    def cancel_booking(self, slot_id: str) -> None:
+        """Quita los recordatorios de una cita cancelada (si el turno ya no existe se descartan al vencer)"""
+        slot = self.calendar.get_slot(slot_id)
+        if not slot:
+            return
+        start = slot_timestamp(slot)
+        buckets = self.section['buckets']
+        for kind, offset in OFFSETS:
+            bucket_id = max(int((start - offset) // BUCKET), self.section['cursor'] + 1)
+            bucket = buckets.get(bucket_id)
+            if bucket is not None and bucket.pop(f"{slot_id}:{kind}", None) is not None and not bucket:
+                del buckets[bucket_id]
+
+    def take(self, limit: int, now: Optional[float] = None) -> List[Dict[str, Any]]:
+        """Saca hasta `limit` recordatorios vencidos y vigentes; quedan en 'inflight' hasta done()"""
+        now = time.time() if now is None else now
+        section = self.section
+        buckets, inflight = section['buckets'], section['inflight']
+        if not self._recovered:
+            # Lo que estaba enviándose cuando se cayó el proceso vuelve a la cola
+            for key, reminder in list(inflight.items()):
+                buckets.setdefault(section['cursor'] + 1, {})[key] = reminder
+            inflight.clear()
+            self._recovered = True
+
+        target = int(now // BUCKET)
+        if target - section['cursor'] > len(buckets):
+            # Tras un apagado largo: más barato recorrer las cubetas existentes que todas las transcurridas
+            due_buckets = sorted(bucket for bucket in buckets if bucket <= target)
+        else:
+            due_buckets = [bucket for bucket in range(section['cursor'] + 1, target + 1) if bucket in buckets]
+        taken: List[Dict[str, Any]] = []
+        for bucket_id in due_buckets:
+            bucket = buckets[bucket_id]
+            while bucket and len(taken) < limit:
+                key, reminder = bucket.popitem()
+                if self._still_valid(key, reminder, now):
+                    inflight[key] = reminder
+                    taken.append(reminder)
+            if bucket:
+                break
+            del buckets[bucket_id]
+        else:
+            section['cursor'] = max(section['cursor'], target)
+        return taken
+
+    def _still_valid(self, key: str, reminder: Dict[str, Any], now: float) -> bool:
+        state = self.reservations.states.get(reminder['slot_id'])
+        slot = self.calendar.get_slot(reminder['slot_id'])
+        if not state or state['status'] != ReservationManager.BOOKED or state['user_id'] != reminder['user_id'] \
+                or not slot:
+            return False
+        if slot['start'] != reminder['start']:
+            # El turno cambió de hora: se reprograma para la nueva
+            self.schedule_booking(reminder['slot_id'], reminder['user_id'], reminder['lang'], reminder['name'], now)
+            return False
+        remaining = slot_timestamp(slot) - now
+        # Atrasado (p. ej. tras un apagado): no se avisa de una cita que ya empezó, ni el de 24 h
+        # cuando ya toca el de 1 h
+        return remaining > 0 and not (reminder['kind'] == '24h' and remaining <= 3600)
+
+    def done(self, reminder: Dict[str, Any]) -> None:
+        """Marca un recordatorio como entregado (o descartado sin reintento)"""
+        self.section['inflight'].pop(f"{reminder['slot_id']}:{reminder['kind']}", None)
+
+    def requeue(self, reminder: Dict[str, Any]) -> None:
+        """Devuelve un recordatorio a la próxima cubeta (p. ej. tras un 429)"""
+        key = f"{reminder['slot_id']}:{reminder['kind']}"
+        self.section['inflight'].pop(key, None)
+        self.section['buckets'].setdefault(self.section['cursor'] + 1, {})[key] = reminder
@@ -0,0 +1,458 @@
+"""
+Importación de horarios de médicos desde CSV e iCalendar
+--------------------------------------------------------
+Lee los archivos en streaming (fila por fila / evento por evento), valida cada
+registro, lo expande en turnos y los inserta o actualiza en el calendario de
+citas. Cada fila guarda una huella para que una nueva importación del mismo
+archivo solo toque las filas que cambiaron.
+
+Formato CSV (con encabezado):
+    medico,especialidad,sede,fecha,hora_inicio,hora_fin[,duracion]
+    Dra. Pérez,Cardiología,Sede Principal,2026-10-20,08:00,12:00,20
+
+Formato iCalendar: un VEVENT por jornada con SUMMARY (médico), CATEGORIES
+(especialidad), LOCATION (sede), DTSTART/DTEND y opcionalmente un RRULE
+sencillo (FREQ=DAILY|WEEKLY con INTERVAL, COUNT o UNTIL).
+
+Uso: python schedule_import.py archivo.csv [archivo.ics ...]
+"""
+import asyncio
+import csv
+import hashlib
+import logging
+import os
+import re
+import sys
+import threading
+import unicodedata
+from collections import Counter
+from datetime import datetime, timedelta, timezone
+from typing import TYPE_CHECKING, Any, Dict, Iterator, List, Optional, Tuple
+
+from appointments import AppointmentCalendar, ReservationManager
+
+if TYPE_CHECKING:
+    from faq_bot import UserDataManager
+
+logger = logging.getLogger(__name__)
+
+# Registro validado: (médico, especialidad, sede, inicio, fin, duración en minutos)
+Record = Tuple[str, str, str, datetime, datetime, int]
+
+
+class ScheduleValidationError(ValueError):
+    """Error de validación de una fila o evento de horario"""
+
+
+class ImportReport:
+    """Resumen de una importación"""
+
+    MAX_ERRORS_KEPT = 50
+
+    def __init__(self, source: str):
+        self.source = source
+        self.rows = 0
+        self.unchanged = 0
+        self.upserted_rows = 0
+        self.removed_rows = 0
+        self.slots_upserted = 0
+        self.slots_removed = 0
+        self.error_count = 0
+        self.errors: List[str] = []
+
+    def add_error(self, line: int, message: str) -> None:
+        self.error_count += 1
+        # Solo se conservan los primeros errores para no crecer sin límite
+        if len(self.errors) < self.MAX_ERRORS_KEPT:
+            self.errors.append(f"{self.source}:{line}: {message}")
+
+    def as_dict(self) -> Dict[str, Any]:
+        return dict(vars(self))
+
+    def __str__(self) -> str:
+        return (f"{os.path.basename(self.source)}: {self.rows} filas, {self.upserted_rows} actualizadas, "
+                f"{self.unchanged} sin cambios, {self.removed_rows} eliminadas, "
+                f"{self.slots_upserted} turnos escritos, {self.error_count} errores")
+
+
+def normalize_sede(sede: str) -> str:
+    """Normaliza el nombre de una sede al formato de carpetas ('Sede Principal' -> 'sede_principal')"""
+    text = unicodedata.normalize('NFKD', sede).encode('ascii', 'ignore').decode('ascii')
+    return re.sub(r'[^a-z0-9]+', '_', text.lower()).strip('_')
+
+
+def parse_datetime(date_text: str, time_text: str) -> datetime:
+    try:
+        return datetime.strptime(f"{date_text.strip()} {time_text.strip()}", "%Y-%m-%d %H:%M")
+    except ValueError:
+        raise ScheduleValidationError(f"fecha u hora inválida: '{date_text} {time_text}'")
+
+
+def validate_record(doctor: str, specialty: str, sede: str, start: datetime,
+                    end: datetime, duration: int) -> Record:
+    """Valida un registro de horario y lo devuelve normalizado"""
+    doctor, specialty = doctor.strip(), specialty.strip()
+    if not doctor:
+        raise ScheduleValidationError("falta el médico")
+    if not specialty:
+        raise ScheduleValidationError("falta la especialidad")
+    if not sede.strip():
+        raise ScheduleValidationError("falta la sede")
+    if end <= start:
+        raise ScheduleValidationError("la hora de fin debe ser posterior a la de inicio")
+    if end - start > timedelta(hours=24):
+        raise ScheduleValidationError("una jornada no puede superar 24 horas")
+    if not 5 <= duration <= 240:
+        raise ScheduleValidationError(f"duración de turno fuera de rango: {duration}")
+    return doctor, specialty, normalize_sede(sede), start, end, duration
+
+
+def iter_csv(path: str, default_duration: int) -> Iterator[Tuple[int, str, Any]]:
+    """Recorre un CSV fila por fila. Produce (línea, clave de fila, registro o error)"""
+    with open(path, newline='', encoding='utf-8-sig') as f:
+        reader = csv.DictReader(f)
+        required = {'medico', 'especialidad', 'sede', 'fecha', 'hora_inicio', 'hora_fin'}
+        missing = required - set(reader.fieldnames or [])
+        if missing:
+            yield 1, '', ScheduleValidationError(f"faltan columnas: {', '.join(sorted(missing))}")
+            return
+        for row in reader:
+            line = reader.line_num
+            key = '|'.join((row.get('medico') or '', row.get('sede') or '',
+                            row.get('fecha') or '', row.get('hora_inicio') or ''))
+            try:
+                duration_text = (row.get('duracion') or '').strip()
+                record = validate_record(
+                    row['medico'] or '', row['especialidad'] or '', row['sede'] or '',
+                    parse_datetime(row['fecha'] or '', row['hora_inicio'] or ''),
+                    parse_datetime(row['fecha'] or '', row['hora_fin'] or ''),
+                    int(duration_text) if duration_text else default_duration
+                )
+                yield line, key, [record]
+            except (ScheduleValidationError, ValueError) as e:
+                yield line, key, ScheduleValidationError(str(e))
+
+
+def _unfold_ics(f) -> Iterator[Tuple[int, str]]:
+    """Une las líneas plegadas de iCalendar (RFC 5545 §3.1) sin cargar el archivo completo"""
+    pending, pending_line = None, 0
+    for number, raw in enumerate(f, 1):
+        line = raw.rstrip('\r\n')
+        if line[:1] in (' ', '\t') and pending is not None:
+            pending += line[1:]
+            continue
+        if pending is not None:
+            yield pending_line, pending
+        pending, pending_line = line, number
+    if pending is not None:
+        yield pending_line, pending
+
+
+def _parse_ics_datetime(value: str) -> datetime:
+    value = value.strip()
+    try:
+        if value.endswith('Z'):
+            utc = datetime.strptime(value, "%Y%m%dT%H%M%SZ").replace(tzinfo=timezone.utc)
+            return utc.astimezone().replace(tzinfo=None)
+        if len(value) == 8:
+            return datetime.strptime(value, "%Y%m%d")
+        return datetime.strptime(value, "%Y%m%dT%H%M%S")
+    except ValueError:
+        raise ScheduleValidationError(f"fecha iCalendar inválida: '{value}'")
+
+
+def _expand_rrule(rule: str, start: datetime) -> List[datetime]:
+    """Expande un RRULE sencillo (DAILY/WEEKLY con INTERVAL y COUNT o UNTIL)"""
+    parts = dict(part.split('=', 1) for part in rule.split(';') if '=' in part)
+    unsupported = set(parts) - {'FREQ', 'INTERVAL', 'COUNT', 'UNTIL', 'WKST'}
+    if unsupported or parts.get('FREQ') not in ('DAILY', 'WEEKLY'):
+        raise ScheduleValidationError(f"RRULE no soportado: {rule}")
+    step = timedelta(days=1 if parts['FREQ'] == 'DAILY' else 7) * int(parts.get('INTERVAL', '1'))
+    until = _parse_ics_datetime(parts['UNTIL']) if 'UNTIL' in parts else None
+    count = int(parts['COUNT']) if 'COUNT' in parts else None
+    if until is None and count is None:
+        raise ScheduleValidationError("RRULE sin COUNT ni UNTIL")
+    limit = min(count or 400, 400)  # Nunca más de un año y algo de jornadas por evento
+    starts = []
+    current = start
+    while len(starts) < limit and (until is None or current <= until):
+        starts.append(current)
+        current += step
+    return starts
+
+
+def iter_ics(path: str, default_duration: int) -> Iterator[Tuple[int, str, Any]]:
+    """Recorre un archivo .ics evento por evento. Produce (línea, clave, registros o error)"""
+    with open(path, encoding='utf-8-sig') as f:
+        event: Optional[Dict[str, str]] = None
+        event_line = 0
+        for line, content in _unfold_ics(f):
+            if content == 'BEGIN:VEVENT':
+                event, event_line = {}, line
+                continue
+            if event is None:
+                continue
+            if content == 'END:VEVENT':
+                key = event.get('UID', f"linea{event_line}") + event.get('RECURRENCE-ID', '')
+                try:
+                    if 'DTSTART' not in event or 'DTEND' not in event:
+                        raise ScheduleValidationError("evento sin DTSTART o DTEND")
+                    start = _parse_ics_datetime(event['DTSTART'])
+                    end = _parse_ics_datetime(event['DTEND'])
+                    duration_text = event.get('X-DURACION', '').strip()
+                    duration = int(duration_text) if duration_text else default_duration
+                    starts = _expand_rrule(event['RRULE'], start) if 'RRULE' in event else [start]
+                    yield event_line, key, [
+                        validate_record(event.get('SUMMARY', ''), event.get('CATEGORIES', '').split(',')[0],
+                                        event.get('LOCATION', ''), day, day + (end - start), duration)
+                        for day in starts
+                    ]
+                except (ScheduleValidationError, ValueError) as e:
+                    yield event_line, key, ScheduleValidationError(str(e))
+                event = None
+                continue
+            name, _, value = content.partition(':')
+            # Se descartan los parámetros (;TZID=..., ;LANGUAGE=...)
+            event[name.split(';', 1)[0].upper()] = value.replace('\\,', ',').replace('\\n', ' ')
+
+
+class ScheduleImporter:
+    """Importa horarios al calendario de citas con semántica upsert e importación incremental"""
+
+    BATCH_SIZE = 500  # Filas por lote entregado al calendario
+
+    def __init__(self, calendar: AppointmentCalendar, storage: 'UserDataManager',
+                 reservations: Optional[ReservationManager] = None, slot_minutes: int = 20):
+        self.calendar = calendar
+        self.storage = storage
+        self.reservations = reservations
+        self.slot_minutes = slot_minutes
+        # archivo -> {clave de fila: (huella, turnos generados)} y '__file__' -> (mtime, tamaño)
+        self.fingerprints: Dict[str, Dict[str, Any]] = storage.get_section('import_fingerprints')
+        # slot_id -> filas (de cualquier archivo) que lo generan; se borra cuando no queda ninguna
+        self._slot_refs: Counter = Counter()
+        self.reload()
+        storage.add_reload_listener(self.reload)
+
+    def reload(self) -> None:
+        """Recuenta las filas que generan cada turno a partir de las huellas persistidas"""
+        self._slot_refs = Counter(
+            slot_id
+            for rows in self.fingerprints.values()
+            for key, value in rows.items() if key != '__file__'
+            for slot_id in value[1]
+        )
+
+    def _iter_source(self, path: str) -> Iterator[Tuple[int, str, Any]]:
+        if path.lower().endswith('.ics'):
+            return iter_ics(path, self.slot_minutes)
+        if path.lower().endswith('.csv'):
+            return iter_csv(path, self.slot_minutes)
+        raise ScheduleValidationError(f"formato no soportado: {path}")
+
+    @staticmethod
+    def _expand(records: List[Record]) -> List[Tuple[str, Dict[str, Any]]]:
+        """Divide cada jornada en turnos de la duración indicada"""
+        slots = []
+        for doctor, specialty, sede, start, end, duration in records:
+            step = timedelta(minutes=duration)
+            current = start
+            while current + step <= end:
+                start_text = current.isoformat(timespec='minutes')
+                slots.append((AppointmentCalendar.make_slot_id(doctor, start_text), {
+                    'doctor': doctor,
+                    'specialty': specialty,
+                    'sede': sede,
+                    'start': start_text,
+                    'end': (current + step).isoformat(timespec='minutes')
+                }))
+                current += step
+        return slots
+
+    def _plan(self, path: str, previous_keys: set, report: ImportReport,
+              stop: threading.Event) -> Iterator[Tuple[str, list]]:
+        """Lee y valida el archivo, produciendo lotes solo con las filas que cambiaron"""
+        known = self.fingerprints.get(path, {})
+        seen = set()
+        batch = []
+        for line, key, result in self._iter_source(path):
+            if stop.is_set():
+                return
+            if isinstance(result, ScheduleValidationError):
+                report.add_error(line, str(result))
+                # Una fila inválida no debe borrar los turnos que ya generó antes
+                seen.add(key)
+                continue
+            report.rows += 1
+            seen.add(key)
+            digest = hashlib.blake2b(repr(result).encode('utf-8'), digest_size=8).digest()
+            previous = known.get(key)
+            if previous is not None and previous[0] == digest:
+                report.unchanged += 1
+                continue
+            batch.append((key, digest, self._expand(result)))
+            if len(batch) >= self.BATCH_SIZE:
+                yield 'upsert', batch
+                batch = []
+        if batch:
+            yield 'upsert', batch
+        removed = [key for key in previous_keys if key not in seen and key != '__file__']
+        if removed:
+            yield 'remove', removed
+
+    def _apply(self, path: str, kind: str, batch: list, report: ImportReport) -> None:
+        """Aplica un lote al calendario (se ejecuta en el hilo del bucle de eventos)"""
+        known = self.fingerprints.setdefault(path, {})
+        if kind == 'upsert':
+            for key, digest, slots in batch:
+                new_ids = set()
+                for slot_id, data in slots:
+                    new_ids.add(slot_id)
+                    if self.calendar.upsert_slot(slot_id, data):
+                        report.slots_upserted += 1
+                previous_ids = set(known[key][1]) if key in known else set()
+                self._slot_refs.update(new_ids - previous_ids)
+                self._release_slots(previous_ids - new_ids, report)
+                known[key] = (digest, tuple(new_ids))
+                report.upserted_rows += 1
+        else:
+            for key in batch:
+                previous = known.pop(key, None)
+                if previous is not None:
+                    self._release_slots(previous[1], report)
+                    report.removed_rows += 1
+
+    def _release_slots(self, slot_ids, report: ImportReport) -> None:
+        """Descuenta una fila de cada turno y borra los que ya no genera ninguna"""
+        for slot_id in slot_ids:
+            self._slot_refs[slot_id] -= 1
+            if self._slot_refs[slot_id] > 0:
+                continue
+            del self._slot_refs[slot_id]
+            # Los turnos ya reservados se conservan aunque desaparezcan del archivo
+            if self.reservations and not self.reservations.is_available(slot_id):
+                logger.warning(f"Turno {slot_id} eliminado del horario pero tiene una reserva; se conserva")
+                continue
+            if self.calendar.remove_slot(slot_id):
+                report.slots_removed += 1
+
+    def _file_changed(self, path: str) -> bool:
+        stat = os.stat(path)
+        return self.fingerprints.get(path, {}).get('__file__') != (stat.st_mtime_ns, stat.st_size)
+
+    def _mark_file(self, path: str) -> None:
+        stat = os.stat(path)
+        self.fingerprints.setdefault(path, {})['__file__'] = (stat.st_mtime_ns, stat.st_size)
+
+    def import_file(self, path: str) -> ImportReport:
+        """Importa un archivo de forma síncrona (uso por línea de comandos)"""
+        path = os.path.abspath(path)
+        report = ImportReport(path)
+        previous_keys = set(self.fingerprints.get(path, {}))
+        for kind, batch in self._plan(path, previous_keys, report, threading.Event()):
+            self._apply(path, kind, batch, report)
+        self._mark_file(path)
+        self.storage.save_data()
+        return report
+
+    async def import_file_async(self, path: str) -> ImportReport:
+        """Importa un archivo sin bloquear el bucle de eventos.
+
+        La lectura y validación corren en un hilo; los lotes llegan por una cola
+        acotada y se aplican en el bucle entre actualizaciones de Telegram.
+        """
+        path = os.path.abspath(path)
+        report = ImportReport(path)
+        previous_keys = set(self.fingerprints.get(path, {}))
+        loop = asyncio.get_running_loop()
+        queue: asyncio.Queue = asyncio.Queue(maxsize=2)
+        stop = threading.Event()
+
+        def producer() -> None:
+            try:
+                for item in self._plan(path, previous_keys, report, stop):
+                    asyncio.run_coroutine_threadsafe(queue.put(item), loop).result()
+            finally:
+                asyncio.run_coroutine_threadsafe(queue.put(None), loop).result()
+
+        future = loop.run_in_executor(None, producer)
+        try:
+            while True:
+                item = await queue.get()
+                if item is None:
+                    break
+                with self.storage.shared():
+                    self._apply(path, item[0], item[1], report)
+                await asyncio.sleep(0)  # Ceder el bucle a los manejadores del bot
+        except BaseException:
+            # Desbloquear al productor antes de propagar el error
+            stop.set()
+            while await queue.get() is not None:
+                pass
+            raise
+        finally:
+            await future
+        with self.storage.shared():
+            self._mark_file(path)
+        await self.storage.save_data_async()
+        return report
+
+    def _retire_file(self, path: str) -> ImportReport:
+        """Quita los turnos de un archivo que ya no existe (los reservados y los que otro archivo genera se conservan)"""
+        report = ImportReport(path)
+        keys = [key for key in self.fingerprints.get(path, {}) if key != '__file__']
+        self._apply(path, 'remove', keys, report)
+        self.fingerprints.pop(path, None)
+        return report
+
+    async def import_directory_async(self, directory: str) -> List[ImportReport]:
+        """Importa los archivos .csv/.ics de una carpeta que cambiaron y retira los que se borraron"""
+        reports = []
+        if not os.path.isdir(directory):
+            return reports
+        for name in sorted(os.listdir(directory)):
+            path = os.path.abspath(os.path.join(directory, name))
+            if not name.lower().endswith(('.csv', '.ics')) or not self._file_changed(path):
+                continue
+            try:
+                report = await self.import_file_async(path)
+                logger.info(f"Horario importado: {report}")
+                for error in report.errors[:10]:
+                    logger.warning(f"Error de validación: {error}")
+                reports.append(report)
+            except Exception as e:
+                logger.error(f"Error al importar horario {path}: {e}")
+
+        # Después de importar: si un archivo solo se renombró, sus turnos ya tienen otra fila que los genera
+        directory = os.path.abspath(directory)
+        retired = []
+        with self.storage.shared():
+            for path in [path for path in self.fingerprints
+                         if os.path.dirname(path) == directory and not os.path.exists(path)]:
+                report = self._retire_file(path)
+                logger.info(f"Horario eliminado de la carpeta: {report}")
+                retired.append(report)
+        if retired:
+            await self.storage.save_data_async()
+        return reports + retired
+
+
+def main() -> None:
+    """Importa los archivos indicados en la línea de comandos"""
+    from faq_bot import UserDataManager
+
+    if len(sys.argv) < 2:
+        print(__doc__)
+        sys.exit(1)
+    storage = UserDataManager()
+    calendar = AppointmentCalendar(storage)
+    importer = ScheduleImporter(calendar, storage, ReservationManager(storage))
+    for path in sys.argv[1:]:
+        report = importer.import_file(path)
+        print(report)
+        for error in report.errors:
+            print(f"  {error}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,221 @@
+"""
+Sedes y sede más cercana
+------------------------
+Registro de las sedes de la clínica con sus coordenadas, para responder a una
+ubicación compartida con la sede más cercana, la distancia y cómo llegar.
+
+Las sedes se reparten en una grilla de celdas de `cell_degrees` grados. Para una
+ubicación se revisan primero las sedes de su celda y luego los anillos de
+celdas vecinas, y se corta en cuanto ninguna celda sin revisar puede tener algo
+más cerca que lo ya encontrado; así el costo depende de las sedes de la zona y
+no del total de la red. La distancia es la de haversine, calculada de una vez
+para todas las candidatas con NumPy si está instalado (si no, en Python puro).
+Con pocas sedes se comparan todas directamente. No contempla redes a ambos
+lados del antimeridiano.
+
+Además de las dos sedes de TranslationManager, se cargan las de SEDES_FILE si
+existe: una lista JSON de {"key", "name" (texto o {idioma: texto}), "latitude",
+"longitude", "address"}.
+"""
+import json
+import logging
+import math
+import os
+from typing import TYPE_CHECKING, Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+try:
+    import numpy as np
+except ImportError:  # NumPy es opcional: sin él la distancia se calcula en Python
+    np = None
+
+if TYPE_CHECKING:
+    from faq_bot import TranslationManager
+
+logger = logging.getLogger(__name__)
+
+EARTH_RADIUS_KM = 6371.0088
+BRUTE_FORCE_LIMIT = 256  # Hasta esta cantidad de sedes se comparan todas sin usar la grilla
+NUMPY_MIN_CANDIDATES = 48  # Con menos candidatas el bucle en Python es más rápido que NumPy
+
+# Sedes de TranslationManager, en el orden de sus etiquetas en 'location'
+BUILTIN_SEDES = ('main_office', 'secondary_office')
+
+
+class Sede(NamedTuple):
+    key: str
+    names: Dict[str, str]  # idioma -> nombre
+    latitude: float
+    longitude: float
+    address: str
+
+    def name(self, lang: str) -> str:
+        return self.names.get(lang) or self.names.get('es') or next(iter(self.names.values()), self.key)
+
+
+def directions_url(latitude: float, longitude: float, sede: Sede) -> str:
+    """Enlace de Google Maps con la ruta desde la ubicación compartida hasta la sede"""
+    return (f"https://www.google.com/maps/dir/?api=1&origin={latitude:.6f},{longitude:.6f}"
+            f"&destination={sede.latitude:.6f},{sede.longitude:.6f}")
+
+
+class SedeRegistry:
+    """Sedes indexadas en una grilla de celdas para buscar la más cercana a una ubicación"""
+
+    def __init__(self, sedes: Iterable[Sede] = (), cell_degrees: float = 0.25,
+                 use_numpy: bool = True, brute_force_limit: int = BRUTE_FORCE_LIMIT):
+        self.cell_degrees = cell_degrees
+        self.use_numpy = use_numpy and np is not None
+        self.brute_force_limit = brute_force_limit
+        self.sedes: List[Sede] = []
+        self._keys: Dict[str, int] = {}
+        self._built = False
+        for sede in sedes:
+            self.add(sede)
+
+    @classmethod
+    def from_translations(cls, translations: 'TranslationManager', path: Optional[str] = None,
+                          **kwargs) -> 'SedeRegistry':
+        """Sedes de TranslationManager y, si existe, las del archivo `path`"""
+        registry = cls(**kwargs)
+        for position, key in enumerate(BUILTIN_SEDES):
+            latitude, longitude = translations.locations[key]
+            names = {lang: translations.get_text('location', lang)[position] for lang in translations.translations}
+            registry.add(Sede(key, names, latitude, longitude, translations.addresses[key]))
+        if path and os.path.exists(path):
+            registry.load(path)
+        return registry
+
+    def __len__(self) -> int:
+        return len(self.sedes)
+
+    def get(self, key: str) -> Optional[Sede]:
+        index = self._keys.get(key)
+        return self.sedes[index] if index is not None else None
+
+    def add(self, sede: Sede) -> None:
+        """Agrega o reemplaza (por clave) una sede; el índice se reconstruye en la próxima búsqueda"""
+        if not -90 <= sede.latitude <= 90 or not -180 <= sede.longitude <= 180:
+            raise ValueError(f"Coordenadas inválidas para la sede {sede.key}")
+        if sede.key in self._keys:
+            self.sedes[self._keys[sede.key]] = sede
+        else:
+            self._keys[sede.key] = len(self.sedes)
+            self.sedes.append(sede)
+        self._built = False
+
+    def load(self, path: str) -> int:
+        """Agrega las sedes de un archivo JSON; las entradas inválidas se informan y se omiten"""
+        with open(path, encoding='utf-8') as f:
+            entries = json.load(f)
+        count = 0
+        for number, entry in enumerate(entries, 1):
+            try:
+                names = entry['name'] if isinstance(entry['name'], dict) else {'es': entry['name']}
+                self.add(Sede(str(entry['key']), names, float(entry['latitude']), float(entry['longitude']),
+                              entry.get('address', '')))
+                count += 1
+            except (KeyError, TypeError, ValueError) as e:
+                logger.warning(f"Sede {number} inválida en {path}: {e}")
+        logger.info(f"{count} sedes cargadas de {path}")
+        return count
+
+    def _cell(self, latitude: float, longitude: float) -> Tuple[int, int]:
+        return math.floor(latitude / self.cell_degrees), math.floor(longitude / self.cell_degrees)
+
+    def _build(self) -> None:
+        self._lat = [math.radians(sede.latitude) for sede in self.sedes]
+        self._lon = [math.radians(sede.longitude) for sede in self.sedes]
+        self._cos = [math.cos(latitude) for latitude in self._lat]
+        self._cells: Dict[Tuple[int, int], List[int]] = {}
+        for index, sede in enumerate(self.sedes):
+            self._cells.setdefault(self._cell(sede.latitude, sede.longitude), []).append(index)
+        if self.use_numpy:
+            # Copias en arreglos para las búsquedas con muchas candidatas
+            self._lat_array = np.array(self._lat)
+            self._lon_array = np.array(self._lon)
+            self._cos_array = np.array(self._cos)
+            self._cell_arrays = {cell: np.array(indices) for cell, indices in self._cells.items()}
+        rows = [cell[0] for cell in self._cells] or [0]
+        columns = [cell[1] for cell in self._cells] or [0]
+        self._bounds = (min(rows), max(rows), min(columns), max(columns))
+        self._built = True
+
+    def _closest_array(self, indices: Any, latitude: float, longitude: float) -> Tuple[int, float]:
+        """Índice y 'a' de haversine de la candidata más cercana (comparar 'a' evita el arcoseno)"""
+        if indices is None:
+            lat, lon, cos = self._lat_array, self._lon_array, self._cos_array
+        else:
+            lat, lon, cos = self._lat_array[indices], self._lon_array[indices], self._cos_array[indices]
+        a = np.sin((lat - latitude) / 2) ** 2 + math.cos(latitude) * cos * np.sin((lon - longitude) / 2) ** 2
+        position = int(a.argmin())
+        return (position if indices is None else int(indices[position])), float(a[position])
+
+    def _closest_list(self, indices: Iterable[int], latitude: float, longitude: float) -> Tuple[int, float]:
+        """Lo mismo en Python puro; con pocas candidatas es más rápido que armar los arreglos"""
+        best, best_a = -1, math.inf
+        sin, lat, lon, cos = math.sin, self._lat, self._lon, self._cos
+        cos_latitude = math.cos(latitude)
+        for index in indices:
+            a = sin((lat[index] - latitude) / 2) ** 2 + cos_latitude * cos[index] * sin((lon[index] - longitude) / 2) ** 2
+            if a < best_a:
+                best, best_a = index, a
+        return best, best_a
+
+    def _ring(self, row: int, column: int, radius: int) -> List[Tuple[int, int]]:
+        """Celdas del borde del anillo `radius` alrededor de (row, column) que caen dentro de la grilla ocupada"""
+        first_row, last_row, first_column, last_column = self._bounds
+        if radius == 0:
+            return [(row, column)]
+        cells = []
+        for r in range(max(row - radius, first_row), min(row + radius, last_row) + 1):
+            if r in (row - radius, row + radius):
+                cells.extend((r, c) for c in range(max(column - radius, first_column),
+                                                   min(column + radius, last_column) + 1))
+            else:
+                cells.extend((r, c) for c in (column - radius, column + radius) if first_column <= c <= last_column)
+        return cells
+
+    def nearest(self, latitude: float, longitude: float) -> Optional[Tuple[Sede, float]]:
+        """Sede más cercana a la ubicación y su distancia en kilómetros, o None si no hay sedes"""
+        if not self.sedes:
+            return None
+        if not self._built:
+            self._build()
+        lat, lon = math.radians(latitude), math.radians(longitude)
+        if len(self.sedes) <= self.brute_force_limit:
+            if self.use_numpy and len(self.sedes) >= NUMPY_MIN_CANDIDATES:
+                best, best_a = self._closest_array(None, lat, lon)
+            else:
+                best, best_a = self._closest_list(range(len(self.sedes)), lat, lon)
+        else:
+            best, best_a = self._search_grid(latitude, longitude, lat, lon)
+        distance = 2 * EARTH_RADIUS_KM * math.asin(math.sqrt(min(1.0, best_a)))
+        return self.sedes[best], distance
+
+    def _search_grid(self, latitude: float, longitude: float, lat: float, lon: float) -> Tuple[int, float]:
+        row, column = self._cell(latitude, longitude)
+        first_row, last_row, first_column, last_column = self._bounds
+        # Desde el primer anillo que toca la grilla ocupada hasta el que la cubre entera
+        radius = max(0, first_row - row, row - last_row, first_column - column, column - last_column)
+        last_radius = max(row - first_row, last_row - row, column - first_column, last_column - column)
+        cos_latitude = math.cos(lat)
+        best, best_a = -1, math.inf
+        while radius <= last_radius:
+            cells = [cell for cell in self._ring(row, column, radius) if cell in self._cells]
+            if cells:
+                if self.use_numpy and sum(len(self._cells[cell]) for cell in cells) >= NUMPY_MIN_CANDIDATES:
+                    arrays = [self._cell_arrays[cell] for cell in cells]
+                    index, a = self._closest_array(arrays[0] if len(arrays) == 1 else np.concatenate(arrays), lat, lon)
+                else:
+                    index, a = self._closest_list((i for cell in cells for i in self._cells[cell]), lat, lon)
+                if a < best_a:
+                    best, best_a = index, a
+            if best >= 0:
+                # Lo que queda fuera del anillo está a más de `radius` celdas en latitud o en longitud;
+                # la cota es la distancia al meridiano más próximo de ese borde
+                angle = math.radians(min(90.0, radius * self.cell_degrees))
+                bound = math.asin(min(1.0, cos_latitude * math.sin(angle)))
+                if math.sin(bound / 2) ** 2 >= best_a:
+                    break
+            radius += 1
+        return best, best_a
@@ -0,0 +1,376 @@
+"""
+Varias clínicas en un proceso
+-----------------------------
+Con TENANTS_DIR, app.py atiende a muchas clínicas, cada una con su propio bot de
+Telegram, desde un solo proceso: un único bucle de eventos, un único pool de
+conexiones HTTP hacia la API de Telegram y un único servidor web que recibe los
+webhooks de todas en /telegram/<clínica>.
+
+Cada clínica es un directorio TENANTS_DIR/<clínica>/ con un tenant.json:
+
+    {"token": "123:ABC",
+     "texts": {"translations": {"es": {"opening_hours": "..."}}, "locations": {...}, "addresses": {...}},
+     "config": {"HOLD_TTL": 60}}
+
+y sus datos al lado: user_data.pkl, warm_start.json, fotos/, horarios/,
+sedes.json, las trazas y los eventos de uso (trazas/, analytics/) y, si tiene
+un menú propio, menu.json. "config" admite cualquier
+valor de Config.
+
+El bot de una clínica se crea con la primera actualización que le llega y se
+descarga (guardando sus datos y la instantánea de arranque) tras
+TENANT_IDLE_TTL segundos sin actividad, o antes si hay más de TENANT_MAX_LOADED
+cargados; nunca con un anuncio en curso o turnos reservados temporalmente. Al
+descargarlo se anota cuándo vence su próximo recordatorio o mensaje a borrar y
+se vuelve a cargar a esa hora, así las tareas periódicas siguen funcionando.
+
+`python tenants.py register https://mi-servicio.onrender.com` configura el
+webhook de cada clínica, con un secret_token derivado de su token.
+"""
+import argparse
+import asyncio
+import hashlib
+import hmac
+import json
+import logging
+import os
+import re
+import time
+from typing import Any, Dict, List, Optional, Tuple, Type
+
+from telegram import Bot, Update
+from telegram.ext import Application
+from telegram.request import HTTPXRequest
+
+from analytics import EventLog
+from faq_bot import ClinicBot, Config
+from metrics import (BOT_MESSAGES_TRACKED, BROADCAST_PENDING, BROADCAST_RATE, REMINDERS_PENDING, TENANT_EVICTIONS,
+                     TENANT_LOADS, TENANTS_LOADED, UPDATE_QUEUE_DEPTH, record_error)
+from monitoring import ApiCallListener, LivenessMonitor, SharedPoolRequest
+from tracing import TracedApplication, Tracer
+from update_processor import ChatUpdateProcessor
+from warm_start import write_atomic
+from web_server import HTTPRequest, HTTPResponse
+
+logger = logging.getLogger(__name__)
+
+TENANT_ID = re.compile(r'^[A-Za-z0-9_-]{1,64}$')
+WEBHOOK_PREFIX = '/telegram/'
+WAKEUPS_FILE = 'wakeups.json'  # Próxima tarea pendiente de cada clínica descargada
+WAKE_BATCH = 5  # Clínicas despertadas como máximo por barrido
+
+
+def webhook_secret(token: str) -> str:
+    """secret_token del webhook de una clínica (Telegram lo reenvía en cada actualización)"""
+    return hashlib.sha256(f"clinicbot-webhook:{token}".encode('utf-8')).hexdigest()[:32]
+
+
+def tenant_config(directory: str, tenant_id: str, settings: Dict[str, Any]) -> Type[Config]:
+    """Subclase de Config con el token, los archivos y los textos de una clínica"""
+    base = os.path.join(directory, tenant_id)
+    values: Dict[str, Any] = {
+        'TOKEN': settings['token'],
+        'DATA_FILE': os.path.join(base, 'user_data.pkl'),
+        'WARM_START_FILE': os.path.join(base, 'warm_start.json'),
+        'PHOTOS_DIR': os.path.join(base, 'fotos'),
+        'SCHEDULES_DIR': os.path.join(base, 'horarios'),
+        'SEDES_FILE': os.path.join(base, 'sedes.json'),
+        # Menú propio si la clínica tiene uno; si no, el general
+        'MENU_FILE': os.path.join(base, 'menu.json') if os.path.exists(os.path.join(base, 'menu.json')) else Config.MENU_FILE,
+        'UPDATE_RECORD_FILE': None,
+        # Trazas y eventos de uso en la carpeta de la clínica (los ids de usuario son de su bot)
+        'TRACE_FILE': os.path.join(base, 'trazas', os.path.basename(Config.TRACE_FILE)),
+        'ANALYTICS_DIR': os.path.join(base, 'analytics') if Config.ANALYTICS_DIR else '',
+        'TEXT_OVERRIDES': settings.get('texts'),
+    }
+    for name, value in settings.get('config', {}).items():
+        if name.isupper() and hasattr(Config, name) and name not in values:
+            values[name] = value
+    return type(f"Config_{tenant_id}", (Config,), values)
+
+
+def tenant_ids(directory: str) -> List[str]:
+    return sorted(name for name in os.listdir(directory)
+                  if TENANT_ID.match(name) and os.path.isfile(os.path.join(directory, name, 'tenant.json')))
+
+
+class TenantBot(ClinicBot):
+    """ClinicBot de una clínica: usa el pool de conexiones compartido y recibe por webhook"""
+
+    def __init__(self, config: Type[Config], pool: HTTPXRequest):
+        self.pool = pool
+        super().__init__(config=config)
+        self.liveness.mode = 'webhook'
+
+    def build_sinks(self) -> Tuple[Tracer, EventLog]:
+        """Cada clínica escribe sus trazas y eventos de uso en su propia carpeta"""
+        return Tracer(), EventLog()
+
+    def build_application(self, api_listeners: List[ApiCallListener]) -> Application:
+        return (
+            Application.builder()
+            .application_class(TracedApplication)
+            .token(self.config.TOKEN)
+            .base_url(self.config.API_BASE_URL)
+            .persistence(self.persistence)
+            .concurrent_updates(ChatUpdateProcessor(self.config.UPDATE_CONCURRENCY, self.config.CALLBACK_DEDUP_WINDOW))
+            .request(SharedPoolRequest(self.pool, api_listeners))
+            .get_updates_request(SharedPoolRequest(self.pool, api_listeners))
+            .updater(None)
+            .build()
+        )
+
+    @property
+    def busy(self) -> bool:
+        """Tiene trabajo que se perdería o se atrasaría al descargarlo"""
+        return (self.broadcasts.running or len(self.reservation_manager.wheel) > 0
+                or self.application.update_queue.qsize() > 0
+                or self.application.update_processor.current_concurrent_updates > 0
+                or (self.rate_limiter is not None and self.rate_limiter.pending > 0))
+
+    @property
+    def next_due(self) -> Optional[float]:
+        """Instante de la próxima tarea pendiente (recordatorio o mensaje a borrar)"""
+        due = [at for at in (self.reminders.next_due, self.message_expiry.next_due) if at is not None]
+        return min(due) if due else None
+
+
+class TenantHost:
+    """Bots de las clínicas de `directory`, cargados a demanda y descargados al quedar inactivos"""
+
+    def __init__(self, directory: str, idle_ttl: float = 900.0, max_loaded: int = 10,
+                 sweep_interval: float = 30.0):
+        self.directory = directory
+        self.idle_ttl = idle_ttl
+        self.max_loaded = max(1, max_loaded)
+        self.sweep_interval = sweep_interval
+        self.liveness = LivenessMonitor()
+        self.liveness.mode = 'webhook'
+        # Un solo pool de conexiones para todas las clínicas (la API es la misma; cambia el token en la URL)
+        self.pool = HTTPXRequest(connection_pool_size=256)
+        self.broadcasts = None  # Los anuncios de /admin son de un solo bot
+        self.bots: Dict[str, TenantBot] = {}
+        self.configs: Dict[str, Type[Config]] = {}
+        self.last_activity: Dict[str, float] = {}
+        self.wake_at: Dict[str, float] = {}
+        self._locks: Dict[str, asyncio.Lock] = {}
+        self._sweep_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if not os.path.isdir(self.directory):
+            raise ValueError(f"No existe el directorio de clínicas {self.directory}")
+        await self.pool.initialize()
+        self._load_wakeups()
+        self.liveness.start()
+        self._sweep_task = asyncio.get_running_loop().create_task(self._sweep_loop())
+        self._bind_metrics()
+        logger.info(f"Modo multi-clínica: {len(tenant_ids(self.directory))} clínicas en {self.directory}")
+
+    def _load_wakeups(self) -> None:
+        """Las clínicas sin registro (nunca descargadas por este proceso) se despiertan una vez al arrancar"""
+        path = os.path.join(self.directory, WAKEUPS_FILE)
+        saved: Dict[str, Optional[float]] = {}
+        if os.path.exists(path):
+            try:
+                with open(path, encoding='utf-8') as f:
+                    saved = json.load(f)
+            except ValueError as e:
+                logger.warning(f"{path} inválido; se despiertan todas las clínicas: {e}")
+        for tenant in tenant_ids(self.directory):
+            at = saved.get(tenant, 0.0)
+            if at is not None:
+                self.wake_at[tenant] = at
+
+    def _save_wakeups(self) -> None:
+        wakeups: Dict[str, Optional[float]] = {tenant: None for tenant in tenant_ids(self.directory)}
+        wakeups.update(self.wake_at)
+        try:
+            write_atomic(os.path.join(self.directory, WAKEUPS_FILE),
+                         json.dumps(wakeups, sort_keys=True).encode('utf-8'), sync=False)
+        except OSError as e:
+            logger.error(f"Error al guardar {WAKEUPS_FILE}: {e}")
+            record_error(e)
+
+    def _config(self, tenant: str) -> Optional[Type[Config]]:
+        """Configuración de una clínica (se lee al primer uso), o None si no existe"""
+        config = self.configs.get(tenant)
+        if config is None and TENANT_ID.match(tenant):
+            path = os.path.join(self.directory, tenant, 'tenant.json')
+            if os.path.isfile(path):
+                with open(path, encoding='utf-8') as f:
+                    config = tenant_config(self.directory, tenant, json.load(f))
+                self.configs[tenant] = config
+        return config
+
+    def _lock(self, tenant: str) -> asyncio.Lock:
+        return self._locks.setdefault(tenant, asyncio.Lock())
+
+    async def get(self, tenant: str, reason: str = 'update') -> TenantBot:
+        """Bot de una clínica, cargándolo si hace falta"""
+        bot = self.bots.get(tenant)
+        if bot is not None:
+            return bot
+        # El candado evita cargarlo dos veces, o mientras todavía se está descargando
+        async with self._lock(tenant):
+            bot = self.bots.get(tenant)
+            if bot is None:
+                bot = await self._load(tenant, reason)
+            return bot
+
+    async def _load(self, tenant: str, reason: str) -> TenantBot:
+        config = self._config(tenant)
+        if config is None:
+            raise KeyError(tenant)
+        if len(self.bots) >= self.max_loaded:
+            await self._evict_least_recent()
+        started = time.perf_counter()
+        bot = TenantBot(config, self.pool)
+        await bot.application.initialize()
+        await bot.application.start()
+        self.bots[tenant] = bot
+        self.last_activity[tenant] = time.monotonic()
+        self.wake_at.pop(tenant, None)
+        TENANT_LOADS.labels(reason).inc()
+        self._bind_metrics()
+        logger.info(f"Clínica {tenant} cargada ({reason}) en {time.perf_counter() - started:.2f}s; "
+                    f"{len(self.bots)} en memoria")
+        return bot
+
+    async def evict(self, tenant: str, timeout: float = 10.0) -> None:
+        """Descarga el bot de una clínica guardando sus datos y anota cuándo despertarlo"""
+        async with self._lock(tenant):
+            bot = self.bots.pop(tenant, None)
+            if bot is None:
+                return
+            try:
+                await bot.shutdown(timeout=timeout)
+            except Exception as e:
+                logger.error(f"Error al descargar la clínica {tenant}: {e}")
+                record_error(e)
+            next_due = bot.next_due
+            if next_due is not None:
+                self.wake_at[tenant] = next_due
+            self.last_activity.pop(tenant, None)
+            TENANT_EVICTIONS.inc()
+            self._bind_metrics()
+        logger.info(f"Clínica {tenant} descargada; {len(self.bots)} en memoria")
+
+    async def _evict_least_recent(self) -> None:
+        idle = sorted((at, tenant) for tenant, at in self.last_activity.items()
+                      if tenant in self.bots and not self.bots[tenant].busy)
+        if idle:
+            await self.evict(idle[0][1])
+            self._save_wakeups()
+
+    def _bind_metrics(self) -> None:
+        """Las métricas de un bot pasan a ser la suma de las clínicas cargadas"""
+        bots = self.bots
+        TENANTS_LOADED.set(len(bots))
+        UPDATE_QUEUE_DEPTH.set_function(lambda: sum(bot.application.update_queue.qsize() for bot in bots.values()))
+        BOT_MESSAGES_TRACKED.set_function(lambda: sum(bot.message_expiry.tracked for bot in bots.values()))
+        REMINDERS_PENDING.set_function(lambda: sum(bot.reminders.pending for bot in bots.values()))
+        BROADCAST_PENDING.set_function(lambda: sum(bot.broadcasts.pending for bot in bots.values()))
+        BROADCAST_RATE.set_function(lambda: sum(bot.broadcasts.rate for bot in bots.values() if bot.broadcasts.running))
+
+    async def handle_webhook(self, request: HTTPRequest) -> HTTPResponse:
+        """POST /telegram/<clínica>: encola la actualización en el bot de esa clínica"""
+        tenant = request.path[len(WEBHOOK_PREFIX):].strip('/')
+        try:
+            config = self._config(tenant)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"Configuración inválida de la clínica {tenant}: {e}")
+            record_error(e)
+            return HTTPResponse(503, b'Service Unavailable')
+        if config is None:
+            return HTTPResponse(404, b'Not Found')
+        supplied = request.headers.get('x-telegram-bot-api-secret-token', '')
+        if not hmac.compare_digest(supplied.encode('utf-8'), webhook_secret(config.TOKEN).encode('utf-8')):
+            return HTTPResponse(401, b'Unauthorized')
+        try:
+            data = json.loads(request.body)
+        except ValueError:
+            return HTTPResponse(400, b'Bad Request')
+        try:
+            bot = await self.get(tenant)
+        except Exception as e:
+            # Telegram reintenta más tarde las actualizaciones que no recibieron un 2xx
+            logger.error(f"Error al cargar la clínica {tenant}: {e}")
+            record_error(e)
+            return HTTPResponse(503, b'Service Unavailable')
+        self.last_activity[tenant] = time.monotonic()
+        self.liveness.record_update()
+        await bot.application.update_queue.put(Update.de_json(data, bot.application.bot))
+        return HTTPResponse(200, b'')
+
+    async def _sweep_loop(self) -> None:
+        await asyncio.sleep(1)
+        while True:
+            try:
+                await self.sweep()
+            except Exception as e:
+                logger.error(f"Error en el barrido de clínicas: {e}")
+                record_error(e)
+            await asyncio.sleep(self.sweep_interval)
+
+    async def sweep(self) -> None:
+        """Descarga las clínicas inactivas y despierta las que tienen tareas vencidas"""
+        changed = False
+        now = time.monotonic()
+        for tenant, bot in list(self.bots.items()):
+            if now - self.last_activity.get(tenant, now) > self.idle_ttl and not bot.busy:
+                await self.evict(tenant)
+                changed = True
+        due = sorted((at, tenant) for tenant, at in self.wake_at.items()
+                     if at <= time.time() and tenant not in self.bots)
+        for _, tenant in due[:WAKE_BATCH]:
+            try:
+                await self.get(tenant, 'wakeup')
+            except Exception as e:
+                logger.error(f"Error al despertar la clínica {tenant}: {e}")
+                record_error(e)
+                self.wake_at[tenant] = time.time() + 300
+            changed = True
+        if changed:
+            self._save_wakeups()
+
+    def failure(self) -> str:
+        """Motivo por el que el anfitrión debe reiniciarse, o cadena vacía si está sano"""
+        if self._sweep_task is None or self._sweep_task.done():
+            return 'tenant_sweeper_stopped'
+        return ''
+
+    async def shutdown(self, timeout: float = Config.SHUTDOWN_TIMEOUT) -> None:
+        """Descarga todas las clínicas (en paralelo) y cierra el pool compartido"""
+        if self._sweep_task is not None:
+            self._sweep_task.cancel()
+            self._sweep_task = None
+        await asyncio.gather(*(self.evict(tenant, timeout) for tenant in list(self.bots)))
+        self._save_wakeups()
+        await self.pool.shutdown()
+        self.liveness.stop()
+        logger.info("Clínicas detenidas")
+
+
+async def register_webhooks(directory: str, base_url: str) -> None:
+    """Apunta el webhook de cada clínica a `base_url`/telegram/<clínica>"""
+    for tenant in tenant_ids(directory):
+        with open(os.path.join(directory, tenant, 'tenant.json'), encoding='utf-8') as f:
+            token = json.load(f)['token']
+        async with Bot(token, base_url=Config.API_BASE_URL) as bot:
+            await bot.set_webhook(f"{base_url.rstrip('/')}{WEBHOOK_PREFIX}{tenant}",
+                                  secret_token=webhook_secret(token), allowed_updates=Update.ALL_TYPES)
+        print(f"{tenant}: webhook configurado")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description='Clínicas del modo multi-clínica')
+    commands = parser.add_subparsers(dest='command', required=True)
+    register = commands.add_parser('register', help='Configura el webhook de cada clínica')
+    register.add_argument('base_url', help='URL pública del servicio, p. ej. https://mi-servicio.onrender.com')
+    register.add_argument('--dir', default=os.getenv('TENANTS_DIR', 'clinicas'))
+    args = parser.parse_args()
+    asyncio.run(register_webhooks(args.dir, args.base_url))
+
+
+if __name__ == '__main__':
+    main()
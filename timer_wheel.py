@@ -0,0 +1,108 @@
+"""
+Rueda de temporizadores (hashed timing wheel)
+---------------------------------------------
+Estructura compartida para vencimientos masivos: reservas temporales de turnos,
+limpieza de mensajes y recordatorios. Programar y cancelar son O(1) y cada
+avance solo toca las ranuras transcurridas y los elementos vencidos.
+"""
+import heapq
+import itertools
+import threading
+import time
+from typing import Any, Callable, Dict, Hashable, List, Optional, Tuple
+
+
+class TimerWheel:
+    """Rueda de temporizadores con ranuras de duración fija y desbordamiento a un heap"""
+
+    def __init__(self, tick: float = 1.0, size: int = 512,
+                 clock: Callable[[], float] = time.time):
+        if tick <= 0 or size <= 0:
+            raise ValueError("tick y size deben ser positivos")
+        self.tick = tick
+        self.size = size
+        self.clock = clock
+        self._buckets: List[Dict[Hashable, Any]] = [{} for _ in range(size)]
+        # Elementos fuera del alcance de la rueda: (tick, secuencia, clave)
+        self._overflow: List[Tuple[int, int, Hashable]] = []
+        self._seq = itertools.count()
+        # clave -> (tick de vencimiento, payload)
+        self._entries: Dict[Hashable, Tuple[int, Any]] = {}
+        self._current = self._tick_of(clock())
+        self._lock = threading.Lock()
+
+    def _tick_of(self, timestamp: float) -> int:
+        return int(timestamp // self.tick)
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._entries
+
+    def keys(self) -> List[Hashable]:
+        """Claves programadas en este momento"""
+        with self._lock:
+            return list(self._entries)
+
+    def deadline(self, key: Hashable) -> Optional[float]:
+        """Devuelve el instante aproximado de vencimiento de una clave"""
+        entry = self._entries.get(key)
+        return entry[0] * self.tick if entry else None
+
+    def schedule(self, key: Hashable, deadline: float, payload: Any = None) -> None:
+        """Programa (o reprograma) el vencimiento de una clave"""
+        with self._lock:
+            self._remove(key)
+            # Un vencimiento en el pasado se dispara en el siguiente avance
+            due = max(self._tick_of(deadline), self._current + 1)
+            self._entries[key] = (due, payload)
+            if due - self._current < self.size:
+                self._buckets[due % self.size][key] = due
+            else:
+                heapq.heappush(self._overflow, (due, next(self._seq), key))
+
+    def cancel(self, key: Hashable) -> bool:
+        """Cancela el vencimiento de una clave. Devuelve True si existía"""
+        with self._lock:
+            return self._remove(key)
+
+    def _remove(self, key: Hashable) -> bool:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        # Las entradas del heap se descartan de forma perezosa al desbordar
+        self._buckets[entry[0] % self.size].pop(key, None)
+        return True
+
+    def advance(self, now: Optional[float] = None) -> List[Tuple[Hashable, Any]]:
+        """Avanza la rueda hasta `now` y devuelve los elementos vencidos (clave, payload)"""
+        target = self._tick_of(self.clock() if now is None else now)
+        expired: List[Tuple[Hashable, Any]] = []
+        with self._lock:
+            if target <= self._current:
+                return expired
+
+            # Si pasó una vuelta completa basta con recorrer cada ranura una vez
+            steps = min(target - self._current, self.size)
+            for step in range(1, steps + 1):
+                bucket = self._buckets[(self._current + step) % self.size]
+                if not bucket:
+                    continue
+                for key, due in list(bucket.items()):
+                    if due <= target:
+                        del bucket[key]
+                        expired.append((key, self._entries.pop(key)[1]))
+            self._current = target
+
+            # Traer a la rueda lo que ahora cae dentro de su alcance
+            while self._overflow and self._overflow[0][0] < target + self.size:
+                due, _, key = heapq.heappop(self._overflow)
+                entry = self._entries.get(key)
+                if entry is None or entry[0] != due:
+                    continue  # cancelada o reprogramada
+                if due <= target:
+                    expired.append((key, self._entries.pop(key)[1]))
+                else:
+                    self._buckets[due % self.size][key] = due
+        return expired
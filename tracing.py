@@ -0,0 +1,220 @@
+"""
+Trazas por actualización
+------------------------
+Abre un span por cada actualización de Telegram y spans hijos para cada llamada
+a la API y cada operación de persistencia, y los exporta a un archivo local en
+formato Chrome trace (chrome://tracing, Perfetto) u OTLP-JSON (una línea por
+traza). El muestreo se decide al inicio de cada actualización; si no se
+muestrea, los spans hijos no cuestan más que leer una variable de contexto.
+"""
+import contextvars
+import json
+import os
+import random
+import threading
+import time
+from collections import deque
+from contextlib import contextmanager
+from typing import Any, Deque, Dict, Iterator, List, Optional
+
+from telegram import Update
+from telegram.ext import Application
+
+
+class Span:
+    """Intervalo de tiempo con nombre dentro de una traza"""
+
+    __slots__ = ('name', 'trace_id', 'span_id', 'parent_id', 'start_us', 'duration_us',
+                 'attributes', 'children', 'root', 'tid')
+
+    def __init__(self, name: str, trace_id: str, parent: Optional['Span'] = None,
+                 attributes: Optional[Dict[str, Any]] = None, tid: int = 0):
+        self.name = name
+        self.trace_id = trace_id
+        self.span_id = f"{random.getrandbits(64):016x}"
+        self.parent_id = parent.span_id if parent else None
+        self.start_us = time.time_ns() // 1000
+        self.duration_us = 0
+        self.attributes = attributes or {}
+        # Solo la raíz acumula los spans terminados de su traza
+        self.children: List['Span'] = []
+        self.root: 'Span' = parent.root if parent else self
+        self.tid = parent.tid if parent else tid
+
+
+_current_span: contextvars.ContextVar[Optional[Span]] = contextvars.ContextVar('current_span', default=None)
+
+
+class Tracer:
+    """Registra trazas muestreadas y las escribe en un archivo local"""
+
+    FORMATS = ('chrome', 'otlp')
+
+    def __init__(self, sample_rate: float = 0.0, path: Optional[str] = None,
+                 fmt: str = 'chrome', max_buffered: int = 2000):
+        self.sample_rate = sample_rate
+        self.path = path
+        self.fmt = fmt
+        self._buffer: Deque[Span] = deque(maxlen=max_buffered)
+        self._write_lock = threading.Lock()
+        self.dropped = 0
+
+    def configure(self, sample_rate: float, path: Optional[str], fmt: str = 'chrome') -> None:
+        if fmt not in self.FORMATS:
+            raise ValueError(f"Formato de trazas no soportado: {fmt}")
+        self.sample_rate = sample_rate
+        self.path = path
+        self.fmt = fmt
+
+    @property
+    def enabled(self) -> bool:
+        return self.sample_rate > 0 and bool(self.path)
+
+    @contextmanager
+    def trace(self, name: str, tid: int = 0, **attributes) -> Iterator[Optional[Span]]:
+        """Abre el span raíz de una traza, si la muestra es elegida"""
+        if not self.enabled or random.random() >= self.sample_rate:
+            yield None
+            return
+        root = Span(name, f"{random.getrandbits(128):032x}", attributes=attributes, tid=tid)
+        token = _current_span.set(root)
+        started = time.perf_counter()
+        try:
+            yield root
+        finally:
+            root.duration_us = int((time.perf_counter() - started) * 1e6)
+            _current_span.reset(token)
+            if len(self._buffer) == self._buffer.maxlen:
+                self.dropped += 1
+            self._buffer.append(root)
+
+    @contextmanager
+    def span(self, name: str, **attributes) -> Iterator[Optional[Span]]:
+        """Abre un span hijo del span actual; no hace nada fuera de una traza muestreada"""
+        parent = _current_span.get()
+        if parent is None:
+            yield None
+            return
+        span = Span(name, parent.trace_id, parent, attributes)
+        token = _current_span.set(span)
+        started = time.perf_counter()
+        try:
+            yield span
+        finally:
+            span.duration_us = int((time.perf_counter() - started) * 1e6)
+            _current_span.reset(token)
+            span.root.children.append(span)
+
+    def record(self, name: str, duration: float, **attributes) -> None:
+        """Registra un span hijo ya terminado (p. ej. una llamada a la API medida por otro)"""
+        parent = _current_span.get()
+        if parent is None:
+            return
+        span = Span(name, parent.trace_id, parent, attributes)
+        span.duration_us = int(duration * 1e6)
+        span.start_us -= span.duration_us
+        span.root.children.append(span)
+
+    def record_api_call(self, method: str, duration: float, status: Optional[int],
+                        error: Optional[BaseException]) -> None:
+        """Listener para TrackedHTTPXRequest"""
+        if _current_span.get() is None:
+            return
+        attributes: Dict[str, Any] = {'status': status}
+        if error is not None:
+            attributes['error'] = type(error).__name__
+        self.record(f"api.{method}", duration, **attributes)
+
+    def _chrome_events(self, root: Span) -> List[Dict[str, Any]]:
+        pid = os.getpid()
+        return [{
+            'name': span.name,
+            'cat': 'update' if span.parent_id is None else 'child',
+            'ph': 'X',
+            'ts': span.start_us,
+            'dur': span.duration_us,
+            'pid': pid,
+            'tid': span.tid,
+            'args': dict(span.attributes, trace_id=span.trace_id, span_id=span.span_id)
+        } for span in [root] + root.children]
+
+    def _otlp_record(self, root: Span) -> Dict[str, Any]:
+        def attribute(key, value):
+            if isinstance(value, bool):
+                return {'key': key, 'value': {'boolValue': value}}
+            if isinstance(value, int):
+                return {'key': key, 'value': {'intValue': str(value)}}
+            return {'key': key, 'value': {'stringValue': str(value)}}
+
+        spans = [{
+            'traceId': span.trace_id,
+            'spanId': span.span_id,
+            'parentSpanId': span.parent_id or '',
+            'name': span.name,
+            'kind': 1,
+            'startTimeUnixNano': str(span.start_us * 1000),
+            'endTimeUnixNano': str((span.start_us + span.duration_us) * 1000),
+            'attributes': [attribute(key, value) for key, value in span.attributes.items() if value is not None]
+        } for span in [root] + root.children]
+        return {'resourceSpans': [{
+            'resource': {'attributes': [attribute('service.name', 'clinica-medica-bot')]},
+            'scopeSpans': [{'scope': {'name': 'faq_bot'}, 'spans': spans}]
+        }]}
+
+    def flush(self) -> int:
+        """Escribe las trazas pendientes en el archivo. Pensado para correr en un hilo auxiliar"""
+        if not self.path:
+            return 0
+        pending = []
+        while self._buffer:
+            pending.append(self._buffer.popleft())
+        if not pending:
+            return 0
+        with self._write_lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            is_new = not os.path.exists(self.path) or os.path.getsize(self.path) == 0
+            with open(self.path, 'a', encoding='utf-8') as f:
+                if self.fmt == 'chrome':
+                    # Formato "JSON Array" de Chrome: el corchete de cierre es opcional,
+                    # lo que permite seguir agregando eventos al archivo
+                    if is_new:
+                        f.write('[\n')
+                    for root in pending:
+                        for event in self._chrome_events(root):
+                            f.write(json.dumps(event) + ',\n')
+                else:
+                    for root in pending:
+                        f.write(json.dumps(self._otlp_record(root)) + '\n')
+        return len(pending)
+
+
+# Tracer global del proceso
+TRACER = Tracer()
+
+
+def describe_update(update: object) -> str:
+    """Nombre corto de una actualización para el span raíz"""
+    if isinstance(update, Update):
+        if update.callback_query is not None:
+            return f"callback:{(update.callback_query.data or '').split('_', 1)[0]}"
+        if update.message is not None and update.message.text:
+            text = update.message.text
+            return f"command:{text.split()[0]}" if text.startswith('/') else 'message:text'
+        if update.inline_query is not None:
+            return 'inline_query'
+    return type(update).__name__
+
+
+class TracedApplication(Application):
+    """Application que abre una traza por actualización procesada"""
+
+    # Con varias clínicas en un proceso cada Application recibe el Tracer de su bot
+    tracer: Tracer = TRACER
+
+    async def process_update(self, update: object) -> None:
+        chat = update.effective_chat if isinstance(update, Update) else None
+        with self.tracer.trace(describe_update(update), tid=chat.id if chat else 0,
+                          update_id=getattr(update, 'update_id', None)):
+            await super().process_update(update)
@@ -0,0 +1,145 @@
+"""
+Procesamiento de actualizaciones por chat
+-----------------------------------------
+Procesador de actualizaciones de la Application (ver concurrent_updates de PTB)
+que atiende en paralelo chats distintos y en orden las actualizaciones de un
+mismo chat, y que antes de encolarlas hace el trabajo barato de los botones:
+
+- Responde cada callback_query apenas llega, para que el usuario no vea el
+  reloj de carga mientras corre el manejador (los manejadores ya no lo hacen).
+- Descarta el toque repetido de un mismo botón (mismo callback_data en el mismo
+  chat) dentro de `dedup_window` segundos: un doble toque ya no envía dos veces
+  el álbum de fotos.
+- Cuando el usuario pulsa otro botón, cancela el trabajo aún pendiente o en
+  curso del botón de navegación anterior de ese chat (fotos, ubicaciones,
+  submenús), que ya no va a mirar. Las reservas, la lista de espera y las
+  calificaciones nunca se cancelan. Si se cancela después de enviar un
+  submenú pero antes de que la conversación cambie de estado, el menú
+  principal también acepta sus botones (turnos, directorio, volver).
+"""
+import asyncio
+import logging
+import time
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Optional, Set, Tuple
+
+from telegram import CallbackQuery, Update
+from telegram.error import TelegramError
+from telegram.ext import BaseUpdateProcessor
+
+from metrics import CALLBACKS_COLLAPSED
+
+logger = logging.getLogger(__name__)
+
+# Botones de navegación cuyo trabajo se puede cortar si llega otro toque del mismo chat
+CANCELLABLE_PREFIXES = ('nav_', 'menu_', 'submenu_', 'location_', 'fotos_', 'back_to_main', 'dir_')
+
+
+def chat_key(update: object) -> Optional[int]:
+    """Chat (o usuario, si no hay chat) cuyas actualizaciones se procesan en orden"""
+    if not isinstance(update, Update):
+        return None
+    if update.effective_chat is not None:
+        return update.effective_chat.id
+    return update.effective_user.id if update.effective_user is not None else None
+
+
+class ChatUpdateProcessor(BaseUpdateProcessor):
+    """Un chat a la vez, chats en paralelo, con respuesta inmediata y filtrado de callback_query"""
+
+    def __init__(self, max_concurrent_updates: int = 32, dedup_window: float = 2.0,
+                 clock: Callable[[], float] = time.monotonic):
+        super().__init__(max(1, max_concurrent_updates))
+        self.dedup_window = dedup_window
+        self.clock = clock
+        self._locks: Dict[int, asyncio.Lock] = {}
+        self._queued: Dict[int, int] = {}  # chat -> actualizaciones esperando o procesándose
+        # chat -> (último callback_data, instante), del más viejo al más reciente
+        self._last_taps: 'OrderedDict[int, Tuple[str, float]]' = OrderedDict()
+        # chat -> tarea del último botón de navegación que se puede cancelar
+        self._cancellable: Dict[int, 'asyncio.Task[Any]'] = {}
+        self._answers: Set['asyncio.Task[None]'] = set()
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        if self._answers:
+            await asyncio.gather(*self._answers, return_exceptions=True)
+
+    async def do_process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        await coroutine
+
+    async def process_update(self, update: object, coroutine: Awaitable[Any]) -> None:
+        chat_id = chat_key(update)
+        query = update.callback_query if isinstance(update, Update) else None
+        if query is not None:
+            self._answer(query)
+            if self._is_duplicate(chat_id, query.data or ''):
+                coroutine.close()
+                CALLBACKS_COLLAPSED.labels('duplicate').inc()
+                return
+            self._supersede(chat_id, query.data or '')
+        if chat_id is None:
+            await super().process_update(update, coroutine)
+            return
+
+        lock = self._locks.get(chat_id)
+        if lock is None:
+            lock = self._locks[chat_id] = asyncio.Lock()
+        self._queued[chat_id] = self._queued.get(chat_id, 0) + 1
+        try:
+            async with lock:
+                await super().process_update(update, coroutine)
+        except asyncio.CancelledError:
+            # Si se canceló antes de empezar, la corrutina nunca se ejecutó
+            coroutine.close()
+            raise
+        finally:
+            self._queued[chat_id] -= 1
+            if not self._queued[chat_id]:
+                del self._queued[chat_id]
+                del self._locks[chat_id]
+            if self._cancellable.get(chat_id) is asyncio.current_task():
+                del self._cancellable[chat_id]
+
+    def _answer(self, query: CallbackQuery) -> None:
+        """Responde el callback_query en segundo plano, sin esperar a la API"""
+        task = asyncio.get_running_loop().create_task(self._send_answer(query))
+        self._answers.add(task)
+        task.add_done_callback(self._answers.discard)
+
+    @staticmethod
+    async def _send_answer(query: CallbackQuery) -> None:
+        try:
+            await query.answer()
+        except TelegramError as e:
+            # Consultas de más de 15 minutos (por ejemplo tras un reinicio) ya no se pueden responder
+            logger.debug(f"No se pudo responder el callback_query {query.id}: {e}")
+
+    def _is_duplicate(self, chat_id: Optional[int], data: str) -> bool:
+        """True si el último toque del chat fue el mismo botón hace menos de `dedup_window` segundos"""
+        if chat_id is None:
+            return False
+        now = self.clock()
+        taps = self._last_taps
+        while taps:
+            first = next(iter(taps.values()))
+            if now - first[1] < self.dedup_window:
+                break
+            taps.popitem(last=False)
+        last = taps.pop(chat_id, None)
+        taps[chat_id] = (data, now)
+        return last is not None and last[0] == data
+
+    def _supersede(self, chat_id: Optional[int], data: str) -> None:
+        """Cancela el botón de navegación anterior del chat y registra este si también es cancelable"""
+        if chat_id is None:
+            return
+        previous = self._cancellable.pop(chat_id, None)
+        if previous is not None and not previous.done():
+            previous.cancel()
+            CALLBACKS_COLLAPSED.labels('superseded').inc()
+        # Con una sola actualización a la vez la tarea actual es la que lee la cola: nunca se cancela
+        if data.startswith(CANCELLABLE_PREFIXES) and self.max_concurrent_updates > 1:
+            self._cancellable[chat_id] = asyncio.current_task()
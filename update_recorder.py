@@ -0,0 +1,159 @@
+"""
+Grabación de actualizaciones
+----------------------------
+Graba las actualizaciones entrantes, anonimizadas y con su instante relativo, en
+un corpus JSONL comprimido con gzip para reproducirlas después contra un
+servidor falso de la Bot API (benchmarks/replay_updates.py).
+
+Anonimización:
+- Los ids de usuario y de chat se reemplazan por un HMAC con una sal de la
+  sesión de grabación: el mismo usuario conserva el mismo id dentro del corpus,
+  pero no se puede volver al id real sin la sal.
+- Usuarios, teléfonos, correos y demás datos de perfil se descartan; los
+  nombres y títulos, obligatorios para Telegram, quedan con un valor fijo.
+- El texto libre se reemplaza por 'x' del mismo largo; los comandos (/buscar
+  cardio) y los callback_data se conservan porque definen el flujo del bot.
+- Las ubicaciones se redondean a dos decimales (~1 km).
+
+Formato de cada línea: {"t": segundos desde el inicio, "update": {...}}
+"""
+import gzip
+import hashlib
+import hmac
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from typing import Any, Deque, Dict, Iterator, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+# Claves con ids de usuario o de chat fuera de los objetos de PERSON_KEYS
+ID_KEYS = {'user_id', 'chat_id', 'sender_chat_id'}
+# Claves de perfil que se descartan
+DROP_KEYS = {'last_name', 'username', 'phone_number', 'email', 'bio', 'vcard', 'invite_link',
+             'active_usernames', 'photo', 'emoji_status_custom_emoji_id'}
+# Claves obligatorias para Telegram que se reemplazan por un valor fijo
+PLACEHOLDERS = {'first_name': 'Usuario', 'title': 'Chat'}
+# Textos libres que se enmascaran salvo que sean comandos
+TEXT_KEYS = {'text', 'caption', 'query'}
+# Objetos cuyo 'id' identifica a un usuario o chat (los demás ids, p. ej. de callback, se conservan)
+PERSON_KEYS = {'from', 'chat', 'user', 'sender_chat', 'new_chat_member', 'old_chat_member',
+               'forward_from', 'forward_from_chat', 'via_bot'}
+
+
+class UpdateAnonymizer:
+    """Anonimiza diccionarios de actualizaciones (Update.to_dict()) de forma estable"""
+
+    def __init__(self, salt: Optional[bytes] = None):
+        self.salt = salt if salt is not None else os.urandom(16)
+        self._ids: Dict[int, int] = {}
+
+    def pseudonym(self, value: int) -> int:
+        """Id estable y positivo de hasta 12 dígitos; conserva el signo de los chats de grupo"""
+        cached = self._ids.get(value)
+        if cached is None:
+            digest = hmac.new(self.salt, str(abs(value)).encode('ascii'), hashlib.sha256).digest()
+            cached = int.from_bytes(digest[:8], 'big') % 10 ** 12 + 1
+            cached = -cached if value < 0 else cached
+            self._ids[value] = cached
+        return cached
+
+    def mask_text(self, text: str) -> str:
+        if text.startswith('/'):
+            return text
+        return 'x' * len(text)
+
+    def anonymize(self, data: Any, person: bool = False) -> Any:
+        if isinstance(data, list):
+            return [self.anonymize(item, person) for item in data]
+        if not isinstance(data, dict):
+            return data
+        result = {}
+        for key, value in data.items():
+            if key in DROP_KEYS:
+                continue
+            if key in PLACEHOLDERS and isinstance(value, str):
+                result[key] = PLACEHOLDERS[key]
+                continue
+            if isinstance(value, int) and not isinstance(value, bool) and (
+                    key in ID_KEYS or (key == 'id' and person)):
+                result[key] = self.pseudonym(value)
+            elif key in TEXT_KEYS and isinstance(value, str):
+                result[key] = self.mask_text(value)
+            elif key in ('latitude', 'longitude') and isinstance(value, float):
+                result[key] = round(value, 2)
+            elif key in ('entities', 'caption_entities'):
+                # Solo se conservan los comandos; las menciones y enlaces revelarían el texto
+                result[key] = [entity for entity in value if entity.get('type') == 'bot_command']
+            else:
+                result[key] = self.anonymize(value, key in PERSON_KEYS)
+        return result
+
+
+class UpdateRecorder:
+    """Acumula actualizaciones en memoria y las agrega al corpus desde un hilo auxiliar"""
+
+    def __init__(self, path: str, salt: Optional[bytes] = None, max_buffered: int = 10000):
+        self.path = path
+        self.anonymizer = UpdateAnonymizer(salt)
+        self.started = time.monotonic()
+        self.recorded = 0
+        self.dropped = 0
+        self._buffer: Deque[Tuple[float, Dict[str, Any]]] = deque(maxlen=max_buffered)
+        self._write_lock = threading.Lock()
+
+    def record(self, update_data: Dict[str, Any]) -> None:
+        """Encola una actualización (Update.to_dict()); la anonimización se hace al escribir"""
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((time.monotonic() - self.started, update_data))
+
+    def flush(self) -> int:
+        """Anonimiza y escribe lo pendiente. Pensado para correr en un hilo auxiliar"""
+        pending = []
+        while self._buffer:
+            pending.append(self._buffer.popleft())
+        if not pending:
+            return 0
+        with self._write_lock:
+            directory = os.path.dirname(self.path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            lines = ''.join(
+                json.dumps({'t': round(offset, 4), 'update': self.anonymizer.anonymize(data)},
+                           ensure_ascii=False, separators=(',', ':')) + '\n'
+                for offset, data in pending
+            )
+            # Cada escritura agrega un miembro gzip; gzip.open los lee en secuencia
+            with gzip.open(self.path, 'at', encoding='utf-8') as f:
+                f.write(lines)
+        self.recorded += len(pending)
+        return len(pending)
+
+
+def iter_corpus(path: str) -> Iterator[Tuple[float, Dict[str, Any]]]:
+    """Recorre un corpus grabado: (segundos desde el inicio, actualización).
+
+    Si el archivo tiene varias sesiones de grabación, cada una continúa donde
+    terminó la anterior.
+    """
+    base = last = 0.0
+    with gzip.open(path, 'rt', encoding='utf-8') as f:
+        for number, line in enumerate(f, 1):
+            if not line.strip():
+                continue
+            try:
+                record = json.loads(line)
+                offset = float(record['t']) + base
+                update = record['update']
+            except (ValueError, KeyError) as e:
+                logger.warning(f"Línea {number} inválida en {path}: {e}")
+                continue
+            if offset < last:
+                base = last
+                offset = float(record['t']) + base
+            last = offset
+            yield offset, update
@@ -0,0 +1,192 @@
+"""
+Lista de espera para turnos liberados
+-------------------------------------
+Cuando se cancela una cita, el turno se ofrece al mejor paciente en espera que
+coincida en especialidad, sede y franja horaria. Cada combinación
+(especialidad, sede, día, media jornada) tiene su propia cola de prioridad, así
+que encontrar al candidato es O(log n) y nunca se recorre la lista completa.
+Las entradas eliminadas o ya ofertadas se descartan de forma perezosa, y una
+oferta rechazada o vencida repone al paciente solo en las colas de las que salió.
+"""
+import heapq
+import itertools
+import logging
+from datetime import date, datetime, timedelta
+from typing import TYPE_CHECKING, Any, Dict, Iterable, Iterator, List, Optional, Set, Tuple
+
+if TYPE_CHECKING:
+    from faq_bot import UserDataManager
+
+logger = logging.getLogger(__name__)
+
+ANY_SEDE = '*'
+
+# Clave de cola: (especialidad, sede, día ISO, media jornada 0=mañana 1=tarde)
+BucketKey = Tuple[str, str, str, int]
+
+
+class WaitlistIndex:
+    """Colas de prioridad de pacientes en espera, persistidas en la sección 'waitlist'"""
+
+    WAITING = 'waiting'
+    OFFERED = 'offered'
+
+    def __init__(self, storage: 'UserDataManager'):
+        self.storage = storage
+        # entry_id -> {'user_id', 'chat_id', 'specialty', 'sede', 'first_day', 'last_day',
+        #              'part', 'priority', 'seq', 'status', 'language', 'name'}
+        self.entries: Dict[str, Dict[str, Any]] = storage.get_section('waitlist')
+        # slot_id -> entry_id de la oferta pendiente
+        self.offers: Dict[str, str] = storage.get_section('waitlist_offers')
+        self._heaps: Dict[BucketKey, List[Tuple[int, int, str]]] = {}
+        # entry_id ofertado -> colas de las que _top ya sacó su elemento (None = todas)
+        self._evicted: Dict[str, Optional[Set[BucketKey]]] = {}
+        self.reload()
+        storage.add_reload_listener(self.reload)
+
+    def reload(self) -> None:
+        """Reconstruye las colas a partir de las entradas persistidas"""
+        self._heaps = {}
+        self._evicted = {}
+        last_seq = max((entry['seq'] for entry in self.entries.values()), default=0)
+        self._seq = itertools.count(last_seq + 1)
+        for entry_id, entry in self.entries.items():
+            if entry['status'] == self.WAITING:
+                self._push(entry_id, entry)
+            elif entry['status'] == self.OFFERED:
+                self._evicted[entry_id] = None
+
+    @staticmethod
+    def _days(entry: Dict[str, Any]) -> Iterator[str]:
+        day = date.fromisoformat(entry['first_day'])
+        last = date.fromisoformat(entry['last_day'])
+        while day <= last:
+            yield day.isoformat()
+            day += timedelta(days=1)
+
+    def _buckets(self, entry: Dict[str, Any]) -> Iterator[BucketKey]:
+        parts = (0, 1) if entry['part'] is None else (entry['part'],)
+        for day in self._days(entry):
+            for part in parts:
+                yield entry['specialty'], entry['sede'], day, part
+
+    def _push(self, entry_id: str, entry: Dict[str, Any], keys: Optional[Iterable[BucketKey]] = None) -> None:
+        item = (-entry['priority'], entry['seq'], entry_id)
+        for key in self._buckets(entry) if keys is None else keys:
+            heapq.heappush(self._heaps.setdefault(key, []), item)
+
+    def add(self, user_id: int, chat_id: int, specialty: str, sede: Optional[str],
+            first_day: date, last_day: date, part: Optional[int] = None,
+            priority: int = 0, save: bool = True, language: str = 'es', name: str = '') -> str:
+        """Agrega un paciente a la lista de espera y devuelve el id de la entrada.
+
+        El idioma y el nombre quedan en la entrada: con el pool, la oferta puede
+        enviarla un proceso que no tiene los datos de ese usuario.
+        """
+        if last_day < first_day:
+            raise ValueError("El último día debe ser posterior al primero")
+        seq = next(self._seq)
+        entry_id = f"w{seq}"
+        entry = {
+            'user_id': user_id,
+            'chat_id': chat_id,
+            'specialty': specialty,
+            'sede': sede or ANY_SEDE,
+            'first_day': first_day.isoformat(),
+            'last_day': last_day.isoformat(),
+            'part': part,
+            'priority': priority,
+            'seq': seq,
+            'status': self.WAITING,
+            'language': language,
+            'name': name
+        }
+        self.entries[entry_id] = entry
+        self._push(entry_id, entry)
+        if save:
+            self.storage.save_data()
+        return entry_id
+
+    def remove(self, entry_id: str, save: bool = True) -> bool:
+        """Elimina una entrada. Sus elementos en las colas se descartan al llegar a la cima"""
+        if self.entries.pop(entry_id, None) is None:
+            return False
+        self._evicted.pop(entry_id, None)
+        if save:
+            self.storage.save_data()
+        return True
+
+    def entries_for_user(self, user_id: int) -> List[str]:
+        return [entry_id for entry_id, entry in self.entries.items() if entry['user_id'] == user_id]
+
+    def retire(self, user_id: int, specialty: str) -> int:
+        """Retira al paciente de la lista de una especialidad (por ejemplo, porque ya reservó un turno)"""
+        retired = [entry_id for entry_id, entry in self.entries.items()
+                   if entry['user_id'] == user_id and entry['specialty'] == specialty]
+        for entry_id in retired:
+            self.remove(entry_id, save=False)
+        return len(retired)
+
+    def _top(self, key: BucketKey) -> Optional[Tuple[int, int, str]]:
+        heap = self._heaps.get(key)
+        while heap:
+            entry_id = heap[0][2]
+            entry = self.entries.get(entry_id)
+            if entry is not None and entry['status'] == self.WAITING:
+                return heap[0]
+            heapq.heappop(heap)
+            if entry is not None and entry['status'] == self.OFFERED:
+                # Si vuelve a la espera, solo hay que reponerlo en las colas de las que salió
+                evicted = self._evicted.setdefault(entry_id, set())
+                if evicted is not None:
+                    evicted.add(key)
+        if heap is not None:
+            del self._heaps[key]
+        return None
+
+    def match(self, slot: Dict[str, Any]) -> Optional[str]:
+        """Encuentra al mejor paciente en espera para un turno, sin modificar la lista"""
+        start = datetime.fromisoformat(slot['start'])
+        day, part = start.date().isoformat(), 0 if start.hour < 12 else 1
+        best = None
+        for sede in (slot['sede'], ANY_SEDE):
+            top = self._top((slot['specialty'], sede, day, part))
+            if top is not None and (best is None or top < best):
+                best = top
+        return best[2] if best else None
+
+    def claim(self, entry_id: str, slot_id: str) -> None:
+        """Marca una entrada como ofertada; deja de competir por otros turnos"""
+        self.entries[entry_id]['status'] = self.OFFERED
+        self.offers[slot_id] = entry_id
+
+    def unclaim(self, slot_id: str) -> Optional[str]:
+        """Devuelve a la lista de espera al paciente con la oferta pendiente de un turno"""
+        entry_id = self.offers.pop(slot_id, None)
+        entry = self.entries.get(entry_id) if entry_id else None
+        if entry is not None and entry['status'] == self.OFFERED:
+            entry['status'] = self.WAITING
+            # En las demás colas su elemento sigue ahí y vuelve a valer
+            self._push(entry_id, entry, self._evicted.pop(entry_id, set()))
+        return entry_id
+
+    def fulfil(self, slot_id: str) -> Optional[str]:
+        """Cierra la oferta aceptada de un turno y retira al paciente de la lista"""
+        entry_id = self.offers.pop(slot_id, None)
+        if entry_id:
+            self.entries.pop(entry_id, None)
+            self._evicted.pop(entry_id, None)
+        return entry_id
+
+    def purge_before(self, today: date) -> int:
+        """Elimina entradas cuyo rango ya pasó y las colas de días anteriores"""
+        today_text = today.isoformat()
+        expired = [entry_id for entry_id, entry in self.entries.items()
+                   if entry['last_day'] < today_text and entry['status'] == self.WAITING]
+        for entry_id in expired:
+            del self.entries[entry_id]
+        for entry_id in [entry_id for entry_id in self._evicted if entry_id not in self.entries]:
+            del self._evicted[entry_id]
+        for key in [key for key in self._heaps if key[2] < today_text]:
+            del self._heaps[key]
+        return len(expired)
@@ -0,0 +1,92 @@
+"""
+Instantánea de arranque en caliente
+-----------------------------------
+Persistencia de PTB que mantiene en memoria los estados del ConversationHandler
+y el context.user_data, y al apagar el bot (Application.shutdown → flush) los
+escribe de forma atómica en un JSON. En el siguiente arranque el bot retoma cada
+conversación donde quedó en vez de perder los menús abiertos.
+
+La instantánea se consume al cargarla: si el proceso muere sin un apagado
+ordenado no se restaura un estado viejo.
+"""
+import asyncio
+import json
+import logging
+import os
+import time
+from typing import Any, Dict, Optional
+
+from telegram.ext import DictPersistence, PersistenceInput
+
+logger = logging.getLogger(__name__)
+
+SNAPSHOT_VERSION = 1
+
+
+def write_atomic(path: str, data: bytes, sync: bool = True) -> None:
+    """Escribe en un temporal y lo reemplaza: el archivo nunca queda a medio escribir"""
+    directory = os.path.dirname(path)
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(data)
+        if sync:
+            f.flush()
+            os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class WarmStartPersistence(DictPersistence):
+    """DictPersistence que vuelca su contenido en un archivo al hacer flush"""
+
+    def __init__(self, path: str, snapshot: Optional[Dict[str, Any]] = None, update_interval: float = 60):
+        snapshot = snapshot or {}
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            user_data_json=snapshot.get('user_data', ''),
+            conversations_json=snapshot.get('conversations', ''),
+            update_interval=update_interval
+        )
+        self.path = path
+
+    @classmethod
+    def load(cls, path: str, max_age: float = 3600.0) -> 'WarmStartPersistence':
+        """Carga y consume la instantánea si existe y es reciente"""
+        snapshot = None
+        try:
+            if os.path.exists(path):
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+                os.remove(path)
+                age = time.time() - data.get('saved_at', 0)
+                if data.get('version') != SNAPSHOT_VERSION:
+                    logger.warning(f"Instantánea de arranque {path} con versión desconocida; se ignora")
+                elif age > max_age:
+                    logger.warning(f"Instantánea de arranque de hace {age:.0f}s; se ignora")
+                else:
+                    snapshot = data
+                    logger.info(f"Arranque en caliente desde {path} (guardada hace {age:.1f}s)")
+        except (OSError, ValueError) as e:
+            logger.error(f"Error al cargar la instantánea de arranque: {e}")
+        try:
+            return cls(path, snapshot)
+        except (TypeError, ValueError) as e:
+            logger.error(f"Instantánea de arranque inválida: {e}")
+            return cls(path)
+
+    def snapshot(self) -> bytes:
+        return json.dumps({
+            'version': SNAPSHOT_VERSION,
+            'saved_at': time.time(),
+            'user_data': self.user_data_json,
+            'conversations': self.conversations_json,
+        }).encode('utf-8')
+
+    async def flush(self) -> None:
+        try:
+            data = self.snapshot()
+            await asyncio.to_thread(write_atomic, self.path, data)
+            logger.info(f"Instantánea de arranque guardada en {self.path} ({len(data)} bytes)")
+        except Exception as e:
+            logger.error(f"Error al guardar la instantánea de arranque: {e}")
@@ -0,0 +1,162 @@
+"""
+Servidor HTTP asíncrono mínimo
+------------------------------
+Corre en el mismo bucle de eventos que el bot: si el bucle se bloquea, los
+health checks dejan de responder y Render reinicia el servicio. Cada conexión es
+una tarea, así que un cliente lento no bloquea al resto de las sondas.
+"""
+import asyncio
+import json
+import logging
+from http import HTTPStatus
+from typing import Any, Awaitable, Callable, Dict, Iterable, List, Optional, Tuple
+from urllib.parse import parse_qs, urlsplit
+
+logger = logging.getLogger(__name__)
+
+
+class HTTPRequest:
+    """Solicitud HTTP ya parseada"""
+
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes = b'',
+                 peer: Optional[Tuple[str, int]] = None):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path or '/'
+        self.query: Dict[str, List[str]] = parse_qs(url.query)
+        self.headers = headers
+        self.body = body
+        self.peer = peer
+
+    def query_param(self, name: str, default: Optional[str] = None) -> Optional[str]:
+        values = self.query.get(name)
+        return values[0] if values else default
+
+
+class HTTPResponse:
+    """Respuesta HTTP"""
+
+    def __init__(self, status: int = 200, body: bytes = b'', content_type: str = 'text/plain; charset=utf-8',
+                 headers: Optional[Dict[str, str]] = None):
+        self.status = status
+        self.body = body
+        self.content_type = content_type
+        self.headers = headers or {}
+
+    @classmethod
+    def json(cls, data: Any, status: int = 200) -> 'HTTPResponse':
+        return cls(status, json.dumps(data).encode('utf-8'), 'application/json')
+
+    @classmethod
+    def html(cls, text: str, status: int = 200) -> 'HTTPResponse':
+        return cls(status, text.encode('utf-8'), 'text/html; charset=utf-8')
+
+
+Handler = Callable[[HTTPRequest], Awaitable[HTTPResponse]]
+
+
+class AsyncHTTPServer:
+    """Servidor HTTP/1.1 sobre asyncio.start_server con rutas exactas y por prefijo"""
+
+    MAX_HEADER_BYTES = 64 * 1024
+
+    def __init__(self, host: str = '', port: int = 8080, read_timeout: float = 10.0,
+                 max_body: int = 1024 * 1024):
+        self.host = host
+        self.port = port
+        self.read_timeout = read_timeout
+        self.max_body = max_body
+        self._routes: Dict[str, Tuple[Handler, Tuple[str, ...]]] = {}
+        self._prefix_routes: List[Tuple[str, Handler, Tuple[str, ...]]] = []
+        self._server: Optional[asyncio.AbstractServer] = None
+
+    def route(self, path: str, handler: Handler, methods: Iterable[str] = ('GET', 'HEAD')) -> None:
+        """Registra un manejador para una ruta exacta"""
+        self._routes[path] = (handler, tuple(methods))
+
+    def route_prefix(self, prefix: str, handler: Handler, methods: Iterable[str] = ('GET', 'HEAD')) -> None:
+        """Registra un manejador para todas las rutas que empiezan por `prefix`"""
+        self._prefix_routes.append((prefix, handler, tuple(methods)))
+        # El prefijo más largo tiene prioridad
+        self._prefix_routes.sort(key=lambda route: len(route[0]), reverse=True)
+
+    def _resolve(self, path: str) -> Optional[Tuple[Handler, Tuple[str, ...]]]:
+        if path in self._routes:
+            return self._routes[path]
+        for prefix, handler, methods in self._prefix_routes:
+            if path.startswith(prefix):
+                return handler, methods
+        return None
+
+    async def start(self) -> None:
+        self._server = await asyncio.start_server(
+            self._handle_connection, self.host or None, self.port, limit=self.MAX_HEADER_BYTES
+        )
+        logger.info(f'Servidor HTTP asíncrono escuchando en puerto {self.port}')
+
+    async def stop(self) -> None:
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _read_request(self, reader: asyncio.StreamReader, peer) -> Optional[HTTPRequest]:
+        head = await asyncio.wait_for(reader.readuntil(b'\r\n\r\n'), self.read_timeout)
+        lines = head.decode('latin-1').split('\r\n')
+        parts = lines[0].split(' ')
+        if len(parts) != 3:
+            return None
+        headers = {}
+        for line in lines[1:]:
+            if ':' in line:
+                name, _, value = line.partition(':')
+                headers[name.strip().lower()] = value.strip()
+        length = int(headers.get('content-length', '0') or 0)
+        if length > self.max_body:
+            raise ValueError('cuerpo demasiado grande')
+        body = await asyncio.wait_for(reader.readexactly(length), self.read_timeout) if length else b''
+        return HTTPRequest(parts[0].upper(), parts[1], headers, body, peer)
+
+    async def _dispatch(self, request: HTTPRequest) -> HTTPResponse:
+        route = self._resolve(request.path)
+        if route is None:
+            return HTTPResponse(404, b'Not Found')
+        handler, methods = route
+        if request.method not in methods:
+            return HTTPResponse(405, b'Method Not Allowed', headers={'Allow': ', '.join(methods)})
+        try:
+            return await handler(request)
+        except Exception as e:
+            logger.error(f"Error en el manejador HTTP de {request.path}: {e}")
+            return HTTPResponse(500, b'Internal Server Error')
+
+    async def _handle_connection(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        try:
+            try:
+                request = await self._read_request(reader, peer)
+            except (asyncio.TimeoutError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+                request = None
+            if request is None:
+                response = HTTPResponse(400, b'Bad Request')
+                method = 'GET'
+            else:
+                response = await self._dispatch(request)
+                method = request.method
+
+            status = HTTPStatus(response.status)
+            head = [f"HTTP/1.1 {status.value} {status.phrase}",
+                    f"Content-Type: {response.content_type}",
+                    f"Content-Length: {len(response.body)}",
+                    "Connection: close"]
+            head.extend(f"{name}: {value}" for name, value in response.headers.items())
+            writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1'))
+            if method != 'HEAD':
+                writer.write(response.body)
+            await asyncio.wait_for(writer.drain(), self.read_timeout)
+        except (ConnectionError, asyncio.TimeoutError):
+            pass
+        except Exception as e:
+            logger.error(f"Error en la conexión HTTP con {peer}: {e}")
+        finally:
+            writer.close()
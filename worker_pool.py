@@ -0,0 +1,473 @@
+"""
+Pool de procesos del bot
+------------------------
+Con BOT_WORKERS > 1 el proceso de app.py deja de atender actualizaciones: hace un
+único getUpdates y las reparte por chat_id entre N procesos, cada uno con su
+propio ClinicBot. Todas las actualizaciones de un chat van siempre al mismo
+proceso y por la misma cola, así que se procesan en el orden en que llegaron.
+
+Almacenamiento:
+- Los datos de cada chat (usuarios, estados de conversación, mensajes del bot,
+  arranque en caliente) quedan en el archivo del proceso que atiende ese chat
+  (user_data.w0.pkl, user_data.w1.pkl...). En un chat privado el chat es el
+  usuario, así que cada usuario vive en un solo proceso.
+- El calendario, las reservas, la lista de espera y los recordatorios de citas
+  son de toda la clínica: se guardan en user_data.shared.pkl y se modifican
+  dentro de UserDataManager.shared(), que toma un candado de archivo entre
+  procesos y antes recarga lo que otro proceso haya escrito.
+- Las tareas periódicas sobre esas secciones (importar horarios, vencer
+  reservas, purgar la lista de espera, enviar recordatorios) corren solo en el
+  proceso 0.
+- Los anuncios (broadcast.py) también son compartidos: el frontal los crea y
+  cada proceso los envía a sus propios usuarios, repartiéndose BROADCAST_RATE.
+
+Al arrancar por primera vez en este modo, user_data.pkl se reparte en esos
+archivos (el original se conserva); si cambia BOT_WORKERS se vuelven a repartir.
+Al volver a BOT_WORKERS=1 se juntan de nuevo en user_data.pkl y se eliminan.
+"""
+import asyncio
+import logging
+import multiprocessing
+import os
+import pickle
+import queue
+import re
+import signal
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Dict, Iterator, List, Optional, Tuple
+
+from telegram.error import RetryAfter, TelegramError
+
+from broadcast import BroadcastManager
+from faq_bot import Config, UserDataManager
+from metrics import WORKER_QUEUE_DEPTH, WORKER_UPDATES, observe_api_call, record_error
+from monitoring import LivenessMonitor, TrackedHTTPXRequest
+from warm_start import write_atomic
+
+logger = logging.getLogger(__name__)
+
+# Secciones con claves de chat: se reparten entre los procesos. Las demás son compartidas
+CHAT_SECTIONS = {'bot_messages'}
+
+
+def shard_of(chat_id: Optional[int], workers: int) -> int:
+    """Proceso que atiende un chat"""
+    return chat_id % workers if chat_id is not None else 0
+
+
+def update_chat_id(data: Dict[str, Any]) -> Optional[int]:
+    """Chat de una actualización en crudo (o el usuario si no tiene chat)"""
+    for key in ('message', 'edited_message', 'channel_post', 'edited_channel_post'):
+        if key in data:
+            return data[key].get('chat', {}).get('id')
+    query = data.get('callback_query')
+    if query is not None:
+        chat = (query.get('message') or {}).get('chat', {}).get('id')
+        return chat if chat is not None else query.get('from', {}).get('id')
+    for key in ('my_chat_member', 'chat_member', 'chat_join_request'):
+        if key in data:
+            return data[key].get('chat', {}).get('id')
+    for key in ('inline_query', 'chosen_inline_result', 'shipping_query', 'pre_checkout_query'):
+        if key in data:
+            return data[key].get('from', {}).get('id')
+    return None
+
+
+def shard_path(path: str, suffix: str) -> str:
+    """user_data.pkl -> user_data.<suffix>.pkl"""
+    root, extension = os.path.splitext(path)
+    return f"{root}.{suffix}{extension}"
+
+
+def shard_files(path: str) -> Dict[int, str]:
+    """Archivos de procesos existentes para un archivo de datos: índice -> ruta"""
+    root, extension = os.path.splitext(path)
+    directory, base = os.path.split(root)
+    pattern = re.compile(re.escape(base) + r'\.w(\d+)' + re.escape(extension) + '$')
+    files = {}
+    for name in os.listdir(directory or '.'):
+        match = pattern.match(name)
+        if match:
+            files[int(match.group(1))] = os.path.join(directory, name)
+    return files
+
+
+def _merge_records(target: Dict[Any, Any], records: Dict[Any, Any]) -> None:
+    """Agrega registros por usuario sin que uno vacío reemplace a uno con datos"""
+    for key, value in records.items():
+        if value or not target.get(key):
+            target[key] = value
+
+
+def reshard_data(path: str, workers: int) -> bool:
+    """Reparte los datos entre `workers` archivos de proceso.
+
+    La primera vez parte de user_data.pkl (que se conserva); si cambió la
+    cantidad de procesos, vuelve a repartir los archivos existentes.
+    """
+    existing = shard_files(path)
+    if set(existing) == set(range(workers)):
+        return False
+    sources = list(existing.values()) or ([path] if os.path.exists(path) else [])
+    if not sources:
+        return False
+    shards = [{'user_data': {}, 'conversation_states': {}, 'sections': {name: {} for name in CHAT_SECTIONS}}
+              for _ in range(workers)]
+    shared = {}
+    for source in sources:
+        with open(source, 'rb') as f:
+            data = pickle.load(f)
+        for key in ('user_data', 'conversation_states'):
+            for user_id, value in data.get(key, {}).items():
+                _merge_records(shards[shard_of(user_id, workers)][key], {user_id: value})
+        for name, section in data.get('sections', {}).items():
+            if name not in CHAT_SECTIONS:
+                shared[name] = section
+                continue
+            for chat_id, value in section.items():
+                shards[shard_of(chat_id, workers)]['sections'][name][chat_id] = value
+    for index, shard in enumerate(shards):
+        write_atomic(shard_path(path, f"w{index}"), pickle.dumps(shard))
+    for index, stale in existing.items():
+        if index >= workers:
+            os.remove(stale)
+    shared_file = shard_path(path, 'shared')
+    if not os.path.exists(shared_file):
+        write_atomic(shared_file, pickle.dumps(shared))
+    logger.info(f"Datos repartidos entre {workers} procesos (antes {len(existing) or 1})")
+    return True
+
+
+def merge_shards(path: str) -> bool:
+    """Junta en user_data.pkl los archivos de un pool anterior y los elimina.
+
+    Sin esto, al volver a un solo proceso se cargaría el user_data.pkl de antes
+    del pool y se perderían los usuarios y reservas registrados desde entonces.
+    """
+    existing = shard_files(path)
+    shared_file = shard_path(path, 'shared')
+    if not existing:
+        return False
+    merged = {'user_data': {}, 'conversation_states': {}, 'sections': {}}
+    if os.path.exists(shared_file):
+        with open(shared_file, 'rb') as f:
+            merged['sections'].update(pickle.load(f))
+    for source in existing.values():
+        with open(source, 'rb') as f:
+            data = pickle.load(f)
+        for key in ('user_data', 'conversation_states'):
+            _merge_records(merged[key], data.get(key, {}))
+        for name, section in data.get('sections', {}).items():
+            merged['sections'].setdefault(name, {}).update(section)
+    write_atomic(path, pickle.dumps(merged), sync=True)
+    for source in list(existing.values()) + [shared_file]:
+        if os.path.exists(source):
+            os.remove(source)
+    logger.info(f"Datos de {len(existing)} procesos juntados en {path}")
+    return True
+
+
+class SharedUserDataManager(UserDataManager):
+    """UserDataManager de un proceso del pool: datos de sus chats más secciones compartidas"""
+
+    def __init__(self, shared_file: str):
+        self.shared_file = shared_file
+        self.lock_file = f"{shared_file}.lock"
+        # (inodo, mtime, tamaño) del archivo compartido cargado; os.replace cambia el inodo
+        self._shared_stamp: Optional[Tuple[int, int, int]] = None
+        self._depth = 0
+        self._shared_dirty = False
+        super().__init__()
+
+    def load_data(self) -> None:
+        super().load_data()
+        self._load_shared()
+
+    def _stamp(self) -> Optional[Tuple[int, int, int]]:
+        try:
+            stat = os.stat(self.shared_file)
+        except FileNotFoundError:
+            return None
+        return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+    def _load_shared(self) -> bool:
+        stamp = self._stamp()
+        if stamp is None or stamp == self._shared_stamp:
+            return False
+        try:
+            with open(self.shared_file, 'rb') as f:
+                data = pickle.load(f)
+        except Exception as e:
+            logger.error(f"Error al cargar datos compartidos: {e}")
+            record_error(e)
+            return False
+        # Se actualizan las mismas instancias: los componentes guardan referencias a sus secciones
+        for name, values in data.items():
+            section = self.get_section(name)
+            section.clear()
+            section.update(values)
+        self._shared_stamp = stamp
+        return True
+
+    def refresh(self) -> None:
+        if self._depth == 0 and self._load_shared():
+            for listener in self._reload_listeners:
+                listener()
+
+    @contextmanager
+    def shared(self) -> Iterator[None]:
+        if self._depth:
+            self._depth += 1
+            try:
+                yield
+            finally:
+                self._depth -= 1
+            return
+        # Solo existe en Unix; el modo de un solo proceso (que importa este módulo) también corre en Windows
+        import fcntl
+
+        with open(self.lock_file, 'a') as lock:
+            fcntl.flock(lock, fcntl.LOCK_EX)
+            try:
+                self.refresh()
+                self._depth = 1
+                try:
+                    yield
+                finally:
+                    self._depth = 0
+                    if self._shared_dirty:
+                        self._save_shared()
+            finally:
+                fcntl.flock(lock, fcntl.LOCK_UN)
+
+    def snapshot(self) -> Dict[str, Any]:
+        snapshot = super().snapshot()
+        snapshot['sections'] = {name: section for name, section in self.sections.items() if name in CHAT_SECTIONS}
+        return snapshot
+
+    def save_data(self, sync: bool = False) -> None:
+        # Las secciones compartidas se escriben al salir del bloque shared(), con el candado tomado
+        if self._depth:
+            self._shared_dirty = True
+        super().save_data(sync)
+
+    async def save_data_async(self) -> None:
+        # Marcar la sección compartida para que se escriba, con el candado, al salir del bloque
+        with self.shared():
+            self._shared_dirty = True
+        await super().save_data_async()
+
+    def _save_shared(self) -> None:
+        try:
+            data = pickle.dumps({name: section for name, section in self.sections.items()
+                                 if name not in CHAT_SECTIONS})
+            write_atomic(self.shared_file, data, sync=False)
+            self._shared_stamp = self._stamp()
+            self._shared_dirty = False
+        except Exception as e:
+            logger.error(f"Error al guardar datos compartidos: {e}")
+            record_error(e)
+
+
+class SharedSectionStore(SharedUserDataManager):
+    """Solo las secciones compartidas: lo que usa el proceso frontal, que no tiene usuarios"""
+
+    def load_data(self) -> None:
+        self._load_shared()
+
+    def save_data(self, sync: bool = False) -> None:
+        if self._depth:
+            self._shared_dirty = True
+
+
+def run_worker(index: int, workers: int, updates: 'multiprocessing.Queue', config: Dict[str, Any],
+               log_level: int = logging.INFO) -> None:
+    """Proceso del pool: un ClinicBot que recibe sus actualizaciones por `updates`"""
+    # El frontal decide cuándo parar (envía None); Ctrl+C llega a todo el grupo de procesos
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    signal.signal(signal.SIGTERM, signal.SIG_IGN)
+    logging.getLogger().setLevel(log_level)
+    for name, value in config.items():
+        setattr(Config, name, value)
+    suffix = f"w{index}"
+    shared_file = shard_path(Config.DATA_FILE, 'shared')
+    Config.DATA_FILE = shard_path(Config.DATA_FILE, suffix)
+    Config.WARM_START_FILE = shard_path(Config.WARM_START_FILE, suffix)
+    Config.TRACE_FILE = shard_path(Config.TRACE_FILE, suffix)
+    if Config.UPDATE_RECORD_FILE:
+        Config.UPDATE_RECORD_FILE = shard_path(Config.UPDATE_RECORD_FILE, suffix)
+    Config.RUN_SHARED_JOBS = index == 0
+    Config.WORKER_INDEX, Config.WORKERS = index, workers
+    Config.BROADCAST_RATE = Config.BROADCAST_RATE / workers
+    asyncio.run(_worker_main(index, updates, shared_file))
+
+
+async def _worker_main(index: int, updates: 'multiprocessing.Queue', shared_file: str) -> None:
+    from telegram import Update
+    from faq_bot import ClinicBot
+
+    bot = ClinicBot(SharedUserDataManager(shared_file))
+    application = bot.application
+    bot.liveness.mode = 'webhook'  # Este proceso no hace getUpdates
+    bot.liveness.start()
+    await application.initialize()
+    await application.start()
+    logger.info(f"Proceso {index} del pool iniciado (pid {os.getpid()})")
+
+    loop = asyncio.get_running_loop()
+    stopped = asyncio.Event()
+
+    def enqueue(data: Dict[str, Any]) -> None:
+        try:
+            application.update_queue.put_nowait(Update.de_json(data, application.bot))
+        except Exception as e:
+            logger.error(f"Actualización inválida en el proceso {index}: {e}")
+            record_error(e)
+
+    def receive() -> None:
+        # Un hilo bloqueado en la cola; el bucle recibe las actualizaciones en el mismo orden
+        parent = multiprocessing.parent_process()
+        while True:
+            try:
+                data = updates.get(timeout=1.0)
+            except queue.Empty:
+                if parent is not None and not parent.is_alive():
+                    break
+                continue
+            if data is None:
+                break
+            loop.call_soon_threadsafe(enqueue, data)
+        loop.call_soon_threadsafe(stopped.set)
+
+    threading.Thread(target=receive, name=f'pool-receive-{index}', daemon=True).start()
+    await stopped.wait()
+    await bot.shutdown()
+
+
+class WorkerPool:
+    """Proceso frontal: un único getUpdates y reparto por chat_id a `workers` procesos"""
+
+    def __init__(self, workers: int, poll_timeout: int = 10, max_queued: int = 10000):
+        self.workers = workers
+        self.poll_timeout = poll_timeout
+        self.max_queued = max_queued
+        self.liveness = LivenessMonitor()
+        self.request = TrackedHTTPXRequest(
+            connection_pool_size=1, read_timeout=poll_timeout + 10,
+            on_api_call=[self.liveness.record_api_call, observe_api_call]
+        )
+        self.url = f"{Config.API_BASE_URL}{Config.TOKEN}/getUpdates"
+        self.offset: Optional[int] = None
+        self.queues: List[Any] = []
+        self.processes: List[multiprocessing.Process] = []
+        self.broadcasts: Optional[BroadcastManager] = None
+        self._poll_task: Optional[asyncio.Task] = None
+
+    async def start(self) -> None:
+        if not Config.TOKEN:
+            raise ValueError("No se ha configurado el token de Telegram. Revise el archivo .env")
+        reshard_data(Config.DATA_FILE, self.workers)
+        store = SharedSectionStore(shard_path(Config.DATA_FILE, 'shared'))
+        self.broadcasts = BroadcastManager(store, workers=self.workers)
+        context = multiprocessing.get_context('spawn')
+        config = {name: value for name, value in vars(Config).items()
+                  if name.isupper() and isinstance(value, (str, int, float, bool, type(None)))}
+        for index in range(self.workers):
+            updates = context.Queue(maxsize=self.max_queued)
+            process = context.Process(target=run_worker,
+                                      args=(index, self.workers, updates, config, logging.getLogger().level),
+                                      name=f'clinicbot-w{index}', daemon=True)
+            process.start()
+            self.queues.append(updates)
+            self.processes.append(process)
+            WORKER_QUEUE_DEPTH.labels(str(index)).set_function(updates.qsize)
+        await self.request.initialize()
+        self.liveness.start()
+        self._poll_task = asyncio.get_running_loop().create_task(self._poll())
+        logger.info(f"Pool de {self.workers} procesos iniciado")
+
+    async def _get_updates(self, timeout: int) -> List[Dict[str, Any]]:
+        url = f"{self.url}?timeout={timeout}"
+        if self.offset is not None:
+            url += f"&offset={self.offset}"
+        return await self.request.post(url, read_timeout=timeout + 10)
+
+    async def _poll(self) -> None:
+        delay = 1.0
+        while True:
+            try:
+                results = await self._get_updates(self.poll_timeout)
+                delay = 1.0
+            except RetryAfter as e:
+                await asyncio.sleep(float(e.retry_after))
+                continue
+            except TelegramError as e:
+                logger.warning(f"Error en getUpdates, se reintenta en {delay:.0f}s: {e}")
+                await asyncio.sleep(delay)
+                delay = min(delay * 2, 30.0)
+                continue
+            for data in results:
+                await self.dispatch(data)
+                self.offset = data['update_id'] + 1
+
+    async def dispatch(self, data: Dict[str, Any]) -> None:
+        """Encola una actualización en crudo en el proceso de su chat (también sirve para un webhook)"""
+        index = shard_of(update_chat_id(data), self.workers)
+        self.liveness.record_update()
+        while True:
+            try:
+                self.queues[index].put_nowait(data)
+                break
+            except queue.Full:
+                # El proceso va atrasado: se frena la lectura en vez de acumular sin límite
+                await asyncio.sleep(0.01)
+        WORKER_UPDATES.labels(str(index)).inc()
+
+    @staticmethod
+    async def _send_stop(updates: Any, timeout: float) -> None:
+        try:
+            updates.put_nowait(None)
+        except queue.Full:
+            try:
+                await asyncio.to_thread(updates.put, None, True, timeout)
+            except queue.Full:
+                pass  # Si no lo recibe a tiempo, el join vence y el proceso se termina
+
+    def failure(self) -> str:
+        """Motivo por el que el pool debe reiniciarse, o cadena vacía si está sano"""
+        if any(not process.is_alive() for process in self.processes):
+            return 'worker_exited'
+        if self._poll_task is None or self._poll_task.done():
+            return 'poller_stopped'
+        return ''
+
+    async def shutdown(self, timeout: float = Config.SHUTDOWN_TIMEOUT) -> None:
+        """Deja de pedir actualizaciones, confirma las recibidas y espera que cada proceso drene y guarde"""
+        deadline = time.monotonic() + timeout
+        if self._poll_task is not None:
+            self._poll_task.cancel()
+            try:
+                await self._poll_task
+            except (asyncio.CancelledError, Exception):
+                pass
+            self._poll_task = None
+            # Confirmar a Telegram lo ya repartido para no recibirlo de nuevo al reiniciar
+            if self.offset is not None:
+                try:
+                    await self._get_updates(0)
+                except TelegramError as e:
+                    logger.warning(f"No se pudo confirmar el último getUpdates: {e}")
+        # Aviso de fin a cada proceso; con una cola llena la espera corre en un hilo, no en el bucle
+        await asyncio.gather(*(self._send_stop(updates, max(0.1, deadline - time.monotonic()))
+                               for updates in self.queues))
+        for process in self.processes:
+            await asyncio.to_thread(process.join, max(0.1, deadline - time.monotonic()))
+            if process.is_alive():
+                logger.warning(f"{process.name} no terminó a tiempo; se detiene")
+                process.terminate()
+        await self.request.shutdown()
+        self.liveness.stop()
+        self.queues, self.processes = [], []
+        logger.info("Pool de procesos detenido")